@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+Compare memory of log dumps kept as list of dicts and as Columns.
+
+Usage:
+    python benchmarks/columnar.py [--rows 1000000] [--log postfix]
+
+Log lines of the mock server are encoded as JSON and decoded by
+`iter_json`, like `streamRequest` does. Reports the memory retained
+by the result, the peak while building it and the time it took.
+'''
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from os import path
+
+HERE = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.join(path.dirname(HERE), 'src'))
+sys.path.insert(0, HERE)
+
+# pylint: disable=wrong-import-position
+from mailcow.columns import Columns  # noqa: E402
+from mailcow.utils import iter_json  # noqa: E402
+from mock_server import Dataset  # noqa: E402
+
+CHUNK = 2 ** 16
+
+
+def chunks(log, rows, mailboxes):
+    '''Yield JSON encoded log `log` of `rows` lines in chunks'''
+    dataset = Dataset(mailboxes, 0, 1)
+    now = 1600000000
+    buffer = ['[']
+
+    for i in range(rows):
+        record = json.dumps(dataset.log(log, i, now))
+        buffer.append(f',{record}' if i else record)
+        if len(buffer) > 256:
+            yield ''.join(buffer).encode()
+            buffer = []
+
+    buffer.append(']')
+    yield ''.join(buffer).encode()
+
+
+def measure(container, log, rows, mailboxes):
+    '''Retained and peak memory in MiB and seconds to build `container`'''
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = container(iter_json(chunks(log, rows, mailboxes)))
+    seconds = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(data) == rows
+    return {'retained_mb': retained / 2 ** 20, 'peak_mb': peak / 2 ** 20,
+            'seconds': seconds}
+
+
+def main():
+    '''Print memory of both containers'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--log', default='postfix',
+                        choices=['postfix', 'dovecot', 'api'])
+    parser.add_argument('--mailboxes', type=int, default=10000)
+    args = parser.parse_args()
+
+    results = {name: measure(container, args.log, args.rows, args.mailboxes)
+               for name, container in [('list', list), ('columns', Columns)]}
+
+    for name, result in results.items():
+        print(f'{name:8} retained {result["retained_mb"]:8.1f} MiB  '
+              f'peak {result["peak_mb"]:8.1f} MiB  '
+              f'{result["seconds"]:6.1f} s')
+
+    saved = 1 - results['columns']['retained_mb'] / \
+        results['list']['retained_mb']
+    print(f'columns retain {saved:.0%} less memory '
+          f'for {args.rows} {args.log} log lines')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+Guard the import time of the bare CLI.
+
+Usage:
+    python benchmarks/importtime.py [budget in ms]
+
+Runs `python -X importtime -c "import mailcow.cli"` and fails if the
+cumulative import time exceeds the budget or heavy modules get imported.
+'''
+
+import os
+import subprocess
+import sys
+
+MODULE = 'mailcow.cli'
+BUDGET = 50
+FORBIDDEN = ['requests', 'urllib3', 'yaml', 'prettytable']
+
+
+def importtime(module):
+    '''Return {module: cumulative microseconds} of a fresh interpreter'''
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stderr=subprocess.PIPE, universal_newlines=True, env=env,
+        check=True)
+    times = dict()
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def main():
+    '''Exit non-zero if import time regressed'''
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET
+    # best of three to keep a busy machine from failing the check
+    runs = [importtime(MODULE) for _ in range(3)]
+    times = min(runs, key=lambda run: run[MODULE])
+    elapsed = times[MODULE] / 1000
+    errors = []
+
+    heavy = {name.split('.')[0] for name in times} & set(FORBIDDEN)
+    if heavy:
+        errors.append(f'heavy modules imported: {", ".join(sorted(heavy))}')
+    if elapsed > budget:
+        errors.append(f'{MODULE} took {elapsed:.1f} ms, budget {budget} ms')
+
+    print(f'import {MODULE}: {elapsed:.1f} ms (budget {budget} ms)')
+    for error in errors:
+        print(f'FAIL: {error}')
+
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
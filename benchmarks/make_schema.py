@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+Write the synthetic OpenApi schema served by the mock server.
+
+Usage:
+    python benchmarks/make_schema.py [benchmarks/data/openapi.yaml]
+
+The schema follows the layout of mailcow's `/api/openapi.yaml`
+(sections, modifiers, path parameters and request bodies) so building
+endpoints from it costs about the same. A recorded schema can replace
+it: `curl https://mail.example.com/api/openapi.yaml > openapi.yaml`
+'''
+
+import sys
+import yaml
+
+STRING, NUMBER, BOOLEAN, ARRAY = 'string', 'number', 'boolean', 'array'
+
+SECTIONS = {
+    'alias': {
+        'active': BOOLEAN, 'address': STRING, 'goto': STRING,
+        'goto_null': BOOLEAN, 'goto_spam': BOOLEAN, 'goto_ham': BOOLEAN,
+        'sogo_visible': BOOLEAN},
+    'app-passwd': {
+        'active': BOOLEAN, 'username': STRING, 'app_name': STRING,
+        'app_passwd': STRING, 'app_passwd2': STRING, 'protocols': ARRAY},
+    'bcc': {
+        'active': BOOLEAN, 'bcc_dest': STRING, 'local_dest': STRING,
+        'type': STRING},
+    'dkim': {
+        'dkim_selector': STRING, 'domains': STRING, 'key_size': NUMBER},
+    'dkim_duplicate': {'from_domain': STRING, 'to_domain': STRING},
+    'domain': {
+        'active': BOOLEAN, 'aliases': NUMBER, 'backupmx': BOOLEAN,
+        'defquota': NUMBER, 'description': STRING, 'domain': STRING,
+        'mailboxes': NUMBER, 'maxquota': NUMBER, 'quota': NUMBER,
+        'relay_all_recipients': BOOLEAN, 'rl_frame': STRING,
+        'rl_value': NUMBER, 'restart_sogo': NUMBER, 'tags': ARRAY},
+    'domain-admin': {
+        'active': BOOLEAN, 'domains': STRING, 'password': STRING,
+        'password2': STRING, 'username': STRING},
+    'da-acl': {'da_acl': ARRAY},
+    'domain-policy': {
+        'domain': STRING, 'object_from': STRING, 'object_list': STRING},
+    'fwdhost': {'filter_spam': BOOLEAN, 'hostname': STRING},
+    'mailbox': {
+        'active': BOOLEAN, 'domain': STRING, 'force_pw_update': BOOLEAN,
+        'local_part': STRING, 'name': STRING, 'pasword': STRING,
+        'password2': STRING, 'quota': NUMBER, 'sogo_access': BOOLEAN,
+        'tls_enforce_in': BOOLEAN, 'tls_enforce_out': BOOLEAN,
+        'tags': ARRAY},
+    'oauth2-client': {'redirect_uri': STRING},
+    'recipient_map': {
+        'active': BOOLEAN, 'recipient_map_new': STRING,
+        'recipient_map_old': STRING},
+    'relayhost': {'hostname': STRING, 'password': STRING,
+                  'username': STRING},
+    'resource': {
+        'active': BOOLEAN, 'description': STRING, 'domain': STRING,
+        'kind': STRING, 'multiple_bookings_custom': NUMBER,
+        'multiple_bookings_select': NUMBER},
+    'syncjob': {
+        'active': BOOLEAN, 'custom_params': STRING, 'delete1': BOOLEAN,
+        'delete2': BOOLEAN, 'delete2duplicates': BOOLEAN, 'enc1': STRING,
+        'exclude': STRING, 'host1': STRING, 'maxage': NUMBER,
+        'maxbytespersecond': NUMBER, 'mins_interval': NUMBER,
+        'password1': STRING, 'port1': STRING, 'subfolder2': STRING,
+        'timeout1': NUMBER, 'timeout2': NUMBER, 'user1': STRING,
+        'username': STRING},
+    'tls-policy-map': {
+        'active': BOOLEAN, 'dest': STRING, 'parameters': STRING,
+        'policy': STRING},
+    'transport': {
+        'active': BOOLEAN, 'destination': STRING, 'nexthop': STRING,
+        'password': STRING, 'username': STRING},
+    'user-acl': {'user_acl': ARRAY},
+    'pushover': {
+        'active': BOOLEAN, 'evaluate_x_prio': BOOLEAN, 'key': STRING,
+        'only_x_prio': BOOLEAN, 'senders': STRING,
+        'senders_regex': STRING, 'text': STRING, 'title': STRING,
+        'token': STRING},
+    'quarantine_notification': {'quarantine_notification': STRING},
+    'fail2ban': {
+        'ban_time': NUMBER, 'blacklist': STRING, 'max_attempts': NUMBER,
+        'netban_ipv4': NUMBER, 'netban_ipv6': NUMBER,
+        'retry_window': NUMBER, 'whitelist': STRING},
+    'rl-mbox': {'rl_frame': STRING, 'rl_value': NUMBER},
+    'rl-domain': {'rl_frame': STRING, 'rl_value': NUMBER},
+    'spam-score': {'spam_score': STRING},
+    'qitem': {'qid': STRING},
+    'mailq': {'action': STRING},
+}
+# sections only supporting a subset of modifiers
+ADD_ONLY = ['dkim_duplicate']
+EDIT_ONLY = ['da-acl', 'user-acl', 'pushover', 'quarantine_notification',
+             'fail2ban', 'rl-mbox', 'rl-domain', 'spam-score', 'mailq']
+NO_ADD = ['qitem']
+GET = {
+    'alias': '{id}', 'app-passwd': 'all/{mailbox}', 'bcc': '{id}',
+    'dkim': '{domain}', 'domain': '{id}', 'domain-admin': 'all',
+    'fwdhost': 'all', 'mailbox': '{id}', 'oauth2-client': '{id}',
+    'recipient_map': '{id}', 'relayhost': '{id}', 'resource': 'all',
+    'syncjobs': 'all/no_log', 'tls-policy-map': '{id}',
+    'transport': '{id}', 'fail2ban': '', 'mailq': 'all',
+    'quarantine': 'all', 'rl-mbox': '{mailbox}', 'rl-domain': '{domain}',
+    'status/containers': '', 'status/version': '',
+    'status/vmail': '', 'policy_bl_domain': '{domain}',
+    'policy_wl_domain': '{domain}', 'logs/acme': '{count}',
+    'logs/api': '{count}', 'logs/autodiscover': '{count}',
+    'logs/dovecot': '{count}', 'logs/netfilter': '{count}',
+    'logs/postfix': '{count}', 'logs/ratelimited': '{count}',
+    'logs/rspamd-history': '{count}', 'logs/sogo': '{count}',
+    'logs/watchdog': '{count}', 'spam-score': '{mailbox}'}
+EXAMPLE = {STRING: 'example', NUMBER: 10, BOOLEAN: True, ARRAY: []}
+
+
+def properties(props):
+    '''Return OpenApi properties of `props`'''
+    return {
+        name: {'description': f'{name.replace("_", " ")} of the object',
+               'example': EXAMPLE[kind], 'type': kind}
+        for name, kind in props.items()}
+
+
+def body(schema):
+    '''Return a POST with JSON body `schema`'''
+    return {'post': {
+        'requestBody': {'content': {'application/json': {
+            'schema': schema}}},
+        'responses': {
+            '200': {'description': 'OK',
+                    'content': {'application/json': {'schema': {
+                        'type': 'array',
+                        'items': {'type': 'object'}}}}},
+            '401': {'$ref': '#/components/responses/Unauthorized'}},
+        'summary': 'Modify object',
+        'tags': ['API']}}
+
+
+def get(parameters):
+    '''Return a GET with path `parameters`'''
+    return {'get': {
+        'parameters': [
+            {'description': f'{name} of the object or all', 'in': 'path',
+             'name': name, 'required': True,
+             'schema': {'type': 'number' if name == 'count'
+                        else 'string'}}
+            for name in parameters] + [
+            {'description': 'e.g. api-key-string', 'in': 'header',
+             'name': 'X-API-Key', 'required': False,
+             'schema': {'type': 'string'}}],
+        'responses': {
+            '200': {'description': 'OK'},
+            '401': {'$ref': '#/components/responses/Unauthorized'}},
+        'summary': 'Get objects',
+        'tags': ['API']}}
+
+
+def schema():
+    '''Return synthetic mailcow schema'''
+    paths = dict()
+
+    for section, props in SECTIONS.items():
+        if section not in EDIT_ONLY + NO_ADD:
+            paths[f'/api/v1/add/{section}'] = body({
+                'type': 'object', 'properties': properties(props)})
+        if section not in ADD_ONLY:
+            paths[f'/api/v1/edit/{section}'] = body({
+                'type': 'object', 'properties': {
+                    'attr': {'type': 'object',
+                             'properties': properties(props)},
+                    'items': {'description': 'contains list of objects',
+                              'type': 'array'}}})
+        if section not in EDIT_ONLY + ADD_ONLY:
+            paths[f'/api/v1/delete/{section}'] = body({
+                'type': 'array', 'items': {'type': 'string'}})
+
+    for section, suffix in GET.items():
+        path = '/'.join(filter(None, ['/api/v1/get', section, suffix]))
+        paths[path] = get(
+            [part[1:-1] for part in suffix.split('/') if '{' in part])
+
+    return {
+        'openapi': '3.0.0',
+        'info': {'title': 'mailcow API', 'version': '1.0.0'},
+        'servers': [{'url': '/'}],
+        'components': {
+            'responses': {'Unauthorized': {
+                'description': 'Unauthorized',
+                'content': {'application/json': {'schema': {
+                    'type': 'object',
+                    'properties': {'type': {'type': 'string'},
+                                   'msg': {'type': 'string'}}}}}}},
+            'securitySchemes': {'ApiKeyAuth': {
+                'type': 'apiKey', 'in': 'header', 'name': 'X-API-Key'}}},
+        'security': [{'ApiKeyAuth': []}],
+        'paths': paths}
+
+
+def main():
+    '''Write schema'''
+    target = sys.argv[1] if len(sys.argv) > 1 \
+        else 'benchmarks/data/openapi.yaml'
+
+    with open(target, 'w') as schemafile:
+        yaml.safe_dump(schema(), schemafile, sort_keys=False)
+
+
+if __name__ == '__main__':
+    main()
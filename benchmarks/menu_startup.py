@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+Compare eager and lazy construction of the CLI menu.
+
+Usage:
+    python benchmarks/menu_startup.py [endpoints.json]
+
+Without argument a synthetic index resembling mailcow's schema is used.
+A compiled index can be found in `~/.cache/python-mailcow/<server>/`.
+'''
+
+import json
+import sys
+import timeit
+from mailcow.menu import menu
+
+TYPES = ['string', 'number', 'boolean', 'array']
+ARGV = ['mailcow', 'alias', 'get', '--all']
+
+
+def synthetic_endpoints(sections=40, modifiers=4, arguments=20):
+    '''Return endpoints of a schema with given dimensions'''
+    endpoints = {}
+
+    for section in [f'section{i}' for i in range(sections - 1)] + ['alias']:
+        endpoints[section] = {}
+        for modifier in ['add', 'edit', 'delete', 'get'][:modifiers]:
+            endpoints[section][modifier] = {
+                f'argument{i}': {
+                    'description': f'argument {i} of {section}',
+                    'type': TYPES[i % len(TYPES)]}
+                for i in range(arguments)}
+        endpoints[section]['get']['all'] = {
+            'description': 'get all entries', 'type': 'bool'}
+
+    return endpoints
+
+
+def measure(endpoints, lazy, number=20):
+    '''Return seconds per menu build'''
+    # build_argument normalizes endpoints in place, warm them up first
+    menu(endpoints, lazy=False)
+    best = min(timeit.repeat(
+        lambda: menu(endpoints, lazy=lazy), number=number, repeat=5))
+
+    return best / number
+
+
+def main():
+    '''Print eager vs. lazy menu build times'''
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as index:
+            endpoints = json.load(index)['endpoints']
+    else:
+        endpoints = synthetic_endpoints()
+
+    sys.argv = ARGV
+    eager = measure(endpoints, lazy=False)
+    lazy = measure(endpoints, lazy=True)
+
+    print(f'argv: {" ".join(ARGV)}')
+    print(f'eager menu: {eager * 1000:8.2f} ms')
+    print(f'lazy menu:  {lazy * 1000:8.2f} ms ({eager / lazy:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
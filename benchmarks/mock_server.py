@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+Local mock of mailcow's API serving synthetic datasets.
+
+Usage:
+    python benchmarks/mock_server.py [--port 8080] [--mailboxes 10000]
+
+The first line written to stdout is the URL the server listens on.
+`/api/openapi.yaml` is served with an ETag and answers conditional
+requests with 304. GET results are generated on first request and
+kept encoded, so repeated requests measure the client only.
+add, edit and delete report success for every item. With `--capacity`
+API requests beyond that many in flight are answered with 429.
+'''
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+
+SCHEMA = path.join(path.dirname(__file__), 'data', 'openapi.yaml')
+
+
+class Dataset:
+    '''Deterministic records of a mailcow instance'''
+    def __init__(self, mailboxes, aliases, domains, seed=0):
+        self.mailboxes = mailboxes
+        self.aliases = aliases
+        self.domains = max(1, domains)
+        self.seed = seed
+
+    def domain(self, i):
+        '''Return domain record `i`'''
+        return {
+            'domain_name': f'domain{i}.example.org', 'active': 1,
+            'description': f'Domain {i}', 'max_quota_for_domain': 10 ** 11,
+            'mboxes_in_domain': self.mailboxes // self.domains,
+            'quota_used_in_domain': str(i * 7919 % 10 ** 9),
+            'backupmx': 0, 'relay_all_recipients': 0, 'tags': []}
+
+    def mailbox(self, i):
+        '''Return mailbox record `i`'''
+        rand = random.Random(self.seed + i)
+        domain = f'domain{i % self.domains}.example.org'
+        return {
+            'username': f'user{i}@{domain}', 'local_part': f'user{i}',
+            'domain': domain, 'name': f'User {i}', 'active': rand.choice(
+                [0, 1, 1, 1]),
+            'quota': 10 ** 9, 'quota_used': rand.randrange(10 ** 9),
+            'percent_in_use': rand.randrange(100),
+            'messages': rand.randrange(10 ** 5),
+            'last_imap_login': 1600000000 + rand.randrange(10 ** 7),
+            'attributes': {
+                'force_pw_update': str(rand.randrange(2)),
+                'tls_enforce_in': '0', 'tls_enforce_out': '0',
+                'sogo_access': '1', 'mailbox_format': 'maildir:'},
+            'tags': rand.sample(['staff', 'sales', 'it', 'ops'], 1)}
+
+    def alias(self, i):
+        '''Return alias record `i`'''
+        domain = f'domain{i % self.domains}.example.org'
+        return {
+            'id': i, 'address': f'alias{i}@{domain}',
+            'goto': f'user{i % max(1, self.mailboxes)}@{domain}',
+            'domain': domain, 'active': 1, 'sogo_visible': 1,
+            'created': '2021-01-01 00:00:00',
+            'modified': '2021-06-01 00:00:00'}
+
+    def log(self, kind, i, now):
+        '''Return log line `i` of log `kind`'''
+        rand = random.Random(self.seed + i)
+        user = f'user{rand.randrange(max(1, self.mailboxes))}'
+        if kind == 'api':
+            return {'time': now - i, 'uri': f'/api/v1/get/mailbox/{user}',
+                    'method': 'GET', 'remote': f'10.0.{i % 256}.1',
+                    'data': ''}
+        return {'time': now - i, 'priority': 'info',
+                'program': f'{kind}', 'message':
+                f'{user}: message {i:x} delivered in {rand.random():.3f}s'}
+
+    def get(self, section, parameters):
+        '''Return result of GET `section` or None if unknown'''
+        key = parameters[0] if parameters else None
+        if section == 'mailbox':
+            if key == 'all':
+                return [self.mailbox(i) for i in range(self.mailboxes)]
+            local_part = key.split('@')[0]
+            return self.mailbox(int(local_part[len('user'):] or 0))
+        if section == 'alias':
+            if key == 'all':
+                return [self.alias(i) for i in range(self.aliases)]
+            return self.alias(int(key))
+        if section == 'domain':
+            if key == 'all':
+                return [self.domain(i) for i in range(self.domains)]
+            return self.domain(0)
+        if section == 'logs':
+            now = int(time.time())
+            return [self.log(key, i, now)
+                    for i in range(int(parameters[1]))]
+        if section in ['rl-mbox', 'rl-domain']:
+            return [{'frame': 'h', 'value': '100', section.split('-')[1]:
+                     key}]
+        if section == 'status':
+            return {'version': '2021-01'}
+
+        return []
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''Answer mailcow API requests from `server.dataset`'''
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def reply(self, status, body, content_type='application/json',
+              headers=None):
+        '''Send `body` with keep alive'''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def admit(self):
+        '''
+        Count request in flight, False if more than `server.capacity`
+        are. Requests that aren't admitted are answered with 429.
+        '''
+        server = self.server
+        with server.lock:
+            if server.capacity and server.inflight >= server.capacity:
+                server.rejected += 1
+                self.reply(429, json.dumps(
+                    {'type': 'error', 'msg': 'rate limit exceeded'}).encode())
+                return False
+            server.inflight += 1
+
+        return True
+
+    def done(self):
+        '''Count request as finished'''
+        with self.server.lock:
+            self.server.inflight -= 1
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''Serve schema and GET results'''
+        if self.path == '/api/openapi.yaml':
+            return self.get()
+        if self.admit():
+            try:
+                self.get()
+            finally:
+                self.done()
+        return None
+
+    def get(self):
+        '''Answer GET request after `server.latency`'''
+        server = self.server
+        time.sleep(server.latency)
+
+        if self.path == '/api/openapi.yaml':
+            if self.headers.get('If-None-Match') == server.etag:
+                return self.reply(304, b'', headers={'ETag': server.etag})
+            return self.reply(200, server.schema, 'application/x-yaml',
+                              {'ETag': server.etag})
+
+        parts = self.path.split('/')[4:]
+        if self.path not in server.responses:
+            data = server.dataset.get(parts[0], parts[1:])
+            server.responses[self.path] = json.dumps(data).encode()
+
+        return self.reply(200, server.responses[self.path])
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        '''Report success for every item of add, edit and delete'''
+        if self.admit():
+            try:
+                self.post()
+            finally:
+                self.done()
+
+    def post(self):
+        '''Answer POST request after `server.latency`'''
+        time.sleep(self.server.latency)
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length) or b'null')
+        items = data if isinstance(data, list) else \
+            (data or {}).get('items') or [None]
+        action = self.path.split('/')[3]
+
+        return self.reply(200, json.dumps([
+            {'type': 'success', 'log': [action], 'msg': [action, item]}
+            for item in items]).encode())
+
+
+class MockServer(ThreadingHTTPServer):
+    '''HTTP server holding schema and dataset'''
+    daemon_threads = True
+
+    def __init__(self, address, dataset, schema=SCHEMA, latency=0.0,
+                 capacity=0):
+        super().__init__(address, Handler)
+        with open(schema, 'rb') as schemafile:
+            self.schema = schemafile.read()
+        self.etag = f'"{hashlib.sha1(self.schema).hexdigest()}"'
+        self.dataset = dataset
+        self.latency = latency
+        self.responses = dict()
+        self.capacity = capacity
+        self.inflight = self.rejected = 0
+        self.lock = threading.Lock()
+
+
+def main():
+    '''Run mock server until interrupted'''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=8080,
+                        help='0 picks a free port')
+    parser.add_argument('--mailboxes', type=int, default=10000)
+    parser.add_argument('--aliases', type=int, default=10000)
+    parser.add_argument('--domains', type=int, default=50)
+    parser.add_argument('--schema', default=SCHEMA)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every request')
+    parser.add_argument('--capacity', type=int, default=0,
+                        help='Requests in flight before answering 429, '
+                        '0 for no limit')
+    args = parser.parse_args()
+
+    server = MockServer(
+        ('127.0.0.1', args.port),
+        Dataset(args.mailboxes, args.aliases, args.domains),
+        args.schema, args.latency, args.capacity)
+    print(f'http://127.0.0.1:{server.server_address[1]}', flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+Benchmark python-mailcow against the local mock server.
+
+Usage:
+    python benchmarks/suite.py [--mailboxes 10000] [--logs 100000]
+                               [--output FILE] [--compare OLD.json]
+
+Measures CLI cold and warm start, building endpoints from the schema,
+single request latency, bulk throughput, time and memory of the
+formatters on mailboxes, aliases and log lines, a report over the
+log lines streamed and listed and the throughput against a server
+answering 429 beyond `--capacity` requests.
+Results are written as JSON, by default to
+`benchmarks/results/<version>.json`, so releases can be compared
+with `--compare`.
+'''
+
+import argparse
+import copy
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from os import path
+
+HERE = path.dirname(path.abspath(__file__))
+SRC = path.join(path.dirname(HERE), 'src')
+sys.path.insert(0, SRC)
+
+# pylint: disable=wrong-import-position
+from mailcow import MailCow  # noqa: E402
+from mailcow.output import write_table  # noqa: E402
+from mailcow.report import Report  # noqa: E402
+from mailcow.utils import getOpenApiEndpoints  # noqa: E402
+
+
+def version():
+    '''Return version of the benchmarked package'''
+    try:
+        from importlib.metadata import version as package_version
+        return package_version('python-mailcow')
+    except Exception:  # pylint: disable=broad-except
+        return 'dev'
+
+
+def summary(samples):
+    '''Return statistics of `samples` in milliseconds'''
+    samples = sorted(sample * 1000 for sample in samples)
+
+    return {
+        'n': len(samples),
+        'min_ms': samples[0],
+        'median_ms': statistics.median(samples),
+        'p95_ms': samples[min(len(samples) - 1,
+                              int(len(samples) * 0.95))],
+        'max_ms': samples[-1]}
+
+
+def timed(func, *args, **kwargs):
+    '''Return seconds `func` took'''
+    start = time.perf_counter()
+    func(*args, **kwargs)
+
+    return time.perf_counter() - start
+
+
+class Environment:
+    '''Mock server and a config pointing to it'''
+    def __init__(self, args, capacity=0):
+        self.directory = tempfile.mkdtemp(prefix='mailcow-bench-')
+        self.server = subprocess.Popen(
+            [sys.executable, path.join(HERE, 'mock_server.py'),
+             '--port', '0',
+             '--mailboxes', str(args.mailboxes),
+             '--aliases', str(args.aliases),
+             '--schema', args.schema,
+             '--latency', str(args.latency),
+             '--capacity', str(capacity)],
+            stdout=subprocess.PIPE, universal_newlines=True)
+        self.url = self.server.stdout.readline().strip()
+        self.cache_dir = path.join(self.directory, 'cache')
+        self.conf = path.join(self.directory, '.config',
+                              'python-mailcow.conf')
+
+        os.makedirs(path.dirname(self.conf))
+        with open(self.conf, 'w') as conf:
+            conf.write(
+                f'[defaults]\nserver = bench\n\n'
+                f'[bench]\nurl = {self.url}\ntoken = benchmark\n'
+                f'ssl_verify = false\ncache_dir = {self.cache_dir}\n')
+
+    def client(self, **kwargs):
+        '''Return MailCow connected to the mock server'''
+        return MailCow(conf=self.conf, **kwargs)
+
+    def cli(self, *argv):
+        '''Run CLI as a fresh process and return seconds it took'''
+        env = dict(
+            os.environ, HOME=self.directory,
+            MAILCOW_SOCKET=path.join(self.directory, 'daemon.sock'),
+            PYTHONPATH=os.pathsep.join(
+                filter(None, [SRC, os.environ.get('PYTHONPATH')])))
+
+        return timed(
+            subprocess.run,
+            [sys.executable, '-m', 'mailcow', '--no-daemon', *argv],
+            env=env, check=True, stdout=subprocess.DEVNULL)
+
+    def clear_cache(self):
+        '''Drop cached schema and endpoints'''
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def close(self):
+        '''Stop server and remove files'''
+        self.server.terminate()
+        self.server.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def bench_startup(env, repeat):
+    '''CLI runtime without (cold) and with (warm) cached schema'''
+    argv = ['domain', 'get', '--all']
+    cold = []
+
+    for _ in range(repeat):
+        env.clear_cache()
+        cold.append(env.cli(*argv))
+
+    warm = [env.cli(*argv) for _ in range(repeat)]
+
+    return {'cold': summary(cold), 'warm': summary(warm)}
+
+
+def bench_endpoints(schema, repeat):
+    '''Build endpoints from the parsed schema'''
+    import yaml
+    with open(schema) as schemafile:
+        parsed = yaml.safe_load(schemafile)
+
+    # getOpenApiEndpoints modifies the schema, build from copies
+    copies = [copy.deepcopy(parsed) for _ in range(repeat)]
+    samples = [timed(getOpenApiEndpoints, schema) for schema in copies]
+
+    return dict(summary(samples), sections=len(getOpenApiEndpoints(
+        copy.deepcopy(parsed))))
+
+
+def bench_latency(moo, repeat):
+    '''Single GET requests over a kept alive connection'''
+    moo.getRequest('domain/all')
+    samples = [timed(moo.getRequest, 'domain/all')
+               for _ in range(repeat * 20)]
+
+    return summary(samples)
+
+
+def bench_bulk(moo, items, records, batch_size, workers):
+    '''Throughput of bulk delete and add'''
+    ids = [str(i) for i in range(items)]
+    results = dict()
+
+    seconds = timed(lambda: list(moo.bulk_delete(
+        'alias', ids, batch_size=batch_size, workers=workers)))
+    results['delete'] = {
+        'items': items, 'seconds': seconds, 'items_per_s': items / seconds}
+
+    records = [{'address': f'bench{i}@example.org', 'goto': 'a@b.c'}
+               for i in range(records)]
+    seconds = timed(lambda: list(moo.bulk_add(
+        'alias', records, workers=workers)))
+    results['add'] = {
+        'items': len(records), 'seconds': seconds,
+        'items_per_s': len(records) / seconds}
+
+    return results
+
+
+def bench_formatters(moo, section):
+    '''Time and peak memory of the formatters'''
+    data = moo.getRequest(section)
+    formatters = {
+        'as_json': moo.as_json,
+        'as_yaml': moo.as_yaml,
+        'as_table': lambda: [str(table) for table in moo.as_table()],
+        'write_table': lambda: write_table(moo.data, out=devnull)}
+    results = dict()
+    devnull = open(os.devnull, 'w')
+
+    for name, formatter in formatters.items():
+        moo.data = data
+        seconds = timed(formatter)
+
+        tracemalloc.start()
+        formatter()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[name] = {
+            'records': len(data), 'seconds': seconds,
+            'peak_mb': peak / 2 ** 20}
+
+    moo.data = None
+    devnull.close()
+    return results
+
+
+def bench_report(moo, section, group_by, aggregates):
+    '''Time and peak memory of a report on streamed and listed records'''
+    requests = {'stream': moo.streamRequest, 'list': moo.getRequest}
+    results = dict()
+
+    for name, request in requests.items():
+        tracemalloc.start()
+        start = time.perf_counter()
+        report = Report(group_by, aggregates).extend(request(section))
+        groups = len(report.results())
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[name] = {
+            'records': report.total, 'groups': groups, 'seconds': seconds,
+            'peak_mb': peak / 2 ** 20}
+
+    return results
+
+
+def bench_throughput(moo, requests, workers):
+    '''
+    Requests per second achieved by `workers` threads against a server
+    answering 429 beyond its capacity, with the scheduler's stats
+    '''
+    sections = [f'rl-mbox/user{i}@example.org' for i in range(requests)]
+    start = time.perf_counter()
+    results = moo.get_many(sections, workers=workers)
+    seconds = time.perf_counter() - start
+    stats = moo.scheduler.stats()
+
+    return {
+        'requests': requests, 'workers': workers, 'seconds': seconds,
+        'items_per_s': requests / seconds,
+        'failed': sum(1 for result in results
+                      if result.get('type') == 'error'),
+        'overloads': stats['overloads'], 'limit': stats['limit'],
+        'lowest': stats['lowest']}
+
+
+def compare(old, new, prefix=''):
+    '''Print relative change of all metrics found in `old` and `new`'''
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            compare(old[key], value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and old.get(key):
+            name = f'{prefix}{key}'
+            change = (value - old[key]) / old[key] * 100
+            print(f'{name:<45} {old[key]:>12.3f} {value:>12.3f} '
+                  f'{change:>+8.1f}%')
+
+
+def main():
+    '''Run all benchmarks and write results'''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--mailboxes', type=int, default=10000)
+    parser.add_argument('--aliases', type=int, default=10000)
+    parser.add_argument('--logs', type=int, default=100000,
+                        help='Log lines requested at once')
+    parser.add_argument('--bulk', type=int, default=10000,
+                        help='Items deleted in bulk')
+    parser.add_argument('--bulk-add', type=int, default=1000,
+                        help='Records added in bulk, one per request')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds the mock server adds per request')
+    parser.add_argument('--capacity', type=int, default=4,
+                        help='Requests in flight the mock server answers '
+                        'before 429, for the throughput benchmark')
+    parser.add_argument('--throughput', type=int, default=1000,
+                        help='Requests of the throughput benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--schema',
+                        default=path.join(HERE, 'data', 'openapi.yaml'))
+    parser.add_argument('--output', help='Defaults to '
+                        'benchmarks/results/<version>.json')
+    parser.add_argument('--compare', help='Results of an earlier run')
+    args = parser.parse_args()
+
+    env = Environment(args)
+    results = dict()
+    try:
+        print(f'Mock server: {env.url}', file=sys.stderr)
+        results['startup'] = bench_startup(env, args.repeat)
+        results['endpoints'] = bench_endpoints(args.schema, args.repeat)
+        moo = env.client()
+        results['latency'] = bench_latency(moo, args.repeat)
+        results['bulk'] = bench_bulk(
+            moo, args.bulk, args.bulk_add, args.batch_size, args.workers)
+        results['formatters'] = {
+            'mailbox': bench_formatters(moo, 'mailbox/all'),
+            'alias': bench_formatters(moo, 'alias/all'),
+            'logs': bench_formatters(moo, f'logs/postfix/{args.logs}')}
+        results['report'] = bench_report(
+            moo, f'logs/postfix/{args.logs}', ['program'],
+            ['count', 'p99(time)', "top(extract(message, '^(\\w+):'))"])
+    finally:
+        env.close()
+
+    # a second server limits requests in flight like mailcow does
+    env = Environment(args, capacity=args.capacity)
+    try:
+        results['throughput'] = bench_throughput(
+            env.client(), args.throughput, args.workers * 4)
+    finally:
+        env.close()
+
+    report = {
+        'meta': {
+            'version': version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'arguments': {key: value for key, value in vars(args).items()
+                          if key not in ['output', 'compare']}},
+        'results': results}
+
+    output = args.output or path.join(
+        HERE, 'results', f'{report["meta"]["version"]}.json')
+    os.makedirs(path.dirname(path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as resultfile:
+        json.dump(report, resultfile, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f'Results written to {output}', file=sys.stderr)
+
+    if args.compare:
+        print(f'{"metric":<45} {"old":>12} {"new":>12} {"change":>9}')
+        with open(args.compare) as previous:
+            compare(json.load(previous)['results'], results)
+
+
+if __name__ == '__main__':
+    main()
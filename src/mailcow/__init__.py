@@ -4,19 +4,28 @@
 # GNU General Public License v3.0+
 # (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
-'''Class for mailcow interaction'''
+'''
+Class for mailcow interaction
 
-import json
-import requests
-from prettytable import PrettyTable
+Heavy modules (requests, yaml, prettytable) are imported where they
+are needed to keep CLI startup fast.
+'''
+
+import textwrap
+import time
+from mailcow.cache import MISSING, FileCache, ResponseCache, SchemaCache
+from mailcow.columns import Columns
 from mailcow.config import find_cfg, load_cfg
-from mailcow.globals import SSL_TIMEOUT, SSL_VERIFY, CONF
+from mailcow.globals import (
+    BACKOFF_FACTOR, BATCH_SIZE, CACHE_DIR, CACHE_SIZE, CHUNK_SIZE, CONF,
+    MAX_CONCURRENCY, POOL_SIZE, RATE, RETRIES, SCHEMA_TTL, SSL_TIMEOUT,
+    SSL_VERIFY, WORKERS)
+from mailcow.instrument import Instrument, connection_timings
+from mailcow.throttle import Scheduler, overloaded, retry_after
 from mailcow.utils import (
-    debug_msg,
-    describeOpenApiPath, filterOpenApiPath,
-    getOpenApiParameters,
-    getOpenApiProperties, validate_response)
-import yaml
+    chunked, debug_msg,
+    getOpenApiEndpoints, iter_json, log_response, merge_results, parallel,
+    read_response, split_response, validate_response)
 
 
 class MailCow:
@@ -31,7 +40,24 @@ class MailCow:
     |url  | String | Base URL (MailCow UI location) for connection ie: https://demo.mailcow.io |
     | token | String | Token for API-Access |
     | ssl_verify | Boolean | Enable/Disable ssl verification |
-    | timeout | Integer | Connection timeout |
+    | timeout | Integer | Read timeout per request |
+    | connect_timeout | Integer | Connect timeout, defaults to timeout |
+    | retries | Integer | Retries on connection errors, 429 and 5xx |
+    | backoff_factor | Float | Base of exponential backoff between retries |
+    | pool_connections | Integer | Number of cached connection pools |
+    | pool_maxsize | Integer | Connections kept alive per pool |
+    | cache_dir | String | Directory caching the OpenApi schema |
+    | schema_ttl | Integer | Seconds before the cached schema is revalidated |
+    | offline | Boolean | Never download the schema, use the cached one |
+    | cache_ttl | Integer | Seconds GET results are cached, 0 disables it |
+    | cache_ttls | Dict | `cache_ttl` per section, ie: {'domain': 300} |
+    | cache_size | Integer | Maximum of GET results cached in memory |
+    | response_cache | String | `memory` or `disk` to share results |
+    | hooks | List | Functions called with timing events, see instrument |
+    | rate | Float | Requests per second at most, 0 disables the limit |
+    | burst | Integer | Requests sent at once within `rate` |
+    | concurrency | Integer | Requests in flight at most, lowered on overload |
+    | validate | Boolean | Check add and edit payloads against the schema |
 
     Example:
     ```
@@ -51,7 +77,17 @@ class MailCow:
     # +------------+----------------------------------+--------+-----------+------+
     ```
     '''  # noqa
+    CONCURRENCY = MAX_CONCURRENCY
+
     def __init__(self, **kwargs):
+        self._configure(**kwargs)
+        with self.instrument.phase('session'):
+            self.session = self._establish_session()
+        with self.instrument.phase('endpoints'):
+            self.endpoints = self._load_endpoints()
+
+    def _configure(self, **kwargs):
+        '''Read settings from config file and `kwargs`'''
         cfg = None
         conf = kwargs.get('conf', CONF)
         if find_cfg(conf):
@@ -61,88 +97,293 @@ class MailCow:
         self.server = kwargs.get('server', cfg['defaults']['server'])
         self.url = kwargs.get('url', cfg[self.server]['url'])
         self.token = kwargs.get('token', cfg[self.server]['token'])
-        self.ssl_verify = kwargs.get('ssl_verify', SSL_VERIFY)
-        self.timeout = kwargs.get('timeout', SSL_TIMEOUT)
+        self.ssl_verify = kwargs.get(
+            'ssl_verify',
+            cfg[self.server].getboolean('ssl_verify', SSL_VERIFY))
+        self.timeout = kwargs.get(
+            'timeout', cfg[self.server].getfloat('timeout', SSL_TIMEOUT))
+        self.connect_timeout = kwargs.get(
+            'connect_timeout',
+            cfg[self.server].getfloat('connect_timeout', self.timeout))
+        self.retries = kwargs.get(
+            'retries', cfg[self.server].getint('retries', RETRIES))
+        self.backoff_factor = kwargs.get(
+            'backoff_factor',
+            cfg[self.server].getfloat('backoff_factor', BACKOFF_FACTOR))
+        self.pool_connections = kwargs.get(
+            'pool_connections',
+            cfg[self.server].getint('pool_connections', POOL_SIZE))
+        self.pool_maxsize = kwargs.get(
+            'pool_maxsize',
+            cfg[self.server].getint('pool_maxsize', POOL_SIZE))
+        self.cache_dir = kwargs.get(
+            'cache_dir', cfg[self.server].get('cache_dir', CACHE_DIR))
+        self.schema_ttl = kwargs.get(
+            'schema_ttl', cfg[self.server].getint('schema_ttl', SCHEMA_TTL))
+        self.offline = kwargs.get(
+            'offline', cfg[self.server].getboolean('offline', False))
+        self.validate = kwargs.get(
+            'validate', cfg[self.server].getboolean('validate', True))
+        self._validators = None
+        self.response_cache = self._response_cache(
+            cfg[self.server], **kwargs)
         self.data = None
         self.json = None
 
         self.request_url = f'{self.url}/api/v1'
-        self.session = self._establish_session()
-        self.schema = self.getOpenApiSchema()
-        self.endpoints = self._endpoints()
+        self.schema_cache = SchemaCache(self.cache_dir, self.server)
+        self._schema = None
+        self.instrument = Instrument(self.server, kwargs.get('hooks'))
+        self.scheduler = Scheduler(
+            rate=kwargs.get('rate', cfg[self.server].getfloat('rate', RATE)),
+            burst=kwargs.get('burst', cfg[self.server].getint('burst', 0)),
+            concurrency=kwargs.get(
+                'concurrency',
+                cfg[self.server].getint('concurrency', self.CONCURRENCY)))
+
+    def _response_cache(self, cfg, **kwargs):
+        '''Return cache for GET results or None if it's disabled'''
+        ttl = kwargs.get('cache_ttl', cfg.getint('cache_ttl', 0))
+        ttls = {option.split('.', 1)[1]: cfg.getint(option)
+                for option in cfg if option.startswith('cache_ttl.')}
+        ttls.update(kwargs.get('cache_ttls', {}))
+
+        if ttl <= 0 and not any(value > 0 for value in ttls.values()):
+            return None
+
+        disk = None
+        storage = kwargs.get(
+            'response_cache', cfg.get('response_cache', 'memory'))
+        if storage == 'disk':
+            disk = FileCache(self.cache_dir, self.server)
+        debug_msg(f'Response cache: {storage} {ttl} {ttls}')
+
+        return ResponseCache(
+            ttl, ttls,
+            kwargs.get('cache_size', cfg.getint('cache_size', CACHE_SIZE)),
+            disk)
+
+    def _cached(self, section):
+        '''Return cached result of GET `section` or MISSING'''
+        if self.response_cache is None:
+            return MISSING
+
+        return self.response_cache.get(section)
+
+    def _cache(self, section, data, status_code=200):
+        '''Cache result of GET `section` unless it's an error'''
+        if self.response_cache is None or isinstance(data, bytes) or \
+                not 200 <= status_code < 300:
+            return
+        if isinstance(data, dict) and data.get('type') in ['error', 'danger']:
+            return
+
+        self.response_cache.set(section, data)
+
+    def _invalidate(self, section):
+        '''Drop cached results of `section` after it was modified'''
+        if self.response_cache is not None:
+            self.response_cache.invalidate(section)
+
+    @property
+    def schema(self):
+        '''OpenApi schema, only loaded if endpoints must be rebuilt'''
+        if self._schema is None:
+            self._schema = self.getOpenApiSchema()
+
+        return self._schema
 
     def getOpenApiSchema(self):
-        '''Read OpenApi Schema from `self.url`'''
-        response = self._request(
-            url=f'{self.url}/api/openapi.yaml',
-            method='get')
+        '''
+        Read OpenApi Schema from cache or `self.url`.
 
-        return yaml.safe_load(response)
+        A cached schema is used as is for `self.schema_ttl` seconds.
+        Afterwards it is revalidated with a conditional GET and only
+        downloaded again if the instance reports a changed schema.
+        '''
+        cache = self.schema_cache
+        schema = cache.schema()
 
-    def endpoint(self, endpoint):
-        '''Return specific endpoint'''
-        return self.endpoints.get(endpoint)
+        if schema is None:
+            return self._download_schema(conditional=False)
 
-    def _endpoints(self):
-        '''Return all endpoints provided by OpenApi'''
-        endpoints = dict()
+        if self.offline or cache.fresh(self.schema_ttl):
+            debug_msg(f'OpenApi schema from cache: {cache.directory}')
+            return schema
 
-        for path in self.schema['paths'].keys():
-            schema = filterOpenApiPath(self.schema['paths'][path])
-            p = describeOpenApiPath(path)
-            section = p['section']
-            modifier = p['modifier']
-            arguments = dict()
+        return self._download_schema() or schema
 
-            if p.get('all') or p.get('parameter') == '{id}':
-                arguments.update(getOpenApiParameters('all'))
+    def _download_schema(self, conditional=True):
+        '''
+        Download OpenApi Schema from `self.url` and update cache.
+        Returns None if the cached schema is still valid.
+        '''
+        with self.instrument.phase('schema'):
+            response = self._send(**self._schema_request(conditional))
 
-            arguments.update(getOpenApiParameters(p.get('component')))
-            arguments.update(getOpenApiParameters(schema.get('parameters')))
-            arguments.update(getOpenApiProperties(schema.get('schema')))
+            return self._store_schema(response, conditional)
 
-            if section not in endpoints.keys():
-                endpoints.update({section: dict()})
+    def _schema_request(self, conditional=True):
+        '''Return request arguments for downloading the OpenApi Schema'''
+        cache = self.schema_cache
 
-            if modifier not in endpoints[section].keys():
-                endpoints[section].update({modifier: dict()})
+        if self.offline:
+            raise IOError(
+                f'No cached OpenApi schema for {self.server} in '
+                f'{cache.directory}. Run without offline mode first!')
 
-            endpoints[section][modifier].update(arguments)
+        return dict(
+            url=f'{self.url}/api/openapi.yaml',
+            method='get',
+            headers=cache.validators() if conditional else {})
+
+    def _store_schema(self, response, conditional=True):
+        '''Parse downloaded OpenApi Schema and update cache'''
+        cache = self.schema_cache
+        debug_msg(f'OpenApi schema status code: {response.status_code}')
+
+        if conditional and response.status_code == 304:
+            cache.touch(cache.META)
+            return None
+
+        # error pages must neither be parsed nor replace the cache
+        if not 200 <= response.status_code < 300:
+            if conditional:
+                debug_msg('OpenApi schema unavailable, using stale cache')
+                return None
+            raise IOError(
+                f'OpenApi schema unavailable from {self.url}: '
+                f'status code {response.status_code}')
+
+        import yaml
+        schema = yaml.safe_load(response.content)
+        cache.update(schema, response.content, response.headers)
+
+        return schema
+
+    def _load_endpoints(self):
+        '''
+        Return endpoints from the compiled index if it matches
+        the current schema, otherwise rebuild them.
+        '''
+        cache = self.schema_cache
+
+        if not (self.offline or cache.fresh(self.schema_ttl)) and \
+                cache.exists(cache.SCHEMA):
+            self._schema = self._download_schema()
+
+        endpoints = cache.index()
+        if endpoints is not None:
+            debug_msg(f'Endpoints from compiled index: {cache.directory}')
+            return endpoints
+
+        return self.compile_endpoints()
+
+    def compile_endpoints(self, refresh=False):
+        '''
+        Build endpoints from OpenApi schema and store them as
+        compiled index. Revalidate the schema first if `refresh` is set.
+        '''
+        if refresh and not self.offline and \
+                self.schema_cache.exists(self.schema_cache.SCHEMA):
+            self._schema = self._download_schema()
+
+        endpoints = self._endpoints()
+        self.schema_cache.store_index(endpoints)
 
         return endpoints
 
+    @property
+    def validators(self):
+        '''Payload validators of `self.endpoints`, compiled on first use'''
+        from mailcow.validate import Validators
+        if self._validators is None or \
+                self._validators.endpoints is not self.endpoints:
+            self._validators = Validators(self.endpoints)
+
+        return self._validators
+
+    def endpoint(self, endpoint):
+        '''Return specific endpoint'''
+        return self.endpoints.get(endpoint)
+
+    def _endpoints(self):
+        '''Return all endpoints provided by OpenApi'''
+        schema = self.schema
+        with self.instrument.phase('compile'):
+            return getOpenApiEndpoints(schema)
+
     def _establish_session(self):
         '''Connect to mailcow instance'''
         for msg in [f'Request Session verify: {self.ssl_verify}',
-                    f'Request Session timeout: {self.timeout}']:
+                    f'Request Session timeout: {self.connect_timeout}/'
+                    f'{self.timeout}',
+                    f'Request Session retries: {self.retries}']:
             debug_msg(msg)
 
-        session = requests.Session()
-        session.verify = self.ssl_verify
-        session.timeout = self.timeout
+        from mailcow.session import establish_session
+        return establish_session(
+            self.ssl_verify, self.retries, self.backoff_factor,
+            self.pool_connections, self.pool_maxsize)
 
-        return session
+    def _ensure_pool(self, size):
+        '''Grow connection pool to keep `size` connections per host'''
+        if size <= self.pool_maxsize:
+            return
 
-    @validate_response
-    def _request(self, **kwargs):
-        '''Send requests to mailcow instance'''
+        from mailcow.session import mount_adapter, retry_policy
+        mount_adapter(
+            self.session, self.pool_connections, size,
+            retry_policy(self.retries, self.backoff_factor))
+        self.pool_maxsize = size
+
+    def _send(self, **kwargs):
+        '''Send requests to mailcow instance and return raw response'''
         url = kwargs.get('url', self.url)
         token = kwargs.get('token', self.token)
         method = kwargs.get('method')
         data = kwargs.get('json', self.json)
         headers = {'X-API-Key': token}
+        headers.update(kwargs.get('headers', {}))
 
         debug_msg(f'Request URL: {url}')
-        debug_msg(f'Request Payload: {json}')
-
-        request = self.session.request(
-            headers=headers,
-            method=method,
-            url=url,
-            json=data)
+        debug_msg(f'Request Payload: {data}')
+
+        # rate limited requests wait for the scheduler, not a connection
+        first = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            with self.scheduler.slot() as slot:
+                connection_timings(reset=True)
+                start = time.perf_counter()
+                request = self.session.request(
+                    headers=headers,
+                    method=method,
+                    url=url,
+                    json=data,
+                    stream=kwargs.get('stream', False),
+                    timeout=(self.connect_timeout, self.timeout))
+                slot.overloaded = overloaded(request)
+                slot.retry_after = retry_after(request)
+            if request.status_code != 429 or attempt == self.retries:
+                break
+            debug_msg(f'Rate limited, retry {attempt + 1}: {url}')
+            request.close()
+
+        if self.instrument.active:
+            self.instrument.emit('schedule', **self.scheduler.stats())
+        self.instrument.request(
+            request, time.perf_counter() - first,
+            url[len(self.url):] if url.startswith(self.url) else url,
+            streamed=kwargs.get('stream', False),
+            waited=start - first, attempts=attempt)
 
         return request
 
+    @validate_response
+    def _request(self, **kwargs):
+        '''Send requests to mailcow instance'''
+        return self._send(**kwargs)
+
     def deleteRequest(self, section, items):
         '''
         Send DELETE request to MailCow instance.
@@ -157,7 +398,10 @@ class MailCow:
         '''
         url = f'{self.request_url}/delete/{section}'
 
-        return self._request(url=url, method='post', json=items)
+        try:
+            return self._request(url=url, method='post', json=items)
+        finally:
+            self._invalidate(section)
 
     def getRequest(self, section):
         '''
@@ -171,8 +415,38 @@ class MailCow:
         ```
         '''
         url = f'{self.request_url}/get/{section}'
+        data = self._cached(section)
 
-        return self._request(url=url, method='get')
+        if data is MISSING:
+            response = self._send(url=url, method='get')
+            data = read_response(response)
+            self._cache(section, data, response.status_code)
+
+        return data
+
+    def streamRequest(self, section):
+        '''
+        Send GET request to MailCow instance and yield the result
+        while it's read. Elements of a JSON array are yielded one
+        by one, so large results never have to fit into memory.
+
+        Example:
+        ```
+        moo = MailCow()
+        for entry in moo.streamRequest('logs/postfix/100000'):
+            print(entry['message'])
+        ```
+        '''
+        url = f'{self.request_url}/get/{section}'
+        response = self._send(url=url, method='get', stream=True)
+        log_response(response)
+
+        with response:
+            if 'json' not in response.headers.get('Content-Type', ''):
+                yield response.content
+                return
+
+            yield from iter_json(response.iter_content(CHUNK_SIZE))
 
     def addRequest(self, section, data=None):
         '''
@@ -191,8 +465,14 @@ class MailCow:
         ```
         '''
         url = f'{self.request_url}/add/{section}'
+        if self.validate:
+            self.validators.check(section, 'add', data)
 
-        return self._request(url=url, method='post', json=data)
+        try:
+            return self._request(url=url, method='post', json=data)
+        finally:
+            # GETs sent meanwhile may have cached the old state
+            self._invalidate(section)
 
     def editRequest(self, section=None, items=None, attr=None, action=None):
         '''
@@ -217,6 +497,8 @@ class MailCow:
         ```
         '''
         url = f'{self.request_url}/edit/{section}'
+        if self.validate and attr:
+            self.validators.check(section, 'edit', attr)
         data = dict(items=items, attr=attr, action=action)
 
         if not items:
@@ -226,22 +508,179 @@ class MailCow:
         if not action:
             del data['action']
 
-        return self._request(url=url, method='post', json=data)
+        try:
+            return self._request(url=url, method='post', json=data)
+        finally:
+            self._invalidate(section)
+
+    def get_many(self, sections, workers=WORKERS):
+        '''
+        Send GET requests for all `sections` using `workers` threads
+        and merge the results into one list.
+
+        `sections` may be a dict mapping every section to fields
+        the records of its result are tagged with.
+
+        Example:
+        ```
+        moo = MailCow()
+        mailboxes = moo.getRequest('mailbox/all')
+        moo.data = moo.get_many({
+            f'rl-mbox/{mailbox["username"]}': {'mailbox': mailbox['username']}
+            for mailbox in mailboxes}, workers=16)
+        print(moo.as_table())
+        ```
+        '''  # noqa
+        if not isinstance(sections, dict):
+            sections = dict.fromkeys(sections, {})
+
+        self._ensure_pool(workers)
+        results = parallel(self.getRequest, sections, workers)
+
+        return merge_results(sections, results)
+
+    def _bulk(self, request, chunks, workers):
+        '''
+        Send `chunks` via `request` using `workers` threads and
+        yield the result of every item. Failing chunks don't stop the run.
+        '''
+        def send(chunk):
+            try:
+                return chunk, request(chunk)
+            except Exception as error:  # pylint: disable=broad-except
+                debug_msg(f'Bulk request failed: {error}')
+                return chunk, error
+
+        self._ensure_pool(workers)
+        for chunk, response in parallel(send, chunks, workers):
+            yield from split_response(chunk, response)
+
+    def bulk_delete(self, section, items,
+                    batch_size=BATCH_SIZE, workers=WORKERS):
+        '''
+        Delete `items` in batches of `batch_size`.
+        `items` may be any iterable, ie. a file object.
+        Yields a dict (item, type, msg) per item.
+
+        Example:
+        ```
+        moo = MailCow()
+        with open('ids.txt') as ids:
+            for result in moo.bulk_delete('alias', read_items(ids)):
+                print(result)
+        # {'item': '5', 'type': 'success', 'msg': ['alias_removed', '5']}
+        ```
+        '''
+        return self._bulk(
+            lambda chunk: self.deleteRequest(section, chunk),
+            chunked(items, batch_size), workers)
+
+    def bulk_edit(self, section, items, attr=None,
+                  batch_size=BATCH_SIZE, workers=WORKERS):
+        '''
+        Apply `attr` to `items` in batches of `batch_size`.
+        Yields a dict (item, type, msg) per item.
+        Invalid `attr` raise ValidationError before anything is sent.
+        '''
+        if self.validate and attr:
+            self.validators.check(section, 'edit', attr)
+
+        return self._bulk(
+            lambda chunk: self.editRequest(section, chunk, attr),
+            chunked(items, batch_size), workers)
+
+    def bulk_add(self, section, records, workers=WORKERS):
+        '''
+        Add every dict of `records`. mailcow takes one object per
+        request, so requests are only pipelined using `workers` threads.
+        Yields a dict (item, type, msg) per record, invalid records are
+        reported without being sent.
+        '''
+        return self._bulk(
+            lambda chunk: self.addRequest(section, chunk[0]),
+            chunked(records, 1), workers)
+
+    def query(self, where=None, sort=None, limit=None):
+        '''
+        Filter `self.data` by expression `where`, sort it by `sort`
+        fields (prefix `-` for descending) and keep `limit` records.
+
+        Example:
+        ```
+        moo = MailCow()
+        moo.data = moo.getRequest('mailbox/all')
+        moo.query("percent_in_use > 90 and domain == 'example.org'",
+                  sort=['-percent_in_use'], limit=10)
+        print(moo.as_table())
+        ```
+        '''
+        from mailcow.query import apply_query
+        self.data = apply_query(self.data, where, sort, limit)
+
+        return self.data
+
+    def report(self, group_by=None, aggregates=None, where=None,
+               section=None):
+        '''
+        Aggregate records of `section`, streamed from the server, or of
+        `self.data` grouped by `group_by` expressions in a single pass.
+        `aggregates` default to `count`, see `mailcow.report`.
+
+        Example:
+        ```
+        moo = MailCow()
+        moo.report(group_by=['extract(message, "from=<([^>]*)>")'],
+                   aggregates=['count'], section='logs/postfix/100000')
+        moo.query(sort=['-count'], limit=10)
+        print(moo.as_table())
+        ```
+        '''
+        from mailcow.report import Report
+        report = Report(group_by, aggregates, where)
+        report.extend(self.streamRequest(section) if section else self.data)
+        self.data = report.results()
+
+        return self.data
 
     def as_json(self):
         '''Convert self.data into JSON'''
+        import json
+        if isinstance(self.data, Columns):
+            if not self.data:
+                return '[]'
+            # same layout as a dumped list without copying the records
+            rows = (textwrap.indent(json.dumps(row, indent=4), '    ')
+                    for row in self.data)
+            return '[\n' + ',\n'.join(rows) + '\n]'
         return json.dumps(self.data, indent=4)
 
     def as_yaml(self):
         '''Convert self.data into YAML'''
+        import yaml
+        if isinstance(self.data, Columns):
+            return ''.join(yaml.dump([row]) for row in self.data) or '[]\n'
         return yaml.dump(self.data)
 
     def as_table(self, vertical=False):
         '''Convert self.data into PrettyTable'''
+        from prettytable import PrettyTable
         tables = []
         table = PrettyTable()
 
-        for data in self.data if isinstance(self.data, list) else [self.data]:
+        if isinstance(self.data, Columns):
+            if not vertical:
+                table.field_names = self.data.fields
+                for row in self.data.rows(missing=''):
+                    table.add_row(row)
+                return [table]
+            # a table per record, like lists
+            records = [dict(zip(self.data.fields, row))
+                       for row in self.data.rows(missing='')]
+        else:
+            records = self.data if isinstance(self.data, list) \
+                else [self.data]
+
+        for data in records:
             if vertical:
                 table.add_column('Key', list(data.keys()))
                 table.add_column('Value', list(data.values()))
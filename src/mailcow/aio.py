@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Asynchronous class for mailcow interaction'''
+
+import asyncio
+import json
+import time
+from collections import deque
+from mailcow import MailCow
+from mailcow.cache import MISSING
+from mailcow.globals import BATCH_SIZE, CONCURRENCY
+from mailcow.throttle import OVERLOAD_STATUS, retry_after
+from mailcow.utils import (
+    chunked, debug_msg, iter_json, log_response, merge_results,
+    read_response, split_response)
+
+
+class AsyncResponse:
+    '''
+    Response of AsyncMailCow providing the attributes of
+    `requests.Response` used by `mailcow.utils.read_response`
+    '''
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        '''Decode JSON body'''
+        return json.loads(self.content)
+
+
+class AsyncMailCow(MailCow):
+    '''
+    Connect to MailCow instance defined in config file and
+    interact via asynchronous API Requests. Requires `aiohttp`
+    (`pip install python-mailcow[async]`).
+
+    Takes the same arguments as `MailCow`, but `concurrency` defaults
+    to `CONCURRENCY`:
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | concurrency | Integer | Requests in flight at most, lowered on overload |
+
+    `getRequest`, `addRequest`, `editRequest`, `deleteRequest`,
+    `get_many`, `report` and `getOpenApiSchema` are coroutines,
+    `streamRequest`, `bulk_delete`, `bulk_edit` and `bulk_add` return
+    asynchronous iterators. Schema and endpoints are loaded on `open()`
+    and share the cache of `MailCow`.
+
+    Example:
+    ```
+    async def limits():
+        async with AsyncMailCow(concurrency=20) as moo:
+            mailboxes = await moo.getRequest('mailbox/all')
+            return await asyncio.gather(*[
+                moo.getRequest(f'rl-mbox/{mailbox["username"]}')
+                for mailbox in mailboxes])
+    ```
+    '''
+    CONCURRENCY = CONCURRENCY
+
+    def __init__(self, **kwargs):
+        self._configure(**kwargs)
+        self.concurrency = self.scheduler.concurrency
+        self.session = None
+        self.endpoints = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def schema(self):
+        '''OpenApi schema, must be loaded by `open()` first'''
+        return self._schema
+
+    async def open(self):
+        '''Establish session and load endpoints'''
+        self.session = self._establish_session()
+        with self.instrument.phase('endpoints'):
+            self.endpoints = await self._load_endpoints()
+
+        return self
+
+    async def close(self):
+        '''Close session'''
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _establish_session(self):
+        '''Create aiohttp session limited to `self.concurrency`'''
+        for msg in [f'Request Session verify: {self.ssl_verify}',
+                    f'Request Session timeout: {self.connect_timeout}/'
+                    f'{self.timeout}',
+                    f'Request Session concurrency: {self.concurrency}']:
+            debug_msg(msg)
+
+        import aiohttp
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            ssl=None if self.ssl_verify else False)
+
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self.connect_timeout, sock_read=self.timeout))
+
+    async def getOpenApiSchema(self):
+        '''Read OpenApi Schema from cache or `self.url`'''
+        cache = self.schema_cache
+        schema = cache.schema()
+
+        if schema is None:
+            return await self._download_schema(conditional=False)
+
+        if self.offline or cache.fresh(self.schema_ttl):
+            debug_msg(f'OpenApi schema from cache: {cache.directory}')
+            return schema
+
+        return await self._download_schema() or schema
+
+    async def _download_schema(self, conditional=True):
+        '''
+        Download OpenApi Schema from `self.url` and update cache.
+        Returns None if the cached schema is still valid.
+        '''
+        with self.instrument.phase('schema'):
+            response = await self._send(
+                **self._schema_request(conditional))
+
+            return self._store_schema(response, conditional)
+
+    async def _load_endpoints(self):
+        '''
+        Return endpoints from the compiled index if it matches
+        the current schema, otherwise rebuild them.
+        '''
+        cache = self.schema_cache
+
+        if not (self.offline or cache.fresh(self.schema_ttl)) and \
+                cache.exists(cache.SCHEMA):
+            self._schema = await self._download_schema()
+
+        endpoints = cache.index()
+        if endpoints is not None:
+            debug_msg(f'Endpoints from compiled index: {cache.directory}')
+            return endpoints
+
+        return await self.compile_endpoints()
+
+    async def compile_endpoints(self, refresh=False):
+        '''
+        Build endpoints from OpenApi schema and store them as
+        compiled index. Revalidate the schema first if `refresh` is set.
+        '''
+        cache = self.schema_cache
+
+        if refresh and not self.offline and cache.exists(cache.SCHEMA):
+            self._schema = await self._download_schema()
+
+        if self._schema is None:
+            self._schema = cache.schema()
+        if self._schema is None:
+            self._schema = await self._download_schema(conditional=False)
+
+        endpoints = self._endpoints()
+        cache.store_index(endpoints)
+
+        return endpoints
+
+    async def _attempt(self, method, url, headers, data):
+        '''
+        Send one request once the scheduler allows it.
+        Returns response, its content, time to first byte and duration.
+        '''
+        slot = await self.scheduler.acquire_async()
+        try:
+            start = time.perf_counter()
+            async with self.session.request(
+                    method, url, headers=headers, json=data) as response:
+                ttfb = time.perf_counter() - start
+                content = await response.read()
+            duration = time.perf_counter() - start
+            slot.overloaded = response.status in OVERLOAD_STATUS
+            slot.retry_after = retry_after(response)
+        except Exception:
+            slot.overloaded = True
+            raise
+        finally:
+            self.scheduler.release(slot)
+
+        return response, content, ttfb, duration
+
+    async def _send(self, **kwargs):
+        '''
+        Send requests to mailcow instance and return raw response.
+        Retries follow `mailcow.session.retry_policy` like `MailCow`:
+        rate limited requests wait for the scheduler, `RETRY_STATUS`
+        and connection errors back off with jitter.
+        '''
+        from aiohttp import ClientConnectorError
+        from mailcow.session import retry_policy
+        url = kwargs.get('url', self.url)
+        token = kwargs.get('token', self.token)
+        method = kwargs.get('method')
+        data = kwargs.get('json', self.json)
+        headers = {'X-API-Key': token}
+        headers.update(kwargs.get('headers', {}))
+
+        debug_msg(f'Request URL: {url}')
+        debug_msg(f'Request Payload: {data}')
+
+        policy = retry_policy(self.retries, self.backoff_factor)
+        first = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                response, content, ttfb, duration = await self._attempt(
+                    method, url, headers, data)
+            except ClientConnectorError as error:
+                # never reached the instance, safe for every method
+                if attempt == self.retries:
+                    raise
+                debug_msg(f'Connection failed, retry {attempt + 1}: {error}')
+                policy = policy.increment(method.upper(), url, error=error)
+                await asyncio.sleep(policy.get_backoff_time())
+                continue
+
+            if attempt == self.retries:
+                break
+            if response.status == 429:
+                debug_msg(f'Rate limited, retry {attempt + 1}: {url}')
+                continue
+            if not policy.is_retry(method.upper(), response.status):
+                break
+            debug_msg(f'Status {response.status}, retry {attempt + 1}: '
+                      f'{url}')
+            policy = policy.increment(method.upper(), url)
+            await asyncio.sleep(policy.get_backoff_time())
+
+        if self.instrument.active:
+            # earlier attempts and their backoff count as time to first byte
+            download = duration - ttfb
+            duration = time.perf_counter() - first
+            self.instrument.emit('schedule', **self.scheduler.stats())
+            self.instrument.emit(
+                'request', method=method.upper(),
+                endpoint=url[len(self.url):]
+                if url.startswith(self.url) else url,
+                status=response.status, connect=None, tls=None,
+                ttfb=duration - download, download=download,
+                duration=duration,
+                sent=len(json.dumps(data)) if data is not None else 0,
+                received=len(content),
+                retries=attempt)
+
+        return AsyncResponse(
+            str(response.url), response.status, response.headers, content)
+
+    async def _request(self, **kwargs):
+        '''Send requests to mailcow instance'''
+        return read_response(await self._send(**kwargs))
+
+    async def getRequest(self, section):
+        '''Send GET request to MailCow instance'''
+        data = self._cached(section)
+
+        if data is MISSING:
+            response = await self._send(
+                url=f'{self.request_url}/get/{section}', method='get')
+            data = read_response(response)
+            self._cache(section, data, response.status_code)
+
+        return data
+
+    async def addRequest(self, section, data=None):
+        '''Send PUT request to MailCow instance'''
+        try:
+            return await MailCow.addRequest(self, section, data)
+        finally:
+            self._invalidate(section)
+
+    async def editRequest(self, section=None, items=None, attr=None,
+                          action=None):
+        '''Send POST request to MailCow instance'''
+        try:
+            return await MailCow.editRequest(
+                self, section, items, attr, action)
+        finally:
+            self._invalidate(section)
+
+    async def deleteRequest(self, section, items):
+        '''Send DELETE request to MailCow instance'''
+        try:
+            return await MailCow.deleteRequest(self, section, items)
+        finally:
+            self._invalidate(section)
+
+    async def get_many(self, sections, workers=None):
+        '''
+        Send GET requests for all `sections` concurrently and merge the
+        results into one list. Concurrency is bound by `self.concurrency`,
+        `workers` is accepted for compatibility with `MailCow.get_many`.
+        '''
+        if not isinstance(sections, dict):
+            sections = dict.fromkeys(sections, {})
+
+        results = await asyncio.gather(
+            *[self.getRequest(section) for section in sections])
+
+        return merge_results(sections, results)
+
+    async def streamRequest(self, section):
+        '''
+        Send GET request to MailCow instance and yield the elements
+        of a JSON array one by one. Unlike `MailCow.streamRequest`
+        the body is read completely first.
+        '''
+        response = await self._send(
+            url=f'{self.request_url}/get/{section}', method='get')
+        log_response(response)
+
+        if 'json' not in response.headers.get('Content-Type', ''):
+            yield response.content
+            return
+
+        for element in iter_json([response.content]):
+            yield element
+
+    async def _bulk(self, request, chunks, workers):
+        '''
+        Send `chunks` via coroutine `request` and yield the result of
+        every item in order. At most twice `workers` chunks are in
+        flight, failing chunks don't stop the run.
+        '''
+        async def send(chunk):
+            try:
+                return chunk, await request(chunk)
+            except Exception as error:  # pylint: disable=broad-except
+                debug_msg(f'Bulk request failed: {error}')
+                return chunk, error
+
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(asyncio.ensure_future(send(chunk)))
+                if len(pending) < 2 * (workers or self.concurrency):
+                    continue
+                for result in split_response(*await pending.popleft()):
+                    yield result
+
+            while pending:
+                for result in split_response(*await pending.popleft()):
+                    yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def bulk_delete(self, section, items, batch_size=BATCH_SIZE,
+                    workers=None):
+        '''
+        Delete `items` in batches of `batch_size`.
+        Yields a dict (item, type, msg) per item asynchronously.
+        '''
+        return self._bulk(
+            lambda chunk: self.deleteRequest(section, chunk),
+            chunked(items, batch_size), workers)
+
+    def bulk_edit(self, section, items, attr=None, batch_size=BATCH_SIZE,
+                  workers=None):
+        '''
+        Apply `attr` to `items` in batches of `batch_size`.
+        Yields a dict (item, type, msg) per item asynchronously.
+        Invalid `attr` raise ValidationError before anything is sent.
+        '''
+        if self.validate and attr:
+            self.validators.check(section, 'edit', attr)
+
+        return self._bulk(
+            lambda chunk: self.editRequest(section, chunk, attr),
+            chunked(items, batch_size), workers)
+
+    def bulk_add(self, section, records, workers=None):
+        '''
+        Add every dict of `records`, one request each.
+        Yields a dict (item, type, msg) per record asynchronously.
+        '''
+        return self._bulk(
+            lambda chunk: self.addRequest(section, chunk[0]),
+            chunked(records, 1), workers)
+
+    async def report(self, group_by=None, aggregates=None, where=None,
+                     section=None):
+        '''
+        Aggregate records of `section` or of `self.data`,
+        see `MailCow.report`.
+        '''
+        from mailcow.report import Report
+        report = Report(group_by, aggregates, where)
+        if section:
+            async for record in self.streamRequest(section):
+                report.update(record)
+        else:
+            report.extend(self.data)
+        self.data = report.results()
+
+        return self.data
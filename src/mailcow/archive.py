@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module exports and imports the configuration of a mailcow instance.
+
+An export is a directory holding a gzip compressed NDJSON file per
+section and a manifest. Records are streamed from the response into
+the files and back into add requests, so only a few records per
+section are held in memory at any time. The manifest is written last
+and marks the export complete.
+'''
+
+import gzip
+import json
+import time
+from os import makedirs, path, remove
+from mailcow.globals import FIELDS, FOR_EACH, WORKERS
+from mailcow.state import SECTIONS
+from mailcow.utils import add_section, debug_msg, parallel
+
+MANIFEST = 'manifest.json'
+ARCHIVE_VERSION = 1
+# sections holding state rather than configuration
+SKIP = ['logs', 'mailq', 'quarantine', 'status']
+
+
+def export_sections(endpoints):
+    '''
+    Return get request of every section that lists all objects.
+    Sections listing objects per mailbox or domain contain a
+    placeholder for it, ie. `app-passwd/all/{mailbox}`.
+    '''
+    sections = dict()
+
+    for section, modifiers in endpoints.items():
+        if modifiers.get('get') is None or section in SKIP:
+            continue
+        # options added by the CLI aren't part of the request
+        arguments = [name for name in modifiers['get'] if name not in FIELDS]
+
+        parent = next(
+            (parent for parent in FOR_EACH if parent in arguments), None)
+        request = [section]
+        if 'all' in arguments:
+            request.append('all')
+            if 'no_log' in arguments:
+                request.append('no_log')
+        if parent:
+            request.append(f'{{{parent}}}')
+
+        if len(request) > 1 or not arguments:
+            sections[section] = '/'.join(request)
+
+    return sections
+
+
+def failed(record):
+    '''Raise IOError if `record` is an error message of mailcow'''
+    if isinstance(record, bytes):
+        raise IOError(
+            f'Unexpected response: {record[:80].decode(errors="replace")}')
+    if isinstance(record, dict) and \
+            record.get('type') in ['error', 'danger']:
+        raise IOError(f'{record["type"]}: {record.get("msg")}')
+
+
+def export_section(moo, directory, section, request, parents, workers):
+    '''Stream `request` into the file of `section`'''
+    filename = f'{section}.ndjson.gz'
+    records = 0
+
+    if '{' in request:
+        # results per parent are small, fetch them concurrently
+        parent = request[request.index('{') + 1:request.index('}')]
+        results = parallel(
+            lambda key: list(moo.streamRequest(
+                request.format(**{parent: key}))),
+            parents[parent], workers)
+        stream = (record for result in results for record in result)
+    else:
+        stream = moo.streamRequest(request)
+
+    try:
+        with gzip.open(path.join(directory, filename), 'wt',
+                       compresslevel=6) as archive:
+            for record in stream:
+                if not record:
+                    continue
+                failed(record)
+                archive.write(json.dumps(record, separators=(',', ':')))
+                archive.write('\n')
+                records += 1
+    except Exception:
+        # a partial file must not be imported
+        remove(path.join(directory, filename))
+        raise
+
+    debug_msg(f'Exported {records} records of {section}')
+    return dict(request=request, file=filename, records=records)
+
+
+def parent_keys(moo, parent):
+    '''Return keys of all mailboxes or domains'''
+    section, key = FOR_EACH[parent]
+
+    return [record[key] for record in moo.streamRequest(section)
+            if isinstance(record, dict) and key in record]
+
+
+def export_archive(moo, directory, sections=None, workers=WORKERS):
+    '''
+    Export `sections` (default: all) into `directory`
+    using `workers` concurrent requests. Returns the manifest.
+    '''
+    requests = export_sections(moo.endpoints)
+    if sections:
+        requests = {section: request
+                    for section, request in requests.items()
+                    if section in sections}
+    makedirs(directory, exist_ok=True)
+    moo._ensure_pool(workers)  # noqa
+
+    parents = {parent: parent_keys(moo, parent) for parent in FOR_EACH
+               if any(f'{{{parent}}}' in request
+                      for request in requests.values())}
+
+    def export(section):
+        try:
+            return export_section(
+                moo, directory, section, requests[section], parents,
+                workers)
+        except Exception as error:  # pylint: disable=broad-except
+            return dict(request=requests[section], error=str(error))
+
+    manifest = dict(
+        version=ARCHIVE_VERSION,
+        server=moo.server,
+        url=moo.url,
+        created=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        schema=moo.schema_cache.meta().get('sha256'),
+        sections=dict())
+
+    # sections requested per parent use all workers on their own
+    direct = [section for section in requests if '{' not in requests[section]]
+    results = dict(zip(direct, parallel(export, direct, workers)))
+    for section in requests:
+        manifest['sections'][section] = results[section] \
+            if section in results else export(section)
+
+    with open(path.join(directory, MANIFEST), 'w') as manifestfile:
+        json.dump(manifest, manifestfile, indent=2)
+
+    return manifest
+
+
+def load_manifest(directory):
+    '''Return manifest of the export in `directory`'''
+    with open(path.join(directory, MANIFEST)) as manifestfile:
+        manifest = json.load(manifestfile)
+
+    if manifest.get('version') != ARCHIVE_VERSION:
+        raise ValueError(
+            f'Unsupported export version {manifest.get("version")}')
+
+    return manifest
+
+
+def schema_changed(moo, manifest):
+    '''True if the instance's schema differs from the exported one'''
+    current = moo.schema_cache.meta().get('sha256')
+
+    return bool(manifest.get('schema') and current and
+                manifest['schema'] != current)
+
+
+def read_records(filename):
+    '''Yield records of an exported section'''
+    with gzip.open(filename, 'rt') as archive:
+        for line in archive:
+            if line.strip():
+                yield json.loads(line)
+
+
+def restorable(section, record):
+    '''Convert exported `record` into the payload adding it'''
+    record = dict(record)
+
+    # mailbox settings are reported as attributes
+    for field, value in (record.pop('attributes', None) or {}).items():
+        record.setdefault(field, value)
+
+    for field, (name, unit) in SECTIONS.get(section, {}).get(
+            'fields', {}).items():
+        if name in record and field != name:
+            record[field] = record.pop(name)
+        if unit != 1 and record.get(field) not in (None, ''):
+            record[field] = int(record[field]) // unit
+
+    return record
+
+
+def import_order(sections):
+    '''Return `sections` with parents (domains) first'''
+    known = [section for section in SECTIONS if section in sections]
+
+    return known + [section for section in sections if section not in known]
+
+
+def import_archive(moo, directory, sections=None, workers=WORKERS):
+    '''
+    Add all records of the export in `directory` via the bulk path.
+    Yields a dict (section, item, type, msg) per record.
+    '''
+    manifest = load_manifest(directory)
+
+    for section in import_order(list(manifest['sections'])):
+        entry = manifest['sections'][section]
+        if sections and section not in sections or 'file' not in entry:
+            continue
+        if 'add' not in moo.endpoints.get(section, {}):
+            debug_msg(f'Skip import of {section}, it can\'t be added')
+            continue
+
+        records = (restorable(section, record) for record in
+                   read_records(path.join(directory, entry['file'])))
+        key = SECTIONS.get(section, {}).get('key')
+        for result in moo.bulk_add(
+                add_section(section), records, workers=workers):
+            result.update(section=section, item=result['item'].get(key)
+                          if key else None)
+            yield result
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module runs many CLI operations on a single client.
+
+A script holds one operation per line (JSONL) or a YAML list of them:
+```
+{"section": "domain", "modifier": "add", "args": {"domain": "a.org"}}
+{"section": "mailbox", "modifier": "get", "args": "--all --limit 5"}
+```
+`args` are options without their leading dashes, a list of CLI
+arguments or a string of them. The menu, schema and connection pool
+are built once for all operations.
+'''
+
+import argparse
+import itertools
+import json
+import shlex
+import threading
+from mailcow.menu import build_parser
+from mailcow.query import apply_query
+from mailcow.utils import parallel, parse_fields, project
+
+
+class ParserError(ValueError):
+    '''Raised on invalid arguments of an operation'''
+
+
+class BatchParser(argparse.ArgumentParser):
+    '''
+    ArgumentParser raising ParserError instead of exiting, help and
+    usage become the error of the operation instead of being printed
+    '''
+    def error(self, message):
+        raise ParserError(message)
+
+    def exit(self, status=0, message=None):
+        raise ParserError(message or f'{self.prog} exited with {status}')
+
+    def print_help(self, file=None):
+        raise ParserError(self.format_help())
+
+    def print_usage(self, file=None):
+        raise ParserError(self.format_usage())
+
+
+def read_operations(stream):
+    '''
+    Yield operations of `stream` as (number, operation).
+    JSON lines are read one by one, other scripts are loaded as YAML.
+    '''
+    lines = (line for line in stream)
+    head = []
+
+    for line in lines:
+        head.append(line)
+        if line.strip() and not line.lstrip().startswith('#'):
+            break
+
+    if not head or not head[-1].lstrip().startswith('{'):
+        import yaml
+        script = yaml.safe_load(''.join(itertools.chain(head, lines)))
+        if not isinstance(script, list):
+            raise ValueError('YAML script must be a list of operations')
+        yield from enumerate(script, start=1)
+        return
+
+    for number, line in enumerate(itertools.chain(head, lines), start=1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield number, json.loads(line)
+
+
+def operation_argv(operation):
+    '''Return CLI arguments of `operation`'''
+    if not isinstance(operation, dict) or \
+            not operation.get('section') or not operation.get('modifier'):
+        raise ParserError('operation needs a section and a modifier')
+
+    args = operation.get('args') or []
+    argv = [operation['section'], operation['modifier']]
+
+    if isinstance(args, str):
+        return argv + shlex.split(args)
+    if isinstance(args, list):
+        return argv + [str(arg) for arg in args]
+
+    for option, value in args.items():
+        for value in value if isinstance(value, list) else [value]:
+            if value is None:
+                continue
+            if value is True:
+                argv.append(f'--{option}')
+            elif value is False:
+                argv.append(f'--no-{option}')
+            elif isinstance(value, dict):
+                argv.extend([f'--{option}', json.dumps(value)])
+            else:
+                argv.extend([f'--{option}', str(value)])
+
+    return argv
+
+
+def status(result):
+    '''Return `error` if any mailcow message of `result` failed'''
+    for entry in result if isinstance(result, list) else [result]:
+        if isinstance(entry, dict) and \
+                entry.get('type') in ['error', 'danger']:
+            return 'error'
+
+    return 'success'
+
+
+class Batch:
+    '''
+    Run operations of a script on a warm MailCow client.
+
+    Consecutive operations of the same section and modifier are
+    independent of each other and run with up to `workers` threads.
+    Every other operation waits until the ones before are done.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | moo | MailCow | Client running all operations |
+    | execute | Function | Called with `moo` and parsed arguments |
+    | workers | Integer | Parallel operations |
+    '''
+    def __init__(self, moo, execute, workers=1):
+        self.moo = moo
+        self.execute = execute
+        self.workers = workers
+        self.parsers = dict()
+        self.lock = threading.Lock()
+
+    def parser(self, section, modifier):
+        '''Return parser with arguments of `section` `modifier` only'''
+        with self.lock:
+            if (section, modifier) not in self.parsers:
+                self.parsers[section, modifier] = build_parser(
+                    self.moo.endpoints, argv=[section, modifier],
+                    parser_class=BatchParser)
+
+            return self.parsers[section, modifier]
+
+    def parse(self, operation):
+        '''Return parsed arguments of `operation`'''
+        argv = operation_argv(operation)
+        if argv[0] not in self.moo.endpoints:
+            raise ParserError(f'unknown section: {argv[0]}')
+
+        args = self.parser(*argv[:2]).parse_args(argv)
+        if args.modifier is None or vars(args).get('follow') or \
+                vars(args).get('items_from') == '-':
+            raise ParserError(f'invalid operation: {" ".join(argv)}')
+        # `--no-OPTION` is looked up in the arguments
+        args.argv = argv
+
+        return args
+
+    def run_one(self, numbered):
+        '''Run a single operation and return its result record'''
+        number, operation = numbered
+        record = dict(operation=number)
+        if isinstance(operation, dict):
+            record.update(section=operation.get('section'),
+                          modifier=operation.get('modifier'))
+
+        try:
+            args = self.parse(operation)
+            result = self.execute(self.moo, args)
+            if args.modifier == 'get' and (
+                    args.where or args.sort or args.limit is not None):
+                result = apply_query(
+                    result, args.where, parse_fields(args.sort), args.limit)
+            fields = parse_fields(vars(args).get('fields'))
+            if args.modifier == 'get' and fields:
+                result = project(result, fields)
+            if result is not None and \
+                    not isinstance(result, (list, dict, str, bytes)):
+                result = list(result)
+        except Exception as error:  # pylint: disable=broad-except
+            return dict(record, type='error', result=str(error))
+
+        if isinstance(result, bytes):
+            result = result.decode(errors='replace')
+
+        return dict(record, type=status(result), result=result)
+
+    def run(self, operations):
+        '''Yield a result record per operation in order'''
+        def key(numbered):
+            operation = numbered[1]
+            if not isinstance(operation, dict):
+                return numbered[0], None
+            return operation.get('section'), operation.get('modifier')
+
+        for _, group in itertools.groupby(operations, key=key):
+            yield from parallel(self.run_one, group, self.workers)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''This module caches data of mailcow instances'''
+
+import hashlib
+import json
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from os import getpid, path, makedirs, replace, utime
+from mailcow.utils import debug_msg
+
+MISSING = object()
+
+
+class FileCache:
+    '''
+    Directory holding cached JSON documents of a single mailcow instance.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | cache_dir | String | Base directory for all instances |
+    | server | String | Name of the config section describing the instance |
+    '''
+    def __init__(self, cache_dir, server):
+        name = re.sub(r'[^\w.-]', '_', server)
+        self.directory = path.join(path.expanduser(cache_dir), name)
+
+    def path(self, name):
+        '''Return location of document `name`'''
+        return path.join(self.directory, f'{name}.json')
+
+    def exists(self, name):
+        '''True if document `name` is cached'''
+        return path.exists(self.path(name))
+
+    def age(self, name):
+        '''Seconds since document `name` was written or touched'''
+        try:
+            return time.time() - path.getmtime(self.path(name))
+        except OSError:
+            return None
+
+    def load(self, name):
+        '''Return document `name` or None if it is missing or broken'''
+        try:
+            with open(self.path(name)) as cachefile:
+                return json.load(cachefile)
+        except (OSError, ValueError) as error:
+            debug_msg(f'Cache miss {self.path(name)}: {error}')
+            return None
+
+    def store(self, name, data):
+        '''Write document `name` atomically'''
+        makedirs(path.dirname(self.path(name)), exist_ok=True)
+        tmp = f'{self.path(name)}.{getpid()}.{threading.get_ident()}.tmp'
+
+        with open(tmp, 'w') as cachefile:
+            json.dump(data, cachefile, separators=(',', ':'), default=str)
+        replace(tmp, self.path(name))
+
+    def touch(self, name):
+        '''Mark document `name` as fresh'''
+        try:
+            utime(self.path(name))
+        except OSError:
+            pass
+
+    def remove(self, name):
+        '''Remove directory `name` and all documents below'''
+        shutil.rmtree(path.join(self.directory, name), ignore_errors=True)
+
+
+class SchemaCache(FileCache):
+    '''
+    Cache of the OpenApi schema of a mailcow instance.
+
+    The schema is stored parsed as JSON next to a small meta document
+    holding the validators (`ETag`, `Last-Modified`) of the response
+    and a hash of the schema's content. Endpoints derived from the
+    schema are stored as compiled index keyed by that hash.
+    '''
+    SCHEMA = 'openapi'
+    META = 'openapi.meta'
+    INDEX = 'endpoints'
+    INDEX_VERSION = 2
+
+    def meta(self):
+        '''Return validators and hash of the cached schema'''
+        return self.load(self.META) or {}
+
+    def fresh(self, ttl):
+        '''True if the cached schema is younger than `ttl` seconds'''
+        age = self.age(self.META)
+
+        return age is not None and age < ttl
+
+    def validators(self):
+        '''Return headers for a conditional GET of the schema'''
+        meta = self.meta()
+        headers = dict()
+
+        if meta.get('etag'):
+            headers.update({'If-None-Match': meta['etag']})
+        if meta.get('last_modified'):
+            headers.update({'If-Modified-Since': meta['last_modified']})
+
+        return headers
+
+    def schema(self):
+        '''Return cached schema or None'''
+        return self.load(self.SCHEMA)
+
+    def update(self, schema, content, headers):
+        '''Store a freshly downloaded schema and its validators'''
+        self.store(self.SCHEMA, schema)
+        self.store(self.META, {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'sha256': hashlib.sha256(content).hexdigest()})
+
+    def index(self):
+        '''Return compiled endpoints if they match the cached schema'''
+        index = self.load(self.INDEX)
+        checksum = self.meta().get('sha256')
+
+        if not index or index.get('version') != self.INDEX_VERSION:
+            return None
+        if not checksum or index.get('schema') != checksum:
+            return None
+
+        return index['endpoints']
+
+    def store_index(self, endpoints):
+        '''Store endpoints compiled from the cached schema'''
+        self.store(self.INDEX, {
+            'version': self.INDEX_VERSION,
+            'schema': self.meta().get('sha256'),
+            'endpoints': endpoints})
+
+
+class ResponseCache:
+    '''
+    LRU cache of GET results with time to live per section.
+    Entries are keyed by the requested path, ie. `domain/all`, and
+    expire after the TTL of their section (`domain`).
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | ttl | Integer | Default TTL in seconds, 0 disables caching |
+    | ttls | Dict | TTL per section overriding `ttl` |
+    | size | Integer | Maximum of entries kept in memory |
+    | disk | FileCache | Also store entries on disk if set |
+    '''
+    DIRECTORY = 'responses'
+
+    def __init__(self, ttl=0, ttls=None, size=128, disk=None):
+        self.default_ttl = ttl
+        self.ttls = ttls or {}
+        self.size = size
+        self.disk = disk
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def ttl(self, section):
+        '''Return TTL of `section`'''
+        return self.ttls.get(section.split('/')[0], self.default_ttl)
+
+    def _name(self, section):
+        '''Return name of the document caching `section` on disk'''
+        digest = hashlib.sha1(section.encode()).hexdigest()
+
+        return f'{self.DIRECTORY}/{section.split("/")[0]}/{digest}'
+
+    def get(self, section):
+        '''Return cached result of `section` or MISSING'''
+        ttl = self.ttl(section)
+        if ttl <= 0:
+            return MISSING
+
+        with self.lock:
+            entry = self.entries.get(section)
+            if entry and time.time() - entry[0] < ttl:
+                self.entries.move_to_end(section)
+                return entry[1]
+
+        if self.disk is not None:
+            age = self.disk.age(self._name(section))
+            document = self.disk.load(self._name(section)) \
+                if age is not None and age < ttl else None
+            if document and document.get('section') == section:
+                self._remember(section, document['data'], time.time() - age)
+                return document['data']
+
+        return MISSING
+
+    def set(self, section, data):
+        '''Cache `data` as result of `section`'''
+        if self.ttl(section) <= 0:
+            return
+
+        self._remember(section, data, time.time())
+        if self.disk is not None:
+            self.disk.store(
+                self._name(section), dict(section=section, data=data))
+
+    def _remember(self, section, data, timestamp):
+        '''Keep `data` in memory, dropping least recently used entries'''
+        with self.lock:
+            self.entries[section] = (timestamp, data)
+            self.entries.move_to_end(section)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, section):
+        '''Drop all cached results of `section`'''
+        base = section.split('/')[0]
+        debug_msg(f'Invalidate cached section: {base}')
+
+        with self.lock:
+            for key in [key for key in self.entries
+                        if key.split('/')[0] == base]:
+                del self.entries[key]
+
+        if self.disk is not None:
+            self.disk.remove(f'{self.DIRECTORY}/{base}')
+
+    def clear(self):
+        '''Drop all cached results'''
+        with self.lock:
+            self.entries.clear()
+
+        if self.disk is not None:
+            self.disk.remove(self.DIRECTORY)
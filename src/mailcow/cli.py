@@ -6,66 +6,328 @@
 
 '''This module represends CLI to interact with MailCow'''
 
+import itertools
 import sys
-from mailcow import MailCow
-from mailcow.globals import CONF, FIELDS
+from collections import deque
+from mailcow import MailCow, instrument
+from mailcow.columns import Columns
+from mailcow.globals import (
+    CONF, FIELDS, FOLLOW_WINDOW, FOR_EACH, TABLE_SAMPLE)
 from mailcow.menu import menu
 from mailcow.config import create_cfg
+from mailcow.output import (
+    flushing, write_csv, write_ndjson, write_table, write_tsv)
 from mailcow.utils import (
+    add_section,
     debug_mailcow,
     debug_msg,
     build_attributes,
     parse_fields,
-    prepare_getRequest)
+    prepare_getRequest,
+    project,
+    read_items)
+from mailcow.validate import ValidationError
 
 
-def main():
-    '''CLI manipulating mailcow instance'''
-    # Allow creation of example configuration file
-    # before building argparse menu
-    if '--create-example-config' in sys.argv:
-        create_cfg(CONF)
-        sys.exit(0)
+def schema_command(moo, args):
+    '''Handle `mailcow schema` commands'''
+    if args.modifier == 'compile':
+        moo.endpoints = moo.compile_endpoints(refresh=True)
+        meta = moo.schema_cache.meta()
+        print(f'Compiled {len(moo.endpoints)} sections of {moo.server} '
+              f'(schema {meta.get("sha256")}) '
+              f'into {moo.schema_cache.path(moo.schema_cache.INDEX)}')
 
-    moo = MailCow()
-    # add `--fields` argument before creating menu
-    for section, modifiers in moo.endpoints.items():
-        if 'get' in modifiers:
-            moo.endpoints[section]['get'].update(FIELDS)
-    args = menu(moo.endpoints)
+
+def apply_command(moo, args):
+    '''Handle `mailcow apply`'''
+    from mailcow.state import apply_plan, describe, load_state, plan_state
+
+    with (sys.stdin if args.state == '-' else open(args.state)) as stream:
+        state = load_state(stream)
+
+    plan = plan_state(moo, state, prune=args.prune, workers=args.workers)
+    if args.plan or not plan:
+        print(f'{len(plan)} change(s) needed', file=sys.stderr)
+        return list(describe(plan))
+
+    return list(apply_plan(
+        moo, plan, batch_size=args.batch_size, workers=args.workers))
+
+
+def export_command(moo, args):
+    '''Handle `mailcow export`'''
+    from mailcow.archive import export_archive
+    manifest = export_archive(
+        moo, args.directory, parse_fields(args.sections), args.workers)
+
+    return [dict(section=section, **entry)
+            for section, entry in manifest['sections'].items()]
+
+
+def import_command(moo, args):
+    '''Handle `mailcow import`'''
+    from mailcow.archive import import_archive, load_manifest, schema_changed
+    if schema_changed(moo, load_manifest(args.directory)):
+        print(f'Warning: {args.directory} was exported from a different '
+              f'schema than {moo.server} provides', file=sys.stderr)
+
+    results = import_archive(
+        moo, args.directory, parse_fields(args.sections), args.workers)
+
+    return results if args.ndjson or args.csv or args.tsv \
+        else list(results)
+
+
+def batch_command(moo, args):
+    '''Handle `mailcow batch`'''
+    from mailcow.batch import Batch, read_operations
+    batch = Batch(moo, execute, workers=args.workers)
+
+    def results():
+        with (sys.stdin if args.script == '-'
+              else open(args.script)) as stream:
+            yield from batch.run(read_operations(stream))
+
+    return results() if args.ndjson or args.csv or args.tsv \
+        else list(results())
+
+
+def report_command(moo, args):
+    '''Handle `mailcow report`'''
+    from mailcow.report import Report, split_arguments
+    try:
+        report = Report(
+            group_by=[spec for option in args.group_by or []
+                      for spec in split_arguments(option)],
+            aggregates=[spec for option in args.aggregate or []
+                        for spec in split_arguments(option)],
+            where=args.filter)
+    except ValueError as error:
+        sys.exit(f'report: {error}')
+
+    return report.extend(moo.streamRequest(args.path)).results()
+
+
+def bulk_command(moo, args):
+    '''
+    Handle `--items-from` for add, edit and delete. Lines that can't be
+    sent are reported as errors as soon as they are read.
+    '''
+    attrs = build_attributes(**vars(args), endpoints=moo.endpoints)
+    debug_msg(f'Attributes build: {attrs}')
+    options = dict(batch_size=args.batch_size, workers=args.workers)
+    rejected = deque()
+
+    def reject(number, line, error):
+        rejected.append(dict(item=line, type='error',
+                             msg=[f'line {number}: {error}']))
+
+    def records(items):
+        # attributes given as argument are defaults for every record
+        for item in items:
+            if isinstance(item, dict):
+                yield dict(attrs, **item)
+            else:
+                rejected.append(dict(item=item, type='error',
+                                     msg=['expected a JSON object']))
+
+    stream = sys.stdin if args.items_from == '-' else open(args.items_from)
+    items = read_items(stream, reject)
+
+    try:
+        if args.modifier == 'delete':
+            results = moo.bulk_delete(args.section, items, **options)
+        elif args.modifier == 'edit':
+            results = moo.bulk_edit(args.section, items, attrs, **options)
+        elif args.modifier == 'add':
+            results = moo.bulk_add(add_section(args.section),
+                                   records(items), workers=args.workers)
+        else:
+            raise ValueError(
+                f'--items-from is not supported by {args.modifier}')
+    except Exception:
+        if stream is not sys.stdin:
+            stream.close()
+        raise
+
+    def stream_results():
+        try:
+            for result in results:
+                while rejected:
+                    yield rejected.popleft()
+                yield result
+            yield from rejected
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    return stream_results() if args.ndjson or args.csv or args.tsv \
+        else list(stream_results())
+
+
+def check_command(moo, args):
+    '''Handle `--check` of `--items-from`, nothing is sent'''
+    from mailcow.validate import check_items
+    attrs = build_attributes(**vars(args), endpoints=moo.endpoints)
+    section = add_section(args.section) if args.modifier == 'add' \
+        else args.section
+
+    with (sys.stdin if args.items_from == '-'
+          else open(args.items_from)) as stream:
+        invalid = list(check_items(
+            moo.validators, section, args.modifier, stream, attrs))
+
+    print(f'{len(invalid)} invalid item(s) in {args.items_from}',
+          file=sys.stderr)
+    return invalid
+
+
+def for_each_command(moo, args):
+    '''Handle `--for-each-mailbox` and `--for-each-domain` for get'''
+    parent = 'mailbox' if args.for_each_mailbox else 'domain'
+    section, key = FOR_EACH[parent]
+    parents = moo.getRequest(section)
+    sections = dict()
+
+    for record in parents if isinstance(parents, list) else []:
+        kwargs = dict(vars(args), **{parent: record[key]})
+        sections.update({
+            prepare_getRequest(**kwargs, endpoints=moo.endpoints):
+            {parent: record[key]}})
+
+    return moo.get_many(sections, workers=args.workers)
+
+
+def follow_command(moo, args):
+    '''Handle `logs get --follow`'''
+    from mailcow.follow import LogFollower
+    section = prepare_getRequest(**vars(args), endpoints=moo.endpoints)
+    follower = LogFollower(
+        moo, section.split('/')[1],
+        count=FOLLOW_WINDOW if args.count is None else args.count,
+        interval=args.interval, max_interval=args.max_interval)
+
+    try:
+        if args.ndjson or args.csv or args.tsv:
+            moo.data = flushing(follower)
+            print_data(moo, args)
+        elif args.table and not (args.yaml or args.json):
+            # one table below a single header, sized by the first entries
+            batches = (batch for batch in follower.batches() if batch)
+            first = next(batches)
+            moo.data = flushing(itertools.chain.from_iterable(
+                itertools.chain([first], batches)))
+            print_data(moo, args, sample=len(first))
+        else:
+            for batch in follower.batches():
+                moo.data = batch
+                print_data(moo, args)
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+
+def execute(moo, args):
+    '''Send the request described by `args` and return its result'''
     args_as_dict = vars(args)
 
-    debug_mailcow(args.debug)
-    debug_msg(f'ArgParse Object: {args}')
-    for msg in [f'MailCow Server: {moo.server}',
-                f'MailCow Server URL: {moo.url}']:
-        debug_msg(msg)
+    if args_as_dict.get('items_from'):
+        return bulk_command(moo, args)
 
     if args.modifier == 'delete':
-        moo.data = moo.deleteRequest(args.section, args.items)
+        return moo.deleteRequest(args.section, args.items)
 
     if args.modifier == 'get':
-        moo.data = moo.getRequest(
+        if args.for_each_mailbox or args.for_each_domain:
+            return for_each_command(moo, args)
+        # filtered results are streamed unless they may be cached
+        if args.ndjson or args.csv or args.tsv or \
+                args.where and moo.response_cache is None:
+            return moo.streamRequest(
+                prepare_getRequest(**args_as_dict, endpoints=moo.endpoints))
+        if args.columnar:
+            return Columns(moo.streamRequest(
+                prepare_getRequest(**args_as_dict, endpoints=moo.endpoints)))
+        return moo.getRequest(
             prepare_getRequest(**args_as_dict, endpoints=moo.endpoints))
 
     attrs = build_attributes(**args_as_dict, endpoints=moo.endpoints)
     debug_msg(f'Attributes build: {attrs}')
 
     if args.modifier == 'add':
-        # /api/v1/add/transport/all - The only API endpoint that differ in uri
-        if args.section == 'transport':
-            section = 'transport/all'
-        else:
-            section = args.section
-
-        moo.data = moo.addRequest(section, attrs)
+        return moo.addRequest(add_section(args.section), attrs)
 
     if args.modifier == 'edit':
         # /api/v1/edit/mailq - The only API endpoint that's payload differ
         if args.section == 'mailq' and args.flush:
-            moo.data = moo.editRequest(args.section, action='flush')
-        else:
-            moo.data = moo.editRequest(args.section, args.items, attrs)
+            return moo.editRequest(args.section, action='flush')
+        return moo.editRequest(args.section, args.items, attrs)
+
+    return None
+
+
+def fleet_command(moo, args, **kwargs):
+    '''Handle `--servers` by sending the request to every server'''
+    from mailcow.fleet import MailCowFleet
+
+    if vars(args).get('items_from') == '-':
+        sys.exit('--servers can\'t read items from stdin, use a file')
+
+    def send(moo):
+        if args.no_cache:
+            moo.response_cache = None
+        if args.no_validate:
+            moo.validate = False
+        return execute(moo, args)
+
+    fleet = MailCowFleet(args.servers, deadline=args.deadline, **kwargs)
+    # the client used to build the menu is warm already
+    fleet.clients[moo.server] = moo
+    return fleet.run(send)
+
+
+def query_data(moo, args):
+    '''Apply `--where`, `--sort` and `--limit` to `moo.data`'''
+    query = dict(where=vars(args).get('where'),
+                 sort=parse_fields(vars(args).get('sort')),
+                 limit=vars(args).get('limit'))
+
+    if any(query.values()) or query['limit'] is not None:
+        try:
+            moo.query(**query)
+        except ValueError as error:
+            sys.exit(f'--where: {error}')
+
+
+def print_data(moo, args, sample=TABLE_SAMPLE):
+    '''
+    Print `moo.data` in the requested format. Table columns fit the
+    first `sample` records.
+    '''
+    query_data(moo, args)
+    fields = parse_fields(vars(args).get('fields'))
+    if fields:
+        moo.data = project(moo.data, fields)
+
+    # streaming formats write records as they arrive
+    for stream, write in [(args.ndjson, write_ndjson),
+                          (args.csv, write_csv),
+                          (args.tsv, write_tsv)]:
+        if stream and moo.data:
+            write([moo.data] if isinstance(moo.data, dict) else moo.data)
+            return
+
+    # tables are written while records arrive, widths are sampled
+    if args.table and not (args.yaml or args.json):
+        if moo.data:
+            write_table(moo.data, vertical=args.vertical, sample=sample)
+        return
+
+    # records filtered while streamed are collected for the formatters
+    if moo.data is not None and \
+            not isinstance(moo.data, (list, dict, str, bytes, Columns)):
+        moo.data = list(moo.data)
 
     if moo.data:
         if args.yaml:
@@ -74,18 +336,151 @@ def main():
         if args.json and not args.yaml:
             print(moo.as_json())
 
-        if args.table and not (args.yaml or args.json):
-            tables = moo.as_table(vertical=args.vertical)
 
-            for table in tables:
-                fields = parse_fields(
-                    args_as_dict.get('fields'),
-                    args.vertical)
+def daemon_command(moo, args, **kwargs):
+    '''Handle `mailcow daemon`'''
+    from mailcow.daemon import Clients, serve
+    clients = Clients()
+    clients.add(moo, **kwargs)
+
+    serve(clients, args.socket)
+
+
+def forwardable(argv):
+    '''
+    True if `argv` may be run by a daemon. Options are read like
+    argparse does: `--option=value`, unique prefixes of long options
+    and clusters of short ones. Reading stdin and following stay local.
+    '''
+    local = ['--no-daemon', '--create-example-config', '--follow']
+
+    for arg in argv[1:]:
+        name, _, value = arg.partition('=') if arg.startswith('--') \
+            else (arg, '', '')
+        if arg in ['daemon', '-'] or value == '-':
+            return False
+        if len(name) > 2 and any(option.startswith(name)
+                                 for option in local):
+            return False
+        # -f alone or among other flags, ie: -vf
+        if arg[:1] == '-' and arg[1:].isalpha() and 'f' in arg:
+            return False
+
+    return True
+
+
+def main(clients=None):
+    '''
+    CLI manipulating mailcow instance
+
+    Calls are forwarded to `mailcow daemon` if it's running.
+    The daemon itself passes its warm `clients`.
+    '''
+    # Allow creation of example configuration file
+    # before building argparse menu
+    if '--create-example-config' in sys.argv:
+        create_cfg(CONF)
+        sys.exit(0)
+
+    if clients is None and forwardable(sys.argv):
+        from mailcow.daemon import forward
+        code = forward(sys.argv)
+        if code is not None:
+            sys.exit(code)
+
+    profile = instrument.Profile() if '--profile' in sys.argv else None
+    if profile:
+        instrument.subscribe(profile)
+
+    try:
+        run(clients)
+    finally:
+        if profile:
+            instrument.unsubscribe(profile)
+            profile.print()
+
+
+def run(clients=None):
+    '''Build menu and handle the requested command'''
+    # Schema must be known before building argparse menu
+    kwargs = dict(offline=True) if '--offline' in sys.argv else dict()
+    moo = (clients or MailCow)(**kwargs)
+    # add `--fields` argument before creating menu
+    for section, modifiers in moo.endpoints.items():
+        if 'get' in modifiers:
+            moo.endpoints[section]['get'].update(FIELDS)
+    with moo.instrument.phase('menu'):
+        args = menu(moo.endpoints, instrument=moo.instrument)
+
+    debug_mailcow(args.debug)
+    debug_msg(f'ArgParse Object: {args}')
+    for msg in [f'MailCow Server: {moo.server}',
+                f'MailCow Server URL: {moo.url}']:
+        debug_msg(msg)
+
+    if args.no_cache:
+        moo.response_cache = None
+    if args.no_validate:
+        moo.validate = False
+
+    if args.section == 'schema':
+        schema_command(moo, args)
+        sys.exit(0)
+
+    if args.section == 'daemon':
+        daemon_command(moo, args, **kwargs)
+        sys.exit(0)
+
+    if args.section in ['export', 'import']:
+        command = export_command if args.section == 'export' \
+            else import_command
+        moo.data = command(moo, args)
+        failed = args.section == 'export' and \
+            any('error' in entry for entry in moo.data)
+        print_data(moo, args)
+        sys.exit(1 if failed else 0)
+
+    if args.section == 'batch':
+        moo.data = batch_command(moo, args)
+        print_data(moo, args)
+        sys.exit(0)
+
+    if args.section == 'report':
+        with moo.instrument.phase('request'):
+            moo.data = report_command(moo, args)
+        print_data(moo, args)
+        sys.exit(0)
+
+    if args.section == 'apply':
+        try:
+            moo.data = apply_command(moo, args)
+        # invalid plans, states and current objects
+        except ValueError as error:
+            sys.exit(str(error))
+        print_data(moo, args)
+        sys.exit(0)
+
+    if vars(args).get('follow'):
+        follow_command(moo, args)
+        sys.exit(0)
+
+    if vars(args).get('check') and args.items_from:
+        moo.data = check_command(moo, args)
+        print_data(moo, args)
+        sys.exit(1 if moo.data else 0)
+
+    with moo.instrument.phase('request'):
+        try:
+            if args.servers:
+                moo.data = fleet_command(
+                    moo, args, connect=clients or MailCow, **kwargs)
+            else:
+                moo.data = execute(moo, args)
+        except ValidationError as error:
+            sys.exit(str(error))
 
-                if fields:
-                    print(table.get_string(fields=fields))
-                else:
-                    print(table)
+    with moo.instrument.phase('render'):
+        print_data(moo, args)
 
 
 if __name__ == '__main__':
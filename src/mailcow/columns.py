@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module stores large results column by column.
+
+A list of dicts keeps a hash table per record. `Columns` keeps a list
+of values per field instead: integers are packed into arrays and
+repeated strings (hosts, programs, domains) share a single object.
+Records are rebuilt as dicts while iterating.
+'''
+
+from array import array
+
+MISSING = object()
+# stop sharing strings of a column once most of its values are unique
+SHARE_SAMPLE = 1024
+
+
+class Columns:
+    '''
+    Columnar container of records with the same or similar fields.
+
+    Example:
+    ```
+    moo = MailCow()
+    moo.data = Columns(moo.streamRequest('logs/postfix/1000000'))
+    print(moo.as_json())
+    ```
+    '''
+    def __init__(self, records=None):
+        self.fields = []
+        self.columns = dict()
+        self.shared = dict()
+        self.length = 0
+
+        if records is not None:
+            self.extend(records)
+
+    def _add_column(self, name):
+        '''Add column `name`, missing in all records so far'''
+        self.fields.append(name)
+        self.columns[name] = array('q') if not self.length \
+            else [MISSING] * self.length
+        self.shared[name] = dict()
+
+    def _store(self, name, value):
+        '''Append `value` to column `name`'''
+        column = self.columns[name]
+
+        if isinstance(column, array):
+            if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+                column.append(value)
+                return
+            column = self.columns[name] = list(column)
+
+        if isinstance(value, str):
+            shared = self.shared.get(name)
+            if shared is not None:
+                value = shared.setdefault(value, value)
+                if len(column) == SHARE_SAMPLE and \
+                        len(shared) > SHARE_SAMPLE // 2:
+                    del self.shared[name]
+
+        column.append(value)
+
+    def append(self, record):
+        '''Append `record`, a dict or any other value'''
+        if not isinstance(record, dict):
+            record = {'value': record}
+
+        for name in record:
+            if name not in self.columns:
+                self._add_column(name)
+        for name in self.fields:
+            self._store(name, record.get(name, MISSING))
+        self.length += 1
+
+    def extend(self, records):
+        '''Append all `records`, which may be streamed'''
+        for record in records:
+            self.append(record)
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+
+        return self._record(index)
+
+    def _record(self, index):
+        '''Rebuild record `index` as dict'''
+        record = dict()
+        for name in self.fields:
+            value = self.columns[name][index]
+            if value is not MISSING:
+                record[name] = value
+
+        return record
+
+    def __iter__(self):
+        columns = [(name, self.columns[name]) for name in self.fields]
+
+        for index in range(self.length):
+            record = dict()
+            for name, column in columns:
+                value = column[index]
+                if value is not MISSING:
+                    record[name] = value
+            yield record
+
+    def rows(self, missing=None):
+        '''Yield values of every record ordered like `fields`'''
+        columns = [self.columns[name] for name in self.fields]
+
+        for index in range(self.length):
+            yield [missing if column[index] is MISSING else column[index]
+                   for column in columns]
+
+    def column(self, name):
+        '''Return values of field `name`, None where it's missing'''
+        return [None if value is MISSING else value
+                for value in self.columns.get(name, [MISSING] * self.length)]
+
+    def project(self, fields):
+        '''
+        Return Columns holding `fields` only. Top level columns are
+        shared, nested ones (separated by dots) are extracted.
+        '''
+        projected = Columns()
+        projected.length = self.length
+
+        for name in fields:
+            keys = name.split('.')
+            if len(keys) == 1 and name in self.columns:
+                column = self.columns[name]
+                projected.columns[name] = [
+                    None if value is MISSING else value for value in column] \
+                    if isinstance(column, list) else column
+            else:
+                values = self.column(keys[0])
+                for key in keys[1:]:
+                    values = [value.get(key) if isinstance(value, dict)
+                              else None for value in values]
+                projected.columns[name] = values
+            projected.fields.append(name)
+
+        return projected
@@ -58,7 +58,8 @@ def create_cfg(file):
         'defaults': {
             'server': 'mail.example.com',
             'ssl_verify': True,
-            'timeout': 15
+            'timeout': 15,
+            'schema_ttl': 3600
         },
         'mail.example.com': {
             'url': 'https://mail.example.com',
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module keeps MailCow instances warm behind a UNIX socket.
+
+`mailcow daemon` serves CLI calls forwarded by `forward()`.
+Every call is a JSON line `{"argv": [...], "cwd": "..."}`, output is
+streamed back as JSON lines `{"out": "..."}` or `{"err": "..."}`
+followed by `{"exit": code}`.
+'''
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from mailcow.globals import DAEMON_SOCKET
+from mailcow.utils import debug_msg
+
+
+def socket_path(path=None):
+    '''Return location of the daemon's socket'''
+    return os.path.expanduser(
+        path or os.environ.get('MAILCOW_SOCKET', DAEMON_SOCKET))
+
+
+def forward(argv, path=None):
+    '''
+    Run `argv` by a running daemon and copy its output.
+    Returns the exit code or None if no daemon is listening.
+    '''
+    path = socket_path(path)
+    if not os.path.exists(path):
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError as error:
+        debug_msg(f'Daemon not reachable at {path}: {error}')
+        client.close()
+        return None
+
+    with client, client.makefile('rwb') as stream:
+        request = dict(argv=argv, cwd=os.getcwd())
+        stream.write(json.dumps(request).encode() + b'\n')
+        stream.flush()
+
+        for line in stream:
+            frame = json.loads(line)
+            if 'exit' in frame:
+                return frame['exit']
+            if 'out' in frame:
+                sys.stdout.write(frame['out'])
+            if 'err' in frame:
+                sys.stderr.write(frame['err'])
+
+    return 1
+
+
+class FrameWriter:
+    '''File object sending everything written as `channel` frame'''
+    def __init__(self, stream, channel):
+        self.stream = stream
+        self.channel = channel
+
+    def write(self, data):
+        '''Send `data` to the client'''
+        if data:
+            frame = json.dumps({self.channel: data})
+            self.stream.write(frame.encode() + b'\n')
+
+        return len(data)
+
+    def writelines(self, lines):
+        '''Send all `lines` as a single frame'''
+        self.write(''.join(lines))
+
+    def isatty(self):
+        '''The client's terminal is unknown, tables aren't shrunk'''
+        return False
+
+    def flush(self):
+        '''Flush socket stream'''
+        self.stream.flush()
+
+
+class Clients:
+    '''
+    Warm MailCow instances, one per distinct set of arguments.
+    Per call state is reset whenever an instance is handed out.
+    '''
+    def __init__(self):
+        self.instances = dict()
+        self.caches = dict()
+        self.validates = dict()
+
+    def add(self, moo, **kwargs):
+        '''Keep `moo` as instance created with `kwargs`'''
+        key = json.dumps(kwargs, sort_keys=True)
+        self.instances[key] = moo
+        self.caches[key] = moo.response_cache
+        self.validates[key] = moo.validate
+
+        return moo
+
+    def __call__(self, **kwargs):
+        key = json.dumps(kwargs, sort_keys=True)
+
+        if key not in self.instances:
+            from mailcow import MailCow
+            debug_msg(f'Daemon connects: {kwargs}')
+            self.add(MailCow(**kwargs), **kwargs)
+
+        moo = self.instances[key]
+        moo.data = None
+        moo.response_cache = self.caches[key]
+        moo.validate = self.validates[key]
+        moo.scheduler.mark()
+
+        # revalidate schema like a fresh process would do
+        if not (moo.offline or moo.schema_cache.fresh(moo.schema_ttl)):
+            moo.endpoints = moo._load_endpoints()  # noqa
+
+        return moo
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    '''Run a forwarded CLI call'''
+    def handle(self):
+        from mailcow import cli
+        request = json.loads(self.rfile.readline())
+        out = FrameWriter(self.wfile, 'out')
+        err = FrameWriter(self.wfile, 'err')
+        argv, cwd = sys.argv, os.getcwd()
+        code = 0
+
+        try:
+            sys.argv = request['argv']
+            os.chdir(request.get('cwd', cwd))
+            with redirect_stdout(out), redirect_stderr(err):
+                cli.main(clients=self.server.clients)
+        except SystemExit as exit_code:
+            code = exit_code.code
+            if isinstance(code, str):
+                err.write(f'{code}\n')
+                code = 1
+        except Exception:  # pylint: disable=broad-except
+            err.write(traceback.format_exc())
+            code = 1
+        finally:
+            sys.argv = argv
+            os.chdir(cwd)
+
+        self.wfile.write(json.dumps({'exit': code or 0}).encode() + b'\n')
+
+
+class Daemon(socketserver.UnixStreamServer):
+    '''
+    Serve forwarded CLI calls one after another.
+    The socket is only accessible by the current user.
+    '''
+    def __init__(self, path, clients):
+        self.clients = clients
+        self.path = path
+
+        if os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        umask = os.umask(0o077)
+        try:
+            super().__init__(path, DaemonHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def serve(clients, path=None):
+    '''Run daemon until interrupted or terminated'''
+    path = socket_path(path)
+    daemon = Daemon(path, clients)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f'mailcow daemon listening on {path}', flush=True)
+
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
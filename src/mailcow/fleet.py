@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Class for interaction with several mailcow instances at once'''
+
+import threading
+import time
+from mailcow.config import find_cfg, load_cfg
+from mailcow.globals import BACKOFF_FACTOR, CONF, RETRIES, SSL_TIMEOUT
+from mailcow.utils import debug_msg, merge_results
+
+
+def resolve_servers(servers, conf=CONF):
+    '''Return server names for `all`, a comma separated string or list'''
+    if servers == 'all':
+        find_cfg(conf)
+        return load_cfg(conf).sections()
+    if isinstance(servers, str):
+        servers = servers.split(',')
+
+    return [server.strip() for server in servers if server.strip()]
+
+
+def default_deadline(servers, conf=CONF, **kwargs):
+    '''
+    Return seconds the slowest of `servers` may take for a request
+    with all retries, from their config sections and `kwargs`.
+    '''
+    cfg = load_cfg(conf)
+    deadline = 0.0
+
+    for server in servers:
+        section = cfg[
+            server if cfg.has_section(server) else cfg.default_section]
+        timeout = kwargs.get(
+            'timeout', section.getfloat('timeout', SSL_TIMEOUT))
+        connect_timeout = kwargs.get(
+            'connect_timeout', section.getfloat('connect_timeout', timeout))
+        retries = kwargs.get(
+            'retries', section.getint('retries', RETRIES))
+        backoff_factor = kwargs.get(
+            'backoff_factor',
+            section.getfloat('backoff_factor', BACKOFF_FACTOR))
+        deadline = max(
+            deadline,
+            (connect_timeout + timeout) * (retries + 1) +
+            sum(backoff_factor * 2 ** retry for retry in range(retries)))
+
+    return deadline
+
+
+class MailCowFleet:
+    '''
+    Send the same request to several MailCow instances concurrently.
+    Results are tagged with the name of their `server` and merged.
+    Failing instances are reported as error records, slow ones don't
+    delay the results of the others longer than `deadline`. It
+    defaults to the longest timeouts with retries of the instances.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | servers | String/List | `all` or names of config sections |
+    | conf | String | Path to config file |
+    | deadline | Float | Seconds to wait for all instances |
+    | connect | Callable | Returns a client for `server=` (MailCow) |
+
+    Further arguments are passed to every MailCow instance.
+
+    Example:
+    ```
+    fleet = MailCowFleet(servers='all', deadline=60)
+    moo = MailCow()
+    moo.data = fleet.getRequest('quarantine')
+    print(moo.as_table())
+    ```
+    '''
+    def __init__(self, servers='all', conf=CONF, deadline=None,
+                 connect=None, **kwargs):
+        self.servers = resolve_servers(servers, conf)
+        self.deadline = default_deadline(self.servers, conf, **kwargs) \
+            if deadline is None else deadline
+        self.connect = connect
+        self.kwargs = kwargs if conf == CONF else dict(kwargs, conf=conf)
+        self.clients = dict()
+        self.lock = threading.Lock()
+
+    def client(self, server):
+        '''Return (warm) client of `server`'''
+        with self.lock:
+            moo = self.clients.get(server)
+
+        if moo is None:
+            if self.connect is None:
+                from mailcow import MailCow
+                self.connect = MailCow
+            moo = self.connect(server=server, **self.kwargs)
+            with self.lock:
+                self.clients[server] = moo
+
+        return moo
+
+    def run(self, func):
+        '''
+        Call `func` with the client of every server concurrently
+        and return merged results tagged with the server's name.
+        '''
+        results = dict()
+
+        def call(server):
+            try:
+                result = func(self.client(server))
+                # drain streamed results inside the worker
+                if not isinstance(result, (dict, list, str, bytes)) and \
+                        result is not None:
+                    result = list(result)
+            except Exception as error:  # pylint: disable=broad-except
+                debug_msg(f'{server} failed: {error}')
+                result = dict(type='error', msg=str(error))
+            results[server] = result
+
+        threads = [
+            threading.Thread(target=call, args=(server,), daemon=True)
+            for server in self.servers]
+        start = time.monotonic()
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(max(0, self.deadline - (time.monotonic() - start)))
+
+        tags = {server: {'server': server} for server in self.servers}
+        return merge_results(tags, [
+            results.get(server, dict(
+                type='error', msg=f'no response within {self.deadline}s'))
+            for server in self.servers])
+
+    def getRequest(self, section):
+        '''Send GET request to every instance'''
+        return self.run(lambda moo: moo.getRequest(section))
+
+    def addRequest(self, section, data=None):
+        '''Send PUT request to every instance'''
+        return self.run(lambda moo: moo.addRequest(section, data))
+
+    def editRequest(self, section=None, items=None, attr=None, action=None):
+        '''Send POST request to every instance'''
+        return self.run(
+            lambda moo: moo.editRequest(section, items, attr, action))
+
+    def deleteRequest(self, section, items):
+        '''Send DELETE request to every instance'''
+        return self.run(lambda moo: moo.deleteRequest(section, items))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''This module follows logs of a mailcow instance'''
+
+import json
+import time
+from collections import OrderedDict
+from mailcow.globals import (
+    FOLLOW_INTERVAL, FOLLOW_MAX_INTERVAL, FOLLOW_MAX_WINDOW, FOLLOW_WINDOW)
+from mailcow.utils import debug_msg
+
+
+class LogFollower:
+    '''
+    Poll a log for entries newer than the last one seen.
+
+    mailcow returns the newest `count` entries of a log. Only a small
+    window is requested per poll, it's widened while every entry of it
+    is new and shrinks back to about twice the entries of the last
+    poll. Entries are deduplicated by the newest timestamp seen and
+    their content. Polling backs off while the log is idle.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | moo | MailCow | Client of the instance |
+    | log | String | Name of the log, ie: postfix |
+    | count | Integer | Entries yielded before following, 0 for none |
+    | window | Integer | Entries requested per poll at least |
+    | max_window | Integer | Entries requested per poll at most |
+    | interval | Float | Seconds between polls while entries arrive |
+    | max_interval | Float | Seconds between polls while idle at most |
+
+    Example:
+    ```
+    moo = MailCow()
+    for entry in LogFollower(moo, 'postfix', count=10):
+        print(entry['message'])
+    ```
+    '''
+    TIME_KEYS = ['time', 'unix_time', 'datetime']
+
+    def __init__(self, moo, log, count=FOLLOW_WINDOW, window=FOLLOW_WINDOW,
+                 max_window=FOLLOW_MAX_WINDOW, interval=FOLLOW_INTERVAL,
+                 max_interval=FOLLOW_MAX_INTERVAL):
+        self.moo = moo
+        self.log = log
+        self.count = count
+        self.min_window = self.window = window
+        self.max_window = max_window
+        self.interval = interval
+        self.max_interval = max_interval
+        self.cursor = None
+        self.seen = OrderedDict()
+
+    @classmethod
+    def timestamp(cls, entry):
+        '''Return time of `entry` as number or None'''
+        if not isinstance(entry, dict):
+            return None
+
+        for key in cls.TIME_KEYS:
+            try:
+                return float(entry[key])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+        return None
+
+    def fetch(self, count):
+        '''Return newest `count` entries, bypassing cached results'''
+        entries = self.moo._request(  # noqa
+            url=f'{self.moo.request_url}/get/logs/{self.log}/{count}',
+            method='get')
+
+        return entries if isinstance(entries, list) else []
+
+    def fresh(self, entries):
+        '''Return entries not seen yet, oldest first'''
+        new = []
+
+        for entry in entries:
+            stamp = self.timestamp(entry)
+            if None not in (stamp, self.cursor) and stamp < self.cursor:
+                continue
+
+            fingerprint = json.dumps(entry, sort_keys=True)
+            if fingerprint not in self.seen:
+                new.append((stamp, fingerprint, entry))
+
+        # logs are returned newest first
+        new.reverse()
+        if all(stamp is not None for stamp, _, _ in new):
+            new.sort(key=lambda item: item[0])
+
+        return new
+
+    def remember(self, new):
+        '''Move cursor past `new` entries'''
+        for stamp, fingerprint, _ in new:
+            self.seen[fingerprint] = None
+            if stamp is not None:
+                self.cursor = max(stamp, self.cursor or stamp)
+
+        # older entries are skipped by timestamp anyway
+        while len(self.seen) > 2 * self.max_window:
+            self.seen.popitem(last=False)
+
+        return [entry for _, _, entry in new]
+
+    def poll(self):
+        '''Return new entries, widening the window if all are new'''
+        count = self.window
+
+        while True:
+            entries = self.fetch(count)
+            new = self.fresh(entries)
+            if len(new) < len(entries) or len(entries) < count or \
+                    count >= self.max_window:
+                break
+            count = min(2 * count, self.max_window)
+
+        self.window = min(self.max_window, max(self.min_window, 2 * len(new)))
+        debug_msg(f'Follow {self.log}: {len(new)} new of {len(entries)}, '
+                  f'next window {self.window}')
+
+        return self.remember(new)
+
+    def batches(self):
+        '''Yield lists of new entries forever'''
+        backlog = self.remember(self.fresh(self.fetch(max(1, self.count))))
+        if self.count and backlog:
+            yield backlog[-self.count:]
+
+        interval = self.interval
+        while True:
+            time.sleep(interval)
+            new = self.poll()
+
+            if new:
+                interval = self.interval
+                yield new
+            else:
+                interval = min(2 * interval, self.max_interval)
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
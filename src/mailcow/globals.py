@@ -8,9 +8,31 @@
 
 SSL_VERIFY = True
 SSL_TIMEOUT = 30
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+POOL_SIZE = 10
 CONF = '~/.config/python-mailcow.conf'
+CACHE_DIR = '~/.cache/python-mailcow'
+DAEMON_SOCKET = '~/.cache/python-mailcow/daemon.sock'
+SCHEMA_TTL = 3600
+CACHE_SIZE = 128
+CONCURRENCY = 10
+MAX_CONCURRENCY = 64
+RATE = 0
+BATCH_SIZE = 100
+WORKERS = 4
+CHUNK_SIZE = 65536
+FOLLOW_WINDOW = 20
+FOLLOW_MAX_WINDOW = 1000
+FOLLOW_INTERVAL = 1.0
+FOLLOW_MAX_INTERVAL = 30.0
+TABLE_SAMPLE = 1000
 FIELDS = {
     'fields': {
         'description': 'only display specified row(s)',
         'type': 'array'}
 }
+FOR_EACH = {
+    'mailbox': ('mailbox/all', 'username'),
+    'domain': ('domain/all', 'domain_name')
+}
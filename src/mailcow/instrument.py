@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module emits timing events of mailcow interaction.
+
+Events are dicts passed to hooks, ie. to feed Prometheus or StatsD:
+```
+from mailcow import instrument
+
+def hook(event):
+    if event['event'] == 'request':
+        histogram.labels(event['endpoint']).observe(event['duration'])
+
+instrument.subscribe(hook)
+```
+Hooks subscribed here receive events of all instances, hooks passed
+to `MailCow(hooks=[...])` only those of that instance.
+'''
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from mailcow.utils import debug_msg
+
+HOOKS = []
+_local = threading.local()
+
+
+def subscribe(hook):
+    '''Call `hook` with every event'''
+    HOOKS.append(hook)
+
+
+def unsubscribe(hook):
+    '''Stop calling `hook`'''
+    if hook in HOOKS:
+        HOOKS.remove(hook)
+
+
+def connection_timings(reset=False):
+    '''
+    Return timings of connections opened by the current thread.
+    Requests of a thread are sent one after another, so connections
+    opened between a reset and the response belong to that request.
+    '''
+    if reset or not hasattr(_local, 'timings'):
+        _local.timings = dict()
+
+    return _local.timings
+
+
+class Instrument:
+    '''
+    Emit events of a single mailcow instance to hooks.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | server | String | Name of the instance added to every event |
+    | hooks | List | Functions called with every event |
+    '''
+    def __init__(self, server=None, hooks=None):
+        self.server = server
+        self.hooks = list(hooks or [])
+
+    def subscribe(self, hook):
+        '''Call `hook` with every event of this instance'''
+        self.hooks.append(hook)
+
+    @property
+    def active(self):
+        '''True if any hook listens'''
+        return bool(self.hooks or HOOKS)
+
+    def emit(self, event, **fields):
+        '''Pass `event` to all hooks, failing hooks are ignored'''
+        if not self.active:
+            return
+
+        record = dict(event=event, server=self.server, **fields)
+        for hook in HOOKS + self.hooks:
+            try:
+                hook(record)
+            except Exception as error:  # pylint: disable=broad-except
+                debug_msg(f'Instrument hook {hook} failed: {error}')
+
+    @contextmanager
+    def phase(self, name):
+        '''Time local phase `name`'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.emit('phase', name=name,
+                      duration=time.perf_counter() - start)
+
+    def request(self, response, duration, endpoint, streamed=False,
+                waited=0.0, attempts=0):
+        '''
+        Emit timings of a requests response that took `duration`
+        seconds. Downloads of `streamed` responses aren't included.
+        `waited` seconds of `attempts` retried before the response
+        count as time to first byte.
+        '''
+        if not self.active:
+            return
+
+        timings = connection_timings()
+        connect = timings.get('connect', 0.0)
+        tls = timings.get('tls', 0.0)
+        elapsed = response.elapsed.total_seconds()
+        retries = getattr(response.raw, 'retries', None)
+        body = response.request.body or b''
+
+        self.emit(
+            'request',
+            method=response.request.method,
+            endpoint=endpoint,
+            status=response.status_code,
+            connect=connect,
+            tls=tls,
+            ttfb=max(0.0, waited + elapsed - connect - tls),
+            download=None if streamed
+            else max(0.0, duration - waited - elapsed),
+            duration=duration,
+            sent=len(body),
+            received=int(response.headers.get('Content-Length', 0))
+            if streamed else len(response.content),
+            retries=attempts + (len(retries.history) if retries else 0))
+
+
+class Profile:
+    '''
+    Hook collecting events into a phase and endpoint breakdown.
+
+    Example:
+    ```
+    profile = Profile()
+    moo = MailCow(hooks=[profile])
+    moo.getRequest('domain/all')
+    print(profile.as_table())
+    ```
+    '''
+    COLUMNS = ['connect', 'tls', 'ttfb', 'download', 'duration']
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.requests = OrderedDict()
+        self.schedulers = OrderedDict()
+
+    def __call__(self, event):
+        if event['event'] == 'schedule':
+            self.schedulers[event['server']] = event
+        if event['event'] == 'phase':
+            self.phases.setdefault(event['name'], []).append(
+                event['duration'])
+        if event['event'] == 'request':
+            key = (event['server'], event['method'], event['endpoint'])
+            self.requests.setdefault(key, []).append(event)
+
+    def rows(self):
+        '''Yield one row per phase and requested endpoint'''
+        for name, durations in self.phases.items():
+            yield dict(name=name, count=len(durations),
+                       duration=sum(durations))
+
+        for (server, method, endpoint), events in self.requests.items():
+            row = dict(
+                name=f'{method} {endpoint}', server=server,
+                count=len(events),
+                status=','.join(sorted({str(e['status']) for e in events})),
+                sent=sum(e['sent'] for e in events),
+                received=sum(e['received'] for e in events),
+                retries=sum(e['retries'] for e in events))
+            for column in self.COLUMNS:
+                row[column] = sum(e[column] or 0.0 for e in events)
+            yield row
+
+    def as_table(self):
+        '''Return breakdown as table, durations in milliseconds'''
+        from prettytable import PrettyTable
+        table = PrettyTable()
+        table.field_names = [
+            'phase', 'count', 'status', *self.COLUMNS[:-1], 'total ms',
+            'sent', 'received', 'retries']
+        table.align = 'r'
+        table.align['phase'] = 'l'
+
+        for row in self.rows():
+            table.add_row([
+                row['name'], row['count'], row.get('status', ''),
+                *[f'{row[column] * 1000:.1f}' if column in row else ''
+                  for column in self.COLUMNS],
+                row.get('sent', ''), row.get('received', ''),
+                row.get('retries', '')])
+
+        return table
+
+    def throughput(self):
+        '''Return throughput and limits of every server as table'''
+        from prettytable import PrettyTable
+        table = PrettyTable()
+        table.field_names = [
+            'server', 'requests', 'req/s', 'busy ms', 'latency ms',
+            'limit', 'lowest', 'overloads', 'queued ms', 'throttled ms']
+        table.align = 'r'
+        table.align['server'] = 'l'
+
+        for server, stats in self.schedulers.items():
+            table.add_row([
+                server, stats['requests'], f'{stats["throughput"]:.1f}',
+                *[f'{stats[key] * 1000:.1f}' for key in ['busy', 'latency']],
+                stats['limit'], stats['lowest'], stats['overloads'],
+                *[f'{stats[key] * 1000:.1f}'
+                  for key in ['queued', 'throttled']]])
+
+        return table
+
+    def print(self, out=None):
+        '''Print breakdown and throughput to `out` (stderr)'''
+        print(self.as_table(), file=out or sys.stderr)
+        if self.schedulers:
+            print(self.throughput(), file=out or sys.stderr)
@@ -8,12 +8,42 @@
 
 import argparse
 import sys
-from mailcow.globals import CONF
+from mailcow.globals import (
+    BATCH_SIZE, CONF, DAEMON_SOCKET, FOLLOW_INTERVAL, FOLLOW_MAX_INTERVAL,
+    WORKERS)
+from mailcow.instrument import Instrument
+from mailcow.utils import debug_msg
 
 
-def menu(sections=None):
-    '''Function building CLI menu'''
-    parser = argparse.ArgumentParser(
+def menu(sections=None, lazy=True, instrument=None):
+    '''
+    Function building CLI menu and parsing `sys.argv`
+
+    Parsing is reported as phase `parse` to `instrument`.
+    '''
+    instrument = instrument or Instrument()
+    parser = build_parser(sections, lazy)
+    with instrument.phase('parse'):
+        args = parser.parse_args()
+
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+
+    return args
+
+
+def build_parser(sections=None, lazy=True, argv=None,
+                 parser_class=argparse.ArgumentParser):
+    '''
+    Build CLI menu
+
+    If `lazy` is set only the section and modifier found in `argv`
+    (defaults to `sys.argv`) get their arguments. All other sections
+    are registered as stubs which keeps them in `--help` without
+    building their arguments.
+    '''
+    parser = parser_class(
         description='Interact with mailcow\'s API. ')
     parser.add_argument('--create-example-config', action='store_true',
                         dest='create_cfg', help='Create configuration file')
@@ -29,27 +59,245 @@ def menu(sections=None):
                         default=False, help='Print results as YAML')
     parser.add_argument('--table', '-t', action='store_true', dest='table',
                         default=True, help='Print results as Table')
+    parser.add_argument('--ndjson', action='store_true', dest='ndjson',
+                        default=False,
+                        help='Stream results as JSON, one per line')
+    parser.add_argument('--csv', action='store_true', dest='csv',
+                        default=False, help='Stream results as CSV')
+    parser.add_argument('--tsv', action='store_true', dest='tsv',
+                        default=False,
+                        help='Stream results as tab separated values')
+    parser.add_argument('--columnar', action='store_true', dest='columnar',
+                        default=False,
+                        help='Keep large results column by column')
     parser.add_argument('--debug', '-d', action='store_true', dest='debug',
                         default=False, help='Enable debugging')
+    parser.add_argument('--offline', action='store_true', dest='offline',
+                        default=False,
+                        help='Use cached OpenApi schema only')
+    parser.add_argument('--no-cache', action='store_true', dest='no_cache',
+                        default=False,
+                        help='Always request fresh results')
+    parser.add_argument('--no-validate', action='store_true',
+                        dest='no_validate', default=False,
+                        help='Send payloads without checking them')
+    parser.add_argument('--no-daemon', action='store_true', dest='no_daemon',
+                        default=False,
+                        help='Don\'t forward call to a running daemon')
+    parser.add_argument('--servers', action='store', dest='servers',
+                        default=None, metavar='all|SERVER,...',
+                        help='Send request to several config sections')
+    parser.add_argument('--deadline', action='store', dest='deadline',
+                        type=float, default=None, metavar='SECONDS',
+                        help='Stop waiting for slow servers (--servers), '
+                        'defaults to their timeouts with retries')
+    parser.add_argument('--profile', action='store_true', dest='profile',
+                        default=False,
+                        help='Print timings of phases and requests')
     section_subparser = parser.add_subparsers(dest='section')
 
     if isinstance(sections, dict):
+        # global options taking a value, their values aren't commands
+        options = [option for action in parser._actions  # noqa
+                   if action.nargs != 0 for option in action.option_strings]
+        wanted = peek_command(sections, argv=argv, options=options) \
+            if lazy else None
+
         for section, modifiers in sections.items():
             section_parser = section_subparser.add_parser(section)
+            if wanted and section != wanted[0]:
+                continue
+
             modify_subparser = section_parser.add_subparsers(dest='modifier')
 
             for modifier in modifiers:
                 modify_parser = modify_subparser.add_parser(modifier)
+                if wanted and modifier != wanted[1]:
+                    continue
+
                 arguments = modifiers[modifier]
                 build_argument(modify_parser, arguments)
+                if modifier in ['add', 'edit', 'delete']:
+                    build_bulk_argument(modify_parser)
+                if modifier == 'get':
+                    build_get_argument(modify_parser)
+                if modifier == 'get' and section == 'logs':
+                    build_follow_argument(modify_parser)
 
-    args = parser.parse_args()
+    build_commands(section_subparser)
 
-    if len(sys.argv) < 2:
-        parser.print_help()
-        sys.exit(1)
+    return parser
 
-    return args
+
+def peek_command(sections, argv=None, options=None):
+    '''
+    Find section and modifier in `argv` without parsing it.
+    Values of `options` are skipped.
+    Returns a tuple which may contain None if nothing was found.
+    '''
+    argv = sys.argv[1:] if argv is None else argv
+    options = options or ['--conf', '-c']
+    words = []
+    skip = False
+
+    for arg in argv:
+        if skip or arg in options:
+            skip = not skip
+            continue
+        if not arg.startswith('-'):
+            words.append(arg)
+
+    section = words[0] if words and words[0] in sections else None
+    modifier = words[1] if section and len(words) > 1 else None
+    debug_msg(f'Building menu for: {section} {modifier}')
+
+    return section, modifier
+
+
+def build_commands(subparser):
+    '''Build commands that are not provided by OpenApi'''
+    schema_parser = subparser.add_parser(
+        'schema', help='Manage cached OpenApi schema')
+    schema_subparser = schema_parser.add_subparsers(dest='modifier')
+    schema_subparser.add_parser(
+        'compile', help='Revalidate schema and rebuild endpoint index')
+
+    apply_parser = subparser.add_parser(
+        'apply', help='Add, edit and delete objects to match a state file')
+    apply_parser.add_argument(
+        'state', help='YAML file mapping sections to objects, - for stdin')
+    apply_parser.add_argument(
+        '--plan', action='store_true', dest='plan',
+        help='Only print changes that would be made')
+    apply_parser.add_argument(
+        '--prune', action='store_true', dest='prune',
+        help='Delete objects of declared sections missing in state')
+    apply_parser.add_argument(
+        '--batch-size', action='store', dest='batch_size', type=int,
+        default=BATCH_SIZE,
+        help='Items per edit or delete request. Defaults to: %(default)s')
+    apply_parser.add_argument(
+        '--workers', action='store', dest='workers', type=int,
+        default=WORKERS,
+        help='Parallel requests. Defaults to: %(default)s')
+
+    export_parser = subparser.add_parser(
+        'export', help='Write all sections into compressed files')
+    export_parser.add_argument(
+        'directory', help='Directory receiving a file per section')
+    import_parser = subparser.add_parser(
+        'import', help='Add all objects of an export')
+    import_parser.add_argument('directory', help='Directory of an export')
+    for archive_parser in [export_parser, import_parser]:
+        archive_parser.add_argument(
+            '--sections', action='append', dest='sections',
+            help='Only these sections, can be used multiple times')
+        archive_parser.add_argument(
+            '--workers', action='store', dest='workers', type=int,
+            default=WORKERS,
+            help='Parallel requests. Defaults to: %(default)s')
+
+    batch_parser = subparser.add_parser(
+        'batch', help='Run operations of a JSONL or YAML script')
+    batch_parser.add_argument(
+        'script', help='Operations {section, modifier, args}, - for stdin')
+    batch_parser.add_argument(
+        '--workers', action='store', dest='workers', type=int, default=1,
+        help='Parallel operations of the same section and modifier. '
+        'Defaults to: %(default)s')
+
+    report_parser = subparser.add_parser(
+        'report', help='Aggregate records of a GET request in one pass')
+    report_parser.add_argument(
+        'path', help='Requested section, ie: mailbox/all, logs/postfix/1000')
+    report_parser.add_argument(
+        '--group-by', action='append', dest='group_by',
+        metavar='EXPRESSION',
+        help='Group records by field or expression, '
+        'can be used multiple times')
+    report_parser.add_argument(
+        '--aggregate', action='append', dest='aggregate',
+        metavar='AGGREGATE',
+        help='count, share, count/sum/avg/min/max/median/p95(FIELD), '
+        'percentile(FIELD, 99.9), top(FIELD, 10). Defaults to: count')
+    report_parser.add_argument(
+        '--where', action='store', dest='filter', metavar='EXPRESSION',
+        help='Only aggregate records matching')
+    report_parser.add_argument(
+        '--sort', action='append', dest='sort', metavar='FIELD',
+        help='Sort groups by field(s), --sort=-FIELD for descending')
+    report_parser.add_argument(
+        '--limit', action='store', dest='limit', type=int,
+        help='Print the first LIMIT groups only')
+
+    daemon_parser = subparser.add_parser(
+        'daemon', help='Serve CLI calls by warm clients via UNIX socket')
+    daemon_parser.add_argument(
+        '--socket', action='store', dest='socket', default=None,
+        help=f'Defaults to: $MAILCOW_SOCKET or {DAEMON_SOCKET}')
+
+    return subparser
+
+
+def build_bulk_argument(data):
+    '''Build arguments for bulk operations'''
+    data.add_argument('--items-from', action='store', dest='items_from',
+                      metavar='FILE',
+                      help='Read items (delete, edit) or JSON objects (add) '
+                      'line by line from FILE or - for stdin')
+    data.add_argument('--batch-size', action='store', dest='batch_size',
+                      type=int, default=BATCH_SIZE,
+                      help='Items per request. Defaults to: %(default)s')
+    data.add_argument('--workers', action='store', dest='workers',
+                      type=int, default=WORKERS,
+                      help='Parallel requests. Defaults to: %(default)s')
+    data.add_argument('--check', action='store_true', dest='check',
+                      help='Only check items against the schema and '
+                      'print invalid lines, nothing is sent')
+
+    return data
+
+
+def build_get_argument(data):
+    '''Build arguments fanning out get requests'''
+    for_each = data.add_mutually_exclusive_group()
+    for_each.add_argument('--for-each-mailbox', action='store_true',
+                          dest='for_each_mailbox',
+                          help='Request section for every mailbox')
+    for_each.add_argument('--for-each-domain', action='store_true',
+                          dest='for_each_domain',
+                          help='Request section for every domain')
+    data.add_argument('--workers', action='store', dest='workers',
+                      type=int, default=WORKERS,
+                      help='Parallel requests. Defaults to: %(default)s')
+    data.add_argument('--where', action='store', dest='where',
+                      metavar='EXPRESSION',
+                      help='Only records matching, ie: '
+                      '"percent_in_use > 90 and domain == \'example.org\'"')
+    data.add_argument('--sort', action='append', dest='sort',
+                      metavar='FIELD',
+                      help='Sort by field(s), --sort=-FIELD for '
+                      'descending. Can be used multiple times.')
+    data.add_argument('--limit', action='store', dest='limit', type=int,
+                      help='Print the first LIMIT records only')
+
+    return data
+
+
+def build_follow_argument(data):
+    '''Build arguments following logs'''
+    data.add_argument('--follow', '-f', action='store_true', dest='follow',
+                      help='Keep printing new entries, --count sets '
+                      'the entries printed first')
+    data.add_argument('--interval', action='store', dest='interval',
+                      type=float, default=FOLLOW_INTERVAL,
+                      help='Seconds between polls. Defaults to: %(default)s')
+    data.add_argument('--max-interval', action='store', dest='max_interval',
+                      type=float, default=FOLLOW_MAX_INTERVAL,
+                      help='Seconds between polls while idle at most. '
+                      'Defaults to: %(default)s')
+
+    return data
 
 
 def build_argument(data, arguments):
@@ -72,7 +320,7 @@ def build_argument(data, arguments):
         if argument == 'active':
             values['type'] = 'boolean'
         # edit/fail2ban - only items that is actually a string
-        if argument == 'items' and values['type'] is not None:
+        if argument in ['items', 'fields'] and values['type'] is not None:
             action = 'append'
 
         # translating types into `actions` and `type`
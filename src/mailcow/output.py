@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module writes records while they are read.
+Nothing but the current record is kept in memory, tables keep the
+records sampled for their column widths.
+'''
+
+import csv
+import itertools
+import json
+import sys
+from mailcow.globals import TABLE_SAMPLE
+
+# columns aren't shrunk below, leaves room for `...`
+MIN_WIDTH = 6
+
+
+def flatten(value):
+    '''Convert `value` into a single CSV cell'''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    if value is None:
+        return ''
+
+    return value
+
+
+def flushing(records, out=None):
+    '''Flush `out` after every record was written'''
+    out = out or sys.stdout
+
+    for record in records:
+        yield record
+        out.flush()
+
+
+def write_ndjson(records, out=None):
+    '''Write one JSON document per record and line'''
+    out = out or sys.stdout
+
+    for record in records:
+        out.write(json.dumps(record, separators=(',', ':')))
+        out.write('\n')
+
+
+def write_csv(records, out=None, delimiter=','):
+    '''
+    Write records as CSV. The header is taken from the first record,
+    keys missing in later records are left empty.
+    '''
+    out = out or sys.stdout
+    writer = None
+
+    for record in records:
+        if not isinstance(record, dict):
+            record = dict(value=record)
+
+        if writer is None:
+            writer = csv.DictWriter(
+                out, fieldnames=list(record), delimiter=delimiter,
+                extrasaction='ignore', lineterminator='\n')
+            writer.writeheader()
+
+        writer.writerow(
+            {key: flatten(value) for key, value in record.items()})
+
+
+def write_tsv(records, out=None):
+    '''Write records as tab separated values'''
+    write_csv(records, out, delimiter='\t')
+
+
+def cell_width(text):
+    '''Return the columns `text` takes on a terminal'''
+    try:
+        text.encode('ascii')
+        return len(text)
+    except UnicodeEncodeError:
+        import unicodedata
+
+    return sum(0 if unicodedata.combining(char) else
+               2 if unicodedata.east_asian_width(char) in 'WF' else 1
+               for char in text)
+
+
+def clip(text, width):
+    '''Cut `text` to `width` columns, marking it with `...`'''
+    if cell_width(text) <= width:
+        return text
+
+    marker = '...' if width > len('...') else ''
+    text = text[:max(0, width - len(marker))]
+    while cell_width(text) > width - len(marker):
+        text = text[:-1]
+
+    return text + marker
+
+
+def justify(text, width):
+    '''Center `text` within `width` columns like PrettyTable does'''
+    excess = width - cell_width(text)
+    left = excess // 2 + (excess & width & 1)
+
+    return ' ' * left + text + ' ' * (excess - left)
+
+
+def table_widths(fields, rows, limit=None):
+    '''
+    Return column widths fitting `fields` and the lines of all `rows`.
+    Widest columns are shrunk until the table fits `limit` columns.
+    '''
+    widths = [cell_width(field) for field in fields]
+
+    for row in rows:
+        for index, lines in enumerate(row):
+            widths[index] = max(
+                widths[index], *[cell_width(line) for line in lines])
+
+    while limit and sum(widths) + 3 * len(widths) + 1 > limit:
+        widest = max(range(len(widths)), key=widths.__getitem__)
+        if widths[widest] <= MIN_WIDTH:
+            break
+        widths[widest] -= 1
+
+    return widths
+
+
+def table_lines(row, widths):
+    '''Yield the lines of `row`, its cells are lists of lines'''
+    for index in range(max(len(lines) for lines in row)):
+        yield '| ' + ' | '.join(
+            justify(clip(lines[index] if index < len(lines) else '', width),
+                    width)
+            for lines, width in zip(row, widths)) + ' |\n'
+
+
+def write_rows(out, fields, rows, sample, limit=None):
+    '''
+    Write a table of `fields` and `rows`. Widths are taken from the
+    first `sample` rows, cells of later rows are clipped to them.
+    '''
+    def cells(values):
+        return [str(value).split('\n') for value in values]
+
+    rows = iter(rows)
+    head = [cells(values) for values in itertools.islice(rows, sample)]
+    widths = table_widths(fields, head, limit)
+    border = '+' + '+'.join('-' * (width + 2) for width in widths) + '+\n'
+
+    out.write(border)
+    out.writelines(table_lines([[field] for field in fields], widths))
+    out.write(border)
+    for row in itertools.chain(head, map(cells, rows)):
+        out.writelines(table_lines(row, widths))
+    out.write(border)
+
+
+def write_table(records, out=None, vertical=False, sample=TABLE_SAMPLE,
+                width=None):
+    '''
+    Write records as table looking like PrettyTable's. Column widths
+    are taken from the first `sample` records, the other records are
+    streamed. Tables are fit to the terminal, or `width` if given.
+    Vertical tables show a record at once.
+    '''
+    out = out or sys.stdout
+    # sockets of the daemon aren't terminals
+    if width is None and getattr(out, 'isatty', lambda: False)():
+        import shutil
+        width = shutil.get_terminal_size().columns
+
+    records = (record if isinstance(record, dict) else dict(value=record)
+               for record in ([records] if isinstance(
+                   records, (dict, str, bytes)) else records))
+
+    if vertical:
+        for record in filter(None, records):
+            write_rows(out, ['Key', 'Value'], record.items(), len(record),
+                       limit=width)
+        return
+
+    head = list(itertools.islice(records, sample))
+    if not head:
+        return
+
+    fields = list(dict.fromkeys(
+        field for record in head for field in record))
+    if not fields:
+        return
+    write_rows(out, fields, (
+        [record.get(field, '') for field in fields]
+        for record in itertools.chain(head, records)),
+        len(head), limit=width)
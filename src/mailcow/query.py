@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module filters, sorts and limits records on the client side.
+
+Filters are python expressions over the fields of a record:
+```
+percent_in_use > 90 and domain == 'example.org'
+attributes.force_pw_update == '1' or match(username, '^admin')
+```
+Expressions are checked against a whitelist of syntax, rewritten to
+field lookups and compiled once into a predicate. Fields compared to
+numbers are compared as numbers, mailcow reports many as strings.
+The same expressions may compute values, ie. to group records by:
+```
+extract(message, 'from=<([^>]*)>')
+```
+'''
+
+import ast
+import heapq
+import itertools
+import re
+import sys
+from mailcow.columns import Columns
+
+NAN = float('nan')
+CONSTANTS = (ast.Constant,) if sys.version_info >= (3, 8) else (
+    ast.Constant, ast.Num, ast.Str, ast.NameConstant)
+ALLOWED = CONSTANTS + (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not,
+    ast.USub, ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt,
+    ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot, ast.Name, ast.Load,
+    ast.Attribute, ast.List, ast.Tuple, ast.Call)
+FUNCTIONS = {
+    'lower': lambda value: str(value).lower(),
+    'upper': lambda value: str(value).upper(),
+    'len': lambda value: len(value) if value is not None else 0,
+    'int': int,
+    'float': float,
+    'str': str,
+    'match': lambda value, pattern: re.search(
+        pattern, '' if value is None else str(value)) is not None,
+    'extract': lambda value, pattern: extract(value, pattern),
+}
+
+
+def field(record, keys):
+    '''Return nested field `keys` of `record` or None'''
+    value = record
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+
+    return value
+
+
+def extract(value, pattern):
+    '''Return first group (or match) of `pattern` in `value` or None'''
+    found = re.search(pattern, '' if value is None else str(value))
+    if found is None:
+        return None
+
+    return found.group(1) if found.re.groups else found.group(0)
+
+
+def number(value):
+    '''Return `value` as number, NaN never compares true'''
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def _numeric(node):
+    '''True if `node` is a number literal'''
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        node = node.operand
+    value = getattr(node, 'value', getattr(node, 'n', None))
+    return isinstance(node, CONSTANTS) and \
+        isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _call(name, *args):
+    '''Return AST calling helper `name`'''
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()),
+                    args=list(args), keywords=[])
+
+
+class _Fields(ast.NodeTransformer):
+    '''Rewrite names and attributes into field lookups of `_record`'''
+    def visit_Name(self, node):  # pylint: disable=invalid-name
+        return _call('_field', ast.Name(id='_record', ctx=ast.Load()),
+                     ast.Constant(value=(node.id,)))
+
+    def visit_Attribute(self, node):  # pylint: disable=invalid-name
+        keys = [node.attr]
+        while isinstance(node.value, ast.Attribute):
+            node = node.value
+            keys.insert(0, node.attr)
+        if not isinstance(node.value, ast.Name):
+            raise ValueError('Only fields may have attributes')
+        keys.insert(0, node.value.id)
+
+        return _call('_field', ast.Name(id='_record', ctx=ast.Load()),
+                     ast.Constant(value=tuple(keys)))
+
+    def visit_Call(self, node):  # pylint: disable=invalid-name
+        node.args = [self.visit(arg) for arg in node.args]
+        node.func = ast.Name(id=f'_{node.func.id}', ctx=ast.Load())
+        return node
+
+    def visit_UnaryOp(self, node):  # pylint: disable=invalid-name
+        node.operand = self.visit(node.operand)
+        if isinstance(node.op, ast.USub):
+            node.operand = _call('_number', node.operand)
+        return node
+
+    def visit_Compare(self, node):  # pylint: disable=invalid-name
+        operands = [node.left] + node.comparators
+        numeric = any(_numeric(operand) for operand in operands)
+        operands = [self.visit(operand) for operand in operands]
+        if numeric:
+            operands = [operand if _numeric(operand) else
+                        _call('_number', operand) for operand in operands]
+        node.left, node.comparators = operands[0], operands[1:]
+        return node
+
+
+def _validate(tree):
+    '''Raise ValueError for syntax outside the whitelist'''
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED):
+            raise ValueError(
+                f'{type(node).__name__} is not allowed in expressions')
+        name = getattr(node, 'id', getattr(node, 'attr', ''))
+        if isinstance(node, (ast.Name, ast.Attribute)) and \
+                name.startswith('_'):
+            raise ValueError(f'Invalid field {name}')
+        if isinstance(node, ast.Call) and not (
+                isinstance(node.func, ast.Name) and
+                node.func.id in FUNCTIONS and not node.keywords):
+            raise ValueError(
+                f'Only {", ".join(FUNCTIONS)} may be called')
+
+
+def _compile(expression):
+    '''Compile `expression` into a function evaluating a record'''
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as error:
+        raise ValueError(f'Invalid expression {expression!r}: {error.msg}')
+    _validate(tree)
+
+    wrapper = ast.parse('lambda _record: None', mode='eval')
+    wrapper.body.body = _Fields().visit(tree.body)
+    namespace = {f'_{name}': func for name, func in FUNCTIONS.items()}
+    namespace.update(
+        {'_field': field, '_number': number, '__builtins__': {}})
+
+    return eval(  # pylint: disable=eval-used
+        compile(ast.fix_missing_locations(wrapper), '<expression>', 'eval'),
+        namespace)
+
+
+def compile_where(expression):
+    '''
+    Compile `expression` into a predicate taking a record.
+    Raises ValueError if the expression is invalid.
+
+    Example:
+        over_quota = compile_where('percent_in_use > 90')
+        [mailbox for mailbox in mailboxes if over_quota(mailbox)]
+    '''
+    test = _compile(expression)
+
+    def predicate(record):
+        try:
+            return bool(test(record))
+        except (TypeError, ValueError, re.error):
+            return False
+
+    return predicate
+
+
+def compile_expression(expression):
+    '''
+    Compile `expression` into a function returning its value for a
+    record or None if it can't be evaluated.
+    Raises ValueError if the expression is invalid.
+
+    Example:
+        sender = compile_expression("extract(message, 'from=<(.*?)>')")
+        [sender(entry) for entry in moo.streamRequest('logs/postfix/100')]
+    '''
+    evaluate = _compile(expression)
+
+    def value(record):
+        try:
+            return evaluate(record)
+        except (TypeError, ValueError, re.error):
+            return None
+
+    return value
+
+
+class _Descending:
+    '''Invert ordering of a sort key'''
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _sortable(value):
+    '''Order numbers before strings before missing values'''
+    if value is None:
+        return (2, '')
+    converted = number(value)
+    if converted == converted:
+        return (0, converted)
+
+    return (1, str(value))
+
+
+def sort_key(fields):
+    '''
+    Return key function sorting by `fields`.
+    Fields prefixed with `-` are sorted descending.
+    '''
+    keys = [(name.lstrip('-').split('.'), name.startswith('-'))
+            for name in fields]
+
+    def key(record):
+        return tuple(
+            _Descending(_sortable(field(record, path))) if descending
+            else _sortable(field(record, path))
+            for path, descending in keys)
+
+    return key
+
+
+def apply_query(data, where=None, sort=None, limit=None):
+    '''
+    Filter `data` by expression `where`, order it by `sort` fields and
+    keep the first `limit` records. Iterables are filtered lazily,
+    sorting with a limit only keeps `limit` records in memory.
+    Columnar results stay columnar.
+    '''
+    if isinstance(data, Columns):
+        return Columns(apply_query(iter(data), where, sort, limit))
+
+    if isinstance(data, dict):
+        data = [data]
+    if data is None or isinstance(data, (str, bytes)):
+        return data
+
+    records = data
+    if where:
+        records = filter(compile_where(where), records)
+
+    if sort:
+        key = sort_key(sort)
+        if limit is not None:
+            return heapq.nsmallest(limit, records, key=key)
+        return sorted(records, key=key)
+
+    if limit is not None:
+        records = itertools.islice(records, limit)
+
+    return list(records) if isinstance(data, list) else records
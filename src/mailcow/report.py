@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module aggregates records in a single pass.
+
+Records are grouped by expressions (see `mailcow.query`) and every
+group keeps a small state per aggregate:
+```
+count, share, count(FIELD), sum(FIELD), avg(FIELD), min(FIELD),
+max(FIELD), p95(FIELD), median(FIELD), percentile(FIELD, 99.9),
+top(FIELD, 10)
+```
+Sums, averages and extremes are exact. Percentiles and top values
+are estimated by sketches of bounded size, so aggregating a log of
+millions of lines takes as much memory as one of thousands. Both are
+exact as long as a group has few records or values.
+
+Expressions and aggregates may be named: `sum(quota) as quota`.
+'''
+
+import heapq
+import json
+import random
+import re
+from mailcow.query import compile_expression, compile_where
+
+# items kept per level of a quantile sketch, rank error is about 1.5%
+QUANTILE_K = 200
+# values tracked per top(FIELD, k) are k * TOP_FACTOR at least
+TOP_FACTOR = 10
+TOP_MIN = 1000
+TOP_K = 10
+
+ALIAS = re.compile(r'^(.*\S)\s+as\s+(\w+)$', re.DOTALL)
+CALL = re.compile(r'^(\w+)\s*\((.*)\)$', re.DOTALL)
+PERCENTILE = re.compile(r'^p(\d{1,2})$')
+# compactions pick odd or even items, seeded for repeatable reports
+_coin = random.Random(0)
+
+
+def split_arguments(text):
+    '''Split `text` at commas outside of brackets and quotes'''
+    parts, depth, quote, start = [], 0, None, 0
+
+    for index, char in enumerate(text):
+        if quote:
+            if char == quote and text[index - 1] != '\\':
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+        elif char == ',' and not depth:
+            parts.append(text[start:index])
+            start = index + 1
+    parts.append(text[start:])
+
+    return [part.strip() for part in parts if part.strip()]
+
+
+def numeric(value):
+    '''Return `value` as int or float, None if it isn't a number'''
+    if isinstance(value, (int, float)):
+        return None if value != value else value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return None if value != value else value
+
+
+def hashable(value):
+    '''Return `value` usable as key, lists and dicts become JSON'''
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True, default=str)
+
+    return value
+
+
+class Counter:
+    '''Records or values that aren't None'''
+    __slots__ = ['count']
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value):
+        '''Count `value`'''
+        if value is not None:
+            self.count += 1
+
+
+class Summary:
+    '''Count, sum and extremes of numeric values'''
+    __slots__ = ['count', 'total', 'low', 'high']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.low = self.high = None
+
+    def add(self, value):
+        '''Add `value` if it's a number'''
+        value = numeric(value)
+        if value is None:
+            return
+
+        self.count += 1
+        self.total += value
+        if self.low is None or value < self.low:
+            self.low = value
+        if self.high is None or value > self.high:
+            self.high = value
+
+    def mean(self):
+        '''Return the average or None'''
+        return self.total / self.count if self.count else None
+
+
+class Quantiles:
+    '''
+    KLL sketch estimating quantiles of numeric values.
+
+    Values are buffered by the lowest level. A full level is sorted and
+    every other item is promoted to the next level, where it counts
+    twice. Levels between the buffer and the top keep fewer items the
+    lower they are, which bounds the sketch to about 4 * `k` items.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | k | Integer | Items kept by the top level |
+    '''
+    __slots__ = ['k', 'levels', 'capacities', 'size', 'limit']
+
+    def __init__(self, k=QUANTILE_K):
+        self.k = k
+        self.levels = [[]]
+        self.capacities = [k]
+        self.size = 0
+        self.limit = k
+
+    def add(self, value):
+        '''Add `value` if it's a number'''
+        value = numeric(value)
+        if value is None:
+            return
+
+        self.levels[0].append(value)
+        self.size += 1
+        if self.size >= self.limit:
+            self._compact()
+
+    def _grow(self):
+        '''Add a level on top and shrink the capacity of lower ones'''
+        self.levels.append([])
+        height = len(self.levels)
+        self.capacities = [self.k] + [
+            max(2, int(self.k * (2 / 3) ** (height - level - 1)))
+            for level in range(1, height)]
+        self.limit = sum(self.capacities)
+
+    def _compact(self):
+        '''Promote half of the items of full levels'''
+        for level, items in enumerate(self.levels):
+            if len(items) < self.capacities[level]:
+                continue
+            if level + 1 == len(self.levels):
+                self._grow()
+
+            items.sort()
+            # an odd item stays, it keeps its weight
+            rest = [items.pop()] if len(items) % 2 else []
+            promoted = items[_coin.randrange(2)::2]
+            self.levels[level + 1].extend(promoted)
+            self.size -= len(items) - len(promoted)
+            items[:] = rest
+
+            if self.size < self.limit:
+                break
+
+    def quantile(self, fraction):
+        '''Return the value of rank `fraction` (0 to 1) or None'''
+        weighted = sorted(
+            (value, 2 ** level)
+            for level, items in enumerate(self.levels) for value in items)
+        if not weighted:
+            return None
+
+        rank = fraction * sum(weight for _, weight in weighted)
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen >= rank:
+                return value
+
+        return weighted[-1][0]
+
+
+class Frequent:
+    '''
+    Space-Saving sketch finding the most frequent values.
+
+    Up to `capacity` values are counted. A new value replaces the one
+    counted least and inherits its count as possible error. Values
+    making up more than 1/`capacity` of all are never replaced. Counts
+    are reported without the error, they are exact for values counted
+    from their first occurrence and never too high.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | capacity | Integer | Values counted at once |
+    '''
+    __slots__ = ['capacity', 'counts', 'errors', 'heap', 'sequence']
+
+    def __init__(self, capacity=TOP_MIN):
+        self.capacity = capacity
+        self.counts = dict()
+        self.errors = dict()
+        # (count, sequence, value) per value, counts may lag behind
+        self.heap = []
+        self.sequence = 0
+
+    def add(self, value):
+        '''Count `value` if it isn't None'''
+        if value is None:
+            return
+        value = hashable(value)
+
+        if value in self.counts:
+            self.counts[value] += 1
+            return
+
+        self.sequence += 1
+        if len(self.counts) < self.capacity:
+            self.counts[value] = 1
+            self.errors[value] = 0
+            heapq.heappush(self.heap, (1, self.sequence, value))
+            return
+
+        # refresh lagging entries until the least counted is on top
+        while True:
+            count, _, victim = self.heap[0]
+            if self.counts[victim] == count:
+                break
+            self.sequence += 1
+            heapq.heapreplace(
+                self.heap, (self.counts[victim], self.sequence, victim))
+
+        del self.counts[victim], self.errors[victim]
+        self.counts[value] = count + 1
+        self.errors[value] = count
+        self.sequence += 1
+        heapq.heapreplace(self.heap, (count + 1, self.sequence, value))
+
+    def top(self, k):
+        '''Return the `k` most frequent values mapped to their counts'''
+        ranked = sorted(
+            ((value, count - self.errors[value])
+             for value, count in self.counts.items()),
+            key=lambda item: -item[1])
+
+        return dict(ranked[:k])
+
+
+class Aggregate:
+    '''
+    Parsed aggregate like `p95(latency) as slow`.
+    States are shared by aggregates of the same kind and field.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | spec | String | Aggregate function, its field and parameter |
+    '''
+    def __init__(self, spec):
+        self.name = spec.strip()
+        alias = ALIAS.match(self.name)
+        if alias:
+            spec, self.name = alias.groups()
+
+        call = CALL.match(spec.strip())
+        function, arguments = call.groups() if call else (spec.strip(), '')
+        arguments = split_arguments(arguments)
+        percentile = PERCENTILE.match(function)
+        if percentile:
+            function, arguments = 'percentile', \
+                (arguments or [None]) + [percentile.group(1)]
+        if function == 'median':
+            function, arguments = 'percentile', (arguments or [None]) + ['50']
+
+        self.function = function
+        self.field = arguments[0] if arguments else None
+        self.parameter = arguments[1] if len(arguments) > 1 else None
+        self._check(spec, arguments)
+
+    def _check(self, spec, arguments):
+        '''Raise ValueError if the aggregate is invalid'''
+        fields = 0 if self.function in ['count', 'share'] else 1
+        parameters = 1 if self.function in ['percentile', 'top'] else 0
+
+        if self.function not in [
+                'count', 'share', 'sum', 'avg', 'min', 'max',
+                'percentile', 'top']:
+            raise ValueError(f'Unknown aggregate {spec!r}')
+        if len(arguments) > 1 + parameters or \
+                fields and not self.field or \
+                self.function == 'share' and arguments or \
+                self.function == 'percentile' and self.parameter is None:
+            raise ValueError(f'Invalid arguments of {spec!r}')
+
+        try:
+            if self.function == 'percentile':
+                self.parameter = float(self.parameter)
+                if not 0 <= self.parameter <= 100:
+                    raise ValueError
+            if self.function == 'top':
+                self.parameter = int(self.parameter or TOP_K)
+                if self.parameter < 1:
+                    raise ValueError
+        except ValueError:
+            raise ValueError(f'Invalid parameter of {spec!r}')
+
+    def state(self):
+        '''Return key and factory of the state this aggregate reads'''
+        if self.function in ['count', 'share']:
+            return ('count', self.field), Counter
+        if self.function == 'percentile':
+            return ('quantiles', self.field), Quantiles
+        if self.function == 'top':
+            capacity = max(TOP_MIN, self.parameter * TOP_FACTOR)
+            return ('top', self.field, capacity), \
+                lambda: Frequent(capacity)
+
+        return ('summary', self.field), Summary
+
+    def result(self, state, total):
+        '''Return the value of this aggregate from `state`'''
+        if self.function == 'count':
+            return state.count
+        if self.function == 'share':
+            return state.count / total if total else None
+        if self.function == 'sum':
+            return state.total
+        if self.function == 'avg':
+            return state.mean()
+        if self.function == 'min':
+            return state.low
+        if self.function == 'max':
+            return state.high
+        if self.function == 'percentile':
+            return state.quantile(self.parameter / 100)
+
+        return state.top(self.parameter)
+
+
+class Report:
+    '''
+    Aggregate records grouped by expressions in a single pass.
+    Records are consumed as they arrive, only a state per group and
+    aggregate is kept.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | group_by | List | Expressions grouping records, ie: `domain` |
+    | aggregates | List | Aggregates per group, defaults to `count` |
+    | where | String | Only aggregate records matching this expression |
+
+    Example:
+    ```
+    moo = MailCow()
+    report = Report(group_by=['domain'],
+                    aggregates=['count', 'sum(quota_used)',
+                                'p95(percent_in_use)'])
+    report.extend(moo.streamRequest('mailbox/all'))
+    print(report.results())
+    ```
+    '''
+    def __init__(self, group_by=None, aggregates=None, where=None):
+        groups = [ALIAS.match(spec.strip()) or spec.strip()
+                  for spec in group_by or []]
+        self.group_names = [
+            spec if isinstance(spec, str) else spec.group(2)
+            for spec in groups]
+        self.group_values = [compile_expression(
+            spec if isinstance(spec, str) else spec.group(1))
+            for spec in groups]
+        self.aggregates = [Aggregate(spec) for spec in aggregates or
+                           ['count']]
+        names = self.group_names + [item.name for item in self.aggregates]
+        if len(set(names)) != len(names):
+            raise ValueError('Columns of a report must have unique names')
+
+        # one state per kind and field, every field is evaluated once
+        self.keys, self.factories, self.slots = [], [], []
+        for item in self.aggregates:
+            key, factory = item.state()
+            if key not in self.keys:
+                self.keys.append(key)
+                self.factories.append(factory)
+            self.slots.append(self.keys.index(key))
+        fields = list(dict.fromkeys(key[1] for key in self.keys))
+        self.field_values = [
+            compile_expression(field) if field else None
+            for field in fields]
+        self.field_slots = [fields.index(key[1]) for key in self.keys]
+
+        self.where = compile_where(where) if where else None
+        self.groups = dict()
+        self.total = 0
+
+    def update(self, record):
+        '''Add `record` to its group'''
+        if self.where is not None and not self.where(record):
+            return
+
+        key = tuple(hashable(value(record)) for value in self.group_values)
+        states = self.groups.get(key)
+        if states is None:
+            states = self.groups[key] = [
+                factory() for factory in self.factories]
+
+        values = [True if value is None else value(record)
+                  for value in self.field_values]
+        for state, slot in zip(states, self.field_slots):
+            state.add(values[slot])
+        self.total += 1
+
+    def extend(self, records):
+        '''Add all `records`, a single dict counts as one record'''
+        if isinstance(records, dict):
+            records = [records]
+
+        for record in records or []:
+            self.update(record)
+
+        return self
+
+    def _row(self, key, states):
+        '''Return record of the group `key` with its `states`'''
+        row = dict(zip(self.group_names, key))
+        for item, slot in zip(self.aggregates, self.slots):
+            row[item.name] = item.result(states[slot], self.total)
+
+        return row
+
+    def results(self):
+        '''Return a record per group holding its keys and aggregates'''
+        if not self.groups and not self.group_names:
+            # aggregates of nothing, ie. count 0
+            return [self._row((), [factory() for factory in self.factories])]
+
+        return [self._row(key, states)
+                for key, states in self.groups.items()]
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module builds the requests session used for mailcow interaction.
+It's imported when a session is established only.
+'''
+
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from mailcow.instrument import connection_timings
+from mailcow.utils import debug_msg
+
+RETRY_STATUS = (500, 502, 503, 504)
+
+
+class MailCowRetry(Retry):
+    '''
+    Retry policy with exponential backoff and full jitter.
+
+    Idempotent requests are retried on connection errors and on
+    `RETRY_STATUS`. mailcow uses POST for add, edit and delete, these
+    are only retried if they never reached the instance. Requests
+    rejected by rate limiting (429) are retried by `MailCow._send`
+    once the scheduler allows it, without holding a connection.
+    '''
+    def get_backoff_time(self):
+        '''Spread retries of parallel requests randomly'''
+        return random.uniform(0, super().get_backoff_time())
+
+
+class TimedHTTPConnection(HTTPConnection):
+    '''
+    Connection recording how long it took to be established.
+    Name resolution is part of `connect`, resolving separately
+    would double the lookups of every new connection.
+    '''
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            connection_timings()['connect'] = time.perf_counter() - start
+
+
+class TimedHTTPSConnection(TimedHTTPConnection, HTTPSConnection):
+    '''Connection recording connect and TLS handshake duration'''
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        timings = connection_timings()
+        timings['tls'] = max(
+            0.0, time.perf_counter() - start - timings.get('connect', 0.0))
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    '''Pool of timed HTTP connections'''
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    '''Pool of timed HTTPS connections'''
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    '''Adapter using timed connections'''
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool}
+
+
+def retry_policy(retries, backoff_factor):
+    '''Return retry policy for `retries` attempts'''
+    return MailCowRetry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS,
+        raise_on_status=False)
+
+
+def mount_adapter(session, pool_connections, pool_maxsize, max_retries):
+    '''Mount adapter with given pool sizes and retry policy'''
+    debug_msg(f'Request Session pool: {pool_connections}/{pool_maxsize}')
+    adapter = TimedAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=max_retries)
+
+    for prefix in ['http://', 'https://']:
+        session.mount(prefix, adapter)
+
+    return session
+
+
+def establish_session(verify, retries, backoff_factor,
+                      pool_connections, pool_maxsize):
+    '''Return keep-alive session with retry policy'''
+    session = requests.Session()
+    session.verify = verify
+
+    return mount_adapter(
+        session, pool_connections, pool_maxsize,
+        retry_policy(retries, backoff_factor))
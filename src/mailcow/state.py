@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module applies a declared state to a mailcow instance.
+
+A state maps sections to their desired objects:
+```
+domain:
+  - domain: example.org
+    description: Example
+mailbox:
+  - local_part: info
+    domain: example.org
+    password: secret
+    password2: secret
+alias:
+  - address: postmaster@example.org
+    goto: info@example.org
+```
+Current objects are fetched once per section and indexed by their
+natural key. Only differences are sent, edits with equal attributes
+share a request.
+'''
+
+import json
+from mailcow.globals import BATCH_SIZE, WORKERS
+from mailcow.utils import add_section, debug_msg, parallel
+from mailcow.validate import ValidationError
+
+MIB = 1024 * 1024
+
+# | key | Natural key of declared objects |
+# | current | Natural key in get results |
+# | item | Identifies objects in edit and delete requests |
+# | fields | Fields named differently in get results and their unit |
+SECTIONS = {
+    'domain': dict(
+        key='domain', current='domain_name', item='domain_name',
+        fields={
+            'domain': ('domain_name', 1),
+            'aliases': ('max_num_aliases_for_domain', 1),
+            'mailboxes': ('max_num_mboxes_for_domain', 1),
+            'defquota': ('def_quota_for_mbox', MIB),
+            'maxquota': ('max_quota_for_mbox', MIB),
+            'quota': ('max_quota_for_domain', MIB)}),
+    'mailbox': dict(
+        key='username', current='username', item='username',
+        fields={'quota': ('quota', MIB)}),
+    'alias': dict(key='address', current='address', item='id'),
+    'domain-admin': dict(key='username', current='username', item='username'),
+    'relayhost': dict(key='hostname', current='hostname', item='id'),
+    'transport': dict(key='destination', current='destination', item='id'),
+    'tls-policy-map': dict(key='dest', current='dest', item='id'),
+    'recipient_map': dict(
+        key='recipient_map_old', current='recipient_map_old', item='id'),
+}
+
+
+def load_state(stream):
+    '''Read state from YAML (or JSON) `stream`'''
+    import yaml
+    state = yaml.safe_load(stream) or {}
+
+    unknown = [section for section in state if section not in SECTIONS]
+    if unknown:
+        raise ValueError(
+            f'No natural key known for section(s): {", ".join(unknown)}. '
+            f'Supported: {", ".join(SECTIONS)}')
+
+    return state
+
+
+def declared(section, record):
+    '''Return natural key and payload of declared `record`'''
+    record = dict(record)
+
+    # mailboxes are added by local part and domain
+    if section == 'mailbox':
+        username = record.pop('username', None)
+        if username and 'local_part' not in record:
+            record['local_part'], record['domain'] = username.split('@', 1)
+        return f'{record.get("local_part")}@{record.get("domain")}', record
+
+    return record.get(SECTIONS[section]['key']), record
+
+
+def comparable(value):
+    '''Return `value` as mailcow reports it'''
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    if value is None:
+        return ''
+
+    return str(value)
+
+
+def current_value(section, record, field):
+    '''Return `field` of get result `record` or KeyError if unknown'''
+    name, unit = SECTIONS[section].get('fields', {}).get(field, (field, 1))
+    attributes = record.get('attributes') or {}
+
+    if name in record:
+        value = record[name]
+    elif name in attributes:
+        value = attributes[name]
+    else:
+        raise KeyError(field)
+
+    if unit != 1 and value not in (None, ''):
+        value = int(value) // unit
+
+    return value
+
+
+def differences(section, desired, current):
+    '''Return fields of `desired` that differ from `current`'''
+    changes = dict()
+
+    for field, value in desired.items():
+        try:
+            old = current_value(section, current, field)
+        except KeyError:
+            # write only fields like passwords can't be compared
+            continue
+        if comparable(old) != comparable(value):
+            changes[field] = [old, value]
+
+    return changes
+
+
+def current_records(section, current):
+    '''
+    Return records of the get result `current` of `section`.
+    Raises ValueError if it's an error or no list of records, planning
+    against it would add everything again and delete nothing known.
+    '''
+    key = SECTIONS[section]['current']
+
+    # a single object may be returned without a list
+    if isinstance(current, dict) and key in current:
+        current = [current]
+    if isinstance(current, dict) and \
+            current.get('type') in ['error', 'danger']:
+        raise ValueError(
+            f'Current {section} objects unavailable: {current.get("msg")}')
+    if not isinstance(current, list):
+        raise ValueError(
+            f'Current {section} objects unavailable: unexpected response '
+            f'{str(current)[:80]!r}')
+
+    return [record for record in current if isinstance(record, dict)]
+
+
+def plan_state(moo, state, prune=False, workers=WORKERS):
+    '''
+    Return changes needed to reach `state`.
+    Objects missing in `state` are only deleted if `prune` is set.
+    '''
+    sections = [section for section in SECTIONS if section in state]
+    results = parallel(
+        lambda section: moo.getRequest(f'{section}/all'), sections, workers)
+    plan = []
+
+    for section, current in zip(sections, results):
+        spec = SECTIONS[section]
+        index = {record[spec['current']]: record
+                 for record in current_records(section, current)
+                 if record.get(spec['current']) is not None}
+        debug_msg(f'State {section}: {len(index)} current objects')
+        wanted = set()
+
+        for record in state[section] or []:
+            key, record = declared(section, record)
+            wanted.add(key)
+
+            if key not in index:
+                plan.append(dict(
+                    action='add', section=section, key=key, record=record))
+                continue
+
+            changes = differences(section, record, index[key])
+            if changes:
+                plan.append(dict(
+                    action='edit', section=section, key=key,
+                    item=index[key].get(spec['item']), changes=changes))
+
+        if prune:
+            plan.extend(
+                dict(action='delete', section=section, key=key,
+                     item=record.get(spec['item']))
+                for key, record in index.items() if key not in wanted)
+
+    return plan
+
+
+def describe(plan):
+    '''Yield a printable row per change, passwords are masked'''
+    def show(field, value):
+        return '***' if 'pass' in field else comparable(value)
+
+    for change in plan:
+        if change['action'] == 'add':
+            details = ', '.join(
+                f'{field}={show(field, value)}'
+                for field, value in change['record'].items())
+        elif change['action'] == 'edit':
+            details = ', '.join(
+                f'{field}: {show(field, old)} -> {show(field, new)}'
+                for field, (old, new) in change['changes'].items())
+        else:
+            details = ''
+
+        yield dict(action=change['action'], section=change['section'],
+                   key=change['key'], item=change.get('item'),
+                   details=details)
+
+
+def check_plan(moo, plan):
+    '''
+    Raise ValidationError listing every invalid add and edit of `plan`.
+    Does nothing if validation of `moo` is disabled.
+    '''
+    if not moo.validate:
+        return
+
+    errors = []
+    for change in plan:
+        if change['action'] == 'add':
+            payload = change['record']
+        elif change['action'] == 'edit':
+            payload = {field: new for field, (_, new)
+                       in change['changes'].items()}
+        else:
+            continue
+        errors.extend(
+            f'{change["action"]} {change["section"]} {change["key"]}: '
+            f'{error}' for error in moo.validators.errors(
+                change['section'], change['action'], payload))
+
+    if errors:
+        raise ValidationError('apply', errors)
+
+
+def apply_plan(moo, plan, batch_size=BATCH_SIZE, workers=WORKERS):
+    '''
+    Send changes of `plan` and yield the result of every change.
+    Objects are added parents first (domains before mailboxes) and
+    deleted children first. Edits setting the same attributes are
+    sent together in batches of `batch_size`. The whole plan is
+    checked by `check_plan` before the first change is sent.
+    '''
+    check_plan(moo, plan)
+    order = list(SECTIONS)
+
+    for section in order:
+        changes = [change for change in plan if change['section'] == section]
+        adds = [change for change in changes if change['action'] == 'add']
+        for change, result in zip(adds, moo.bulk_add(
+                add_section(section),
+                [change['record'] for change in adds], workers=workers)):
+            yield dict(result, action='add', section=section,
+                       item=change['key'])
+
+        edits = dict()
+        for change in changes:
+            if change['action'] == 'edit':
+                attr = {field: new for field, (_, new)
+                        in change['changes'].items()}
+                edits.setdefault(
+                    json.dumps(attr, sort_keys=True), []).append(
+                        change['item'])
+        for attr, items in edits.items():
+            for result in moo.bulk_edit(
+                    section, items, json.loads(attr),
+                    batch_size=batch_size, workers=workers):
+                yield dict(result, action='edit', section=section)
+
+    for section in reversed(order):
+        items = [change['item'] for change in plan
+                 if change['section'] == section and
+                 change['action'] == 'delete']
+        if items:
+            for result in moo.bulk_delete(
+                    section, items, batch_size=batch_size, workers=workers):
+                yield dict(result, action='delete', section=section)
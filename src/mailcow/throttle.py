@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module schedules requests to a mailcow instance.
+
+A token bucket caps the request rate, an adaptive limit caps requests
+in flight. The limit follows AIMD: it grows by one per round trip
+while responses are fine and is halved once per round trip if the
+server answers 429 or 5xx, fails or gets much slower than usual.
+Slower means the recent latency (short moving average) exceeds the
+usual one (long moving average) by `tolerance`.
+
+Every overload also pauses new requests, for a round trip doubled
+with each overload in a row or as long as `Retry-After` asks.
+'''
+
+import threading
+import time
+from contextlib import contextmanager
+
+OVERLOAD_STATUS = (429, 500, 502, 503, 504)
+SHORT_WEIGHT = 0.2
+LONG_WEIGHT = 0.02
+# responses needed before latency is compared to the long average
+WARMUP = 50
+# seconds new requests are paused after overloads at most
+MAX_PAUSE = 30.0
+
+
+def overloaded(response):
+    '''True if `response` or one of its retries signals overload'''
+    if response.status_code in OVERLOAD_STATUS:
+        return True
+
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    return any(entry.status in OVERLOAD_STATUS or entry.error is not None
+               for entry in (retries.history if retries else []))
+
+
+def retry_after(response):
+    '''Return seconds of a `Retry-After` header or None'''
+    value = response.headers.get('Retry-After', '')
+
+    return float(value) if value.isdigit() else None
+
+
+class TokenBucket:
+    '''
+    Allow `rate` requests per second on average and `burst` at once.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | rate | Float | Requests per second |
+    | burst | Integer | Requests allowed at once, defaults to `rate` |
+    '''
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst or int(rate))
+        self.tokens = self.burst
+        self.clock = clock
+        self.stamp = clock()
+
+    def take(self):
+        '''Take a token, return 0 or seconds until one is available'''
+        now = self.clock()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+
+        return 0
+
+
+class Slot:
+    '''
+    Permission to send a request. Whether the server was `overloaded`
+    and asked to `retry_after` seconds is reported back.
+    '''
+    def __init__(self):
+        self.start = time.monotonic()
+        self.overloaded = False
+        self.retry_after = None
+
+
+class Scheduler:
+    '''
+    Limit rate and concurrency of requests to a single server.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | rate | Float | Requests per second, 0 disables the token bucket |
+    | burst | Integer | Requests allowed at once, defaults to `rate` |
+    | concurrency | Integer | Maximum of requests in flight |
+    | min_concurrency | Integer | Requests in flight on overload |
+    | tolerance | Float | Latency increase taken as overload |
+    | backoff | Float | Factor applied to the limit on overload |
+
+    Example:
+    ```
+    scheduler = Scheduler(rate=20, concurrency=8)
+    with scheduler.slot() as slot:
+        response = session.get(url)
+        slot.overloaded = overloaded(response)
+    print(scheduler.stats())
+    ```
+    '''
+    def __init__(self, rate=0, burst=None, concurrency=64,
+                 min_concurrency=1, tolerance=2.0, backoff=0.5):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.concurrency = max(1, concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, concurrency))
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.limit = float(self.concurrency)
+        self.inflight = 0
+        self.condition = threading.Condition()
+        self.event = None
+        # moving averages of latency, time of the last decrease,
+        # overloads in a row and end of the pause they caused
+        self.short = self.long = None
+        self.decreased = 0.0
+        self.streak = 0
+        self.resume = 0.0
+        # statistics
+        self.requests = self.overloads = 0
+        self.queued = self.throttled = self.busy = 0.0
+        self.busy_since = None
+        self.lowest = self.limit
+        self.marked = dict.fromkeys(
+            ('requests', 'overloads', 'busy', 'queued', 'throttled'), 0)
+
+    def _reserve(self):
+        '''
+        Count a request in flight if allowed. Returns 0 on success,
+        seconds to wait for a token or None to wait for a release.
+        '''
+        now = time.monotonic()
+        if now < self.resume:
+            return self.resume - now
+        if self.inflight >= max(self.min_concurrency, int(self.limit)):
+            return None
+        if self.bucket is not None:
+            wait = self.bucket.take()
+            if wait:
+                return wait
+
+        self.inflight += 1
+        if self.inflight == 1:
+            self.busy_since = now
+
+        return 0
+
+    def _waited(self, wait, seconds):
+        '''Account `seconds` spent waiting for a slot or a token'''
+        if wait is None:
+            self.queued += seconds
+        else:
+            self.throttled += seconds
+
+    def acquire(self):
+        '''Block until a request may be sent, return its Slot'''
+        with self.condition:
+            while True:
+                start = time.monotonic()
+                wait = self._reserve()
+                if wait == 0:
+                    return Slot()
+                self.condition.wait(wait)
+                self._waited(wait, time.monotonic() - start)
+
+    async def acquire_async(self):
+        '''Wait within the event loop until a request may be sent'''
+        import asyncio
+        if self.event is None:
+            self.event = asyncio.Event()
+
+        while True:
+            start = time.monotonic()
+            with self.condition:
+                wait = self._reserve()
+            if wait == 0:
+                return Slot()
+            if wait is None:
+                self.event.clear()
+                await self.event.wait()
+            else:
+                await asyncio.sleep(wait)
+            with self.condition:
+                self._waited(wait, time.monotonic() - start)
+
+    def release(self, slot):
+        '''Finish request of `slot` and adapt the limit'''
+        now = time.monotonic()
+
+        with self.condition:
+            self.inflight -= 1
+            self.requests += 1
+            if not self.inflight:
+                self.busy += now - self.busy_since
+            self._adapt(now - slot.start, slot, now)
+            self.condition.notify_all()
+
+        if self.event is not None:
+            self.event.set()
+
+    def _adapt(self, latency, slot, now):
+        '''Decrease limit on overload, increase it otherwise'''
+        if self.short is None:
+            self.short = self.long = latency
+        self.short += SHORT_WEIGHT * (latency - self.short)
+        self.long += LONG_WEIGHT * (latency - self.long)
+
+        # requests sent before the last decrease tell nothing new
+        fresh = slot.start >= self.decreased
+        if slot.overloaded:
+            self.overloads += 1
+        if slot.overloaded and fresh:
+            self.streak += 1
+            pause = min(MAX_PAUSE, self.short * 2 ** (self.streak - 1))
+            self.resume = max(
+                self.resume, now + max(pause, slot.retry_after or 0.0))
+        elif not slot.overloaded:
+            self.streak = 0
+
+        slow = self.requests > WARMUP and \
+            self.short > self.tolerance * self.long
+        if slot.overloaded or slow:
+            if fresh:
+                self.limit = max(
+                    float(self.min_concurrency), self.limit * self.backoff)
+                self.lowest = min(self.lowest, self.limit)
+                self.decreased = now
+        # grow only while the limit is used, by one per round trip
+        elif self.inflight + 1 >= int(self.limit):
+            self.limit = min(
+                float(self.concurrency), self.limit + 1 / self.limit)
+
+    @contextmanager
+    def slot(self):
+        '''Send a request within the context, failures are overload'''
+        slot = self.acquire()
+        try:
+            yield slot
+        except Exception:
+            slot.overloaded = True
+            raise
+        finally:
+            self.release(slot)
+
+    def _totals(self):
+        '''Counters since creation, busy time includes requests in flight'''
+        busy = self.busy
+        if self.inflight:
+            busy += time.monotonic() - self.busy_since
+
+        return dict(
+            requests=self.requests, overloads=self.overloads, busy=busy,
+            queued=self.queued, throttled=self.throttled)
+
+    def mark(self):
+        '''Count statistics from now on, e.g. per call of the daemon'''
+        with self.condition:
+            self.marked = self._totals()
+            self.lowest = self.limit
+
+    def stats(self):
+        '''Return requests sent, achieved throughput and limits since mark'''
+        with self.condition:
+            totals = self._totals()
+            stats = {key: value - self.marked[key]
+                     for key, value in totals.items()}
+            busy = stats['busy']
+            stats.update(
+                throughput=stats['requests'] / busy if busy else 0.0,
+                limit=int(self.limit),
+                lowest=int(self.lowest),
+                latency=self.short or 0.0)
+            return stats
@@ -6,9 +6,12 @@
 
 '''Utils for mailcow'''
 
+import json
 import re
 import sys
 import logging
+from collections import deque
+from mailcow.columns import Columns
 
 
 def chomp(data):
@@ -39,6 +42,7 @@ def build_attributes(**kwargs):
     Arguments:
         **(vars(args))      This function takes all arguments from argparse
         endpoints    (dict) Object provided by MailCowOpenApi()
+        argv         (list) Arguments parsed, defaults to sys.argv
 
     Example:
         moo = MailCow()
@@ -63,6 +67,7 @@ def build_attributes(**kwargs):
     endpoints = kwargs.get('endpoints')
     section = kwargs.get('section')
     modifier = kwargs.get('modifier')
+    argv = kwargs.get('argv') or sys.argv
     attrs = dict()
 
     for arg in endpoints[section][modifier]:
@@ -71,7 +76,7 @@ def build_attributes(**kwargs):
         # Bools must be converted into int str
         if isinstance(value, bool):
             # Hack avoid using argparse.BooleanOptionalAction as action
-            if f'--no-{arg}' in sys.argv:
+            if f'--no-{arg}' in argv:
                 value = False
             attrs.update({arg: str(int(value))})
         else:
@@ -83,27 +88,75 @@ def build_attributes(**kwargs):
     return attrs
 
 
-def parse_fields(fields, vertical):
+def parse_fields(fields):
     '''
     Splitts `fields` if necessary
 
     Attributes:
-        fields      (string)  Will be converted to list if splittable by ','
-        vertical    (boolean) Skip splitting if True
+        fields      (list)  Field names, each may be a commaseparated list
 
     Example:
         Incase someone use fields as commaseparated list ie:
         `[...] --fields address,goto` instead of
         `[...] --fields address --fields goto`
     '''
-    if fields and not vertical:
-        for field in fields:
-            fields = field.split(',') if ',' in field else fields
+    if isinstance(fields, str):
+        fields = [fields]
+
+    fields = [name.strip() for field in fields or []
+              for name in field.split(',') if name.strip()]
+    if fields:
         debug_msg(f'Filter Fields: {fields}')
 
     return fields
 
 
+def project(data, fields):
+    '''
+    Reduce records in `data` to `fields` before they are formatted.
+    Nested keys are separated by dots, ie: `attributes.quota`.
+    Lists are projected at once, other iterables lazily and columnar
+    results share their columns.
+
+    Example:
+        project([{'id': 5, 'goto': 'a@example.com', 'active': 1}],
+                ['id', 'goto'])
+        will return: [{'id': 5, 'goto': 'a@example.com'}]
+    '''
+    paths = [(field, field.split('.')) for field in fields]
+
+    def pick(record):
+        if not isinstance(record, dict):
+            return record
+
+        row = dict()
+        for field, keys in paths:
+            value = record.get(keys[0])
+            for key in keys[1:]:
+                value = value.get(key) if isinstance(value, dict) else None
+            row[field] = value
+
+        return row
+
+    if isinstance(data, list):
+        return [pick(record) for record in data]
+    if hasattr(data, 'project'):
+        return data.project(fields)
+    if isinstance(data, (dict, str, bytes)) or data is None:
+        return pick(data)
+
+    return map(pick, data)
+
+
+def add_section(section):
+    '''Return section used for add requests'''
+    # /api/v1/add/transport/all - The only API endpoint that differ in uri
+    if section == 'transport':
+        return 'transport/all'
+
+    return section
+
+
 def prepare_getRequest(**kwargs):
     '''
     Sections in /api​/v1​/get​/ require more manipulation.
@@ -159,6 +212,120 @@ def prepare_getRequest(**kwargs):
     return return_section
 
 
+def read_items(stream, invalid=None):
+    '''
+    Yield items from `stream` line by line.
+    Empty lines and comments are skipped, JSON objects or lists
+    are decoded and everything else is passed as string.
+    Invalid JSON raises ValueError, unless `invalid` is given:
+    it's called with line number, line and error and reading goes on.
+    '''
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+
+        if not line or line.startswith('#'):
+            continue
+        if line[0] not in '{[':
+            yield line
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as error:
+            if invalid is None:
+                raise
+            invalid(number, line, f'invalid JSON: {error}')
+            continue
+        yield item
+
+
+def chunked(iterable, size):
+    '''Yield lists of at most `size` elements from `iterable`'''
+    chunk = []
+
+    for element in iterable:
+        chunk.append(element)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def parallel(func, iterable, workers=1):
+    '''
+    Apply `func` to every element of `iterable` using `workers` threads.
+    Results are yielded in order. At most twice as many elements as
+    workers are in flight, so `iterable` may be a stream.
+    '''
+    if workers <= 1:
+        yield from map(func, iterable)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        for element in iterable:
+            pending.append(pool.submit(func, element))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def merge_results(sections, results):
+    '''
+    Merge `results` of GET requests into one list of records.
+    Records are tagged with the fields `sections` maps their section to.
+    Empty results are dropped.
+    '''
+    data = []
+
+    for section, result in zip(sections, results):
+        tags = sections[section]
+
+        for record in result if isinstance(result, (list, Columns)) \
+                else [result]:
+            if not record:
+                continue
+            if isinstance(record, dict):
+                record = dict(tags, **record)
+            data.append(record)
+
+    return data
+
+
+def split_response(items, response):
+    '''
+    Map mailcow's response of a request to each of its `items`.
+
+    mailcow answers with one message per item most of the time.
+    Otherwise every item gets all messages and the worst type.
+    '''
+    if isinstance(response, Exception):
+        response = dict(type='error', msg=str(response))
+    if not isinstance(response, list):
+        response = [response]
+
+    entries = [
+        entry if isinstance(entry, dict) else
+        dict(type='error', msg=entry.decode(errors='replace')
+             if isinstance(entry, bytes) else str(entry))
+        for entry in response]
+
+    if len(entries) != len(items):
+        types = [entry.get('type') for entry in entries]
+        failed = [kind for kind in types if kind != 'success']
+        entries = [dict(
+            type=failed[0] if failed else 'success',
+            msg=[entry.get('msg') for entry in entries])] * len(items)
+
+    for item, entry in zip(items, entries):
+        yield dict(item=item, type=entry.get('type'), msg=entry.get('msg'))
+
+
 def filterOpenApiPath(schema):
     '''filter out relevant dicts from OpenApi'''
     method = ''.join(schema)
@@ -223,6 +390,7 @@ def getOpenApiProperties(schema):
     properties = schema.get('properties', {})
     items = schema.get('items')
     attr = properties.get('attr')
+    required = list(schema.get('required') or [])
 
     # schema/items instead of schema/properties/items
     # missing in delete/{alias,dkim}
@@ -232,6 +400,7 @@ def getOpenApiProperties(schema):
     # move properties to top and remove redundant properties key
     if attr:
         properties.update(attr['properties'])
+        required.extend(attr.get('required') or [])
         del properties['attr']
 
     # https://github.com/mailcow/mailcow-dockerized/blob/master/data/web/api/openapi.yaml#L1024
@@ -241,36 +410,149 @@ def getOpenApiProperties(schema):
         properties.update({'password': properties['pasword']})
         del properties['pasword']
 
+    # flag required properties on copies, the schema shares anchors
+    for name in required:
+        name = 'password' if name == 'pasword' else name
+        if isinstance(properties.get(name), dict):
+            properties[name] = dict(properties[name], required=True)
+
     return properties
 
 
+def getOpenApiEndpoints(schema):
+    '''Return all endpoints provided by OpenApi `schema`'''
+    endpoints = dict()
+
+    for path in schema['paths'].keys():
+        path_schema = filterOpenApiPath(schema['paths'][path])
+        p = describeOpenApiPath(path)
+        section = p['section']
+        modifier = p['modifier']
+        arguments = dict()
+
+        if p.get('all') or p.get('parameter') == '{id}':
+            arguments.update(getOpenApiParameters('all'))
+
+        arguments.update(getOpenApiParameters(p.get('component')))
+        arguments.update(getOpenApiParameters(path_schema.get('parameters')))
+        arguments.update(getOpenApiProperties(path_schema.get('schema')))
+
+        if section not in endpoints.keys():
+            endpoints.update({section: dict()})
+
+        if modifier not in endpoints[section].keys():
+            endpoints[section].update({modifier: dict()})
+
+        endpoints[section][modifier].update(arguments)
+
+    return endpoints
+
+
+def log_response(response):
+    '''Log status and headers of response'''
+    for msg in [f'Request Status Code: {response.status_code}',
+                f'Request Headers: {response.headers}']:
+        debug_msg(msg)
+
+    color = '\x1b[0m'
+    if response.status_code < 400:
+        color = '\x1b[6;30;42m'  # green
+    if response.status_code >= 400:
+        color = '\x1b[6;30;43m'  # yellow
+    if response.status_code >= 500:
+        color = '\x1b[6;30;41m'  # red
+    end = '\x1b[0m'
+
+    debug_msg(f'API response {response.url}:'
+              f'{color} {response.status_code} {end}')
+
+
+def read_response(response):
+    '''Log response and return its decoded body'''
+    log_response(response)
+
+    if 'json' in response.headers.get('Content-Type', '') and \
+            len(response.content) > 0:
+        body = response.json()
+    else:
+        body = response.content
+
+    debug_msg(f'Request Content: {body}')
+    return body
+
+
+def _json_elements(buffer, decoder, final=False):
+    '''
+    Decode complete elements of a JSON array from `buffer`.
+    Returns decoded elements, the unconsumed rest and
+    whether the array has been closed.
+    '''
+    elements = []
+    pos = 0
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return elements, '', True
+
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            break
+        # numbers and literals may continue in the next chunk,
+        # ie. `2.` of `2.5`, until a delimiter follows them
+        if not final and (end == len(buffer) or (
+                not isinstance(element, (dict, list, str)) and
+                buffer[end] not in ' \t\r\n,]')):
+            break
+
+        elements.append(element)
+        pos = end
+
+    return elements, buffer[pos:], False
+
+
+def iter_json(chunks):
+    '''
+    Decode JSON from an iterable of byte `chunks` incrementally.
+    Elements of a top level array are yielded as soon as they are
+    complete, any other document is yielded once.
+    '''
+    import codecs
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    array = None
+
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+
+        if array is None:
+            buffer = buffer.lstrip()
+            if not buffer:
+                continue
+            array = buffer[0] == '['
+            if array:
+                buffer = buffer[1:]
+
+        if array:
+            elements, buffer, closed = _json_elements(buffer, decoder)
+            yield from elements
+            if closed:
+                return
+
+    buffer += text.decode(b'', final=True)
+
+    if array:
+        yield from _json_elements(buffer, decoder, final=True)[0]
+    elif buffer.strip():
+        yield json.loads(buffer)
+
+
 def validate_response(func):
     '''Decorator validating session responses'''
     def validate(*args, **kwargs):
-        response = func(*args, **kwargs)
-        for msg in [f'Request Status Code: {response.status_code}',
-                    f'Request Headers: {response.headers}']:
-            debug_msg(msg)
-
-        color = '\x1b[0m'
-        if response.status_code < 400:
-            color = '\x1b[6;30;42m'  # green
-        if response.status_code >= 400:
-            color = '\x1b[6;30;43m'  # yellow
-        if response.status_code >= 500:
-            color = '\x1b[6;30;41m'  # red
-        end = '\x1b[0m'
-
-        debug_msg(f'API response {response.url}:'
-                  f'{color} {response.status_code} {end}')
-
-        if 'json' in response.headers['Content-Type'] and \
-                len(response.content) > 0:
-            body = response.json()
-        else:
-            body = response.content
-
-        debug_msg(f'Request Content: {body}')
-        return body
+        return read_response(func(*args, **kwargs))
 
     return validate
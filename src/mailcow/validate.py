@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+This module checks payloads of add and edit requests locally.
+
+A validator is compiled once per endpoint from the properties found
+in the OpenApi schema: required fields, types, enums and formats.
+Types are checked as loosely as mailcow reads them, ie. booleans may
+be `"1"` and numbers may be strings of digits. Fields unknown to the
+schema are passed on, mailcow accepts more than it documents.
+'''
+
+import json
+import re
+import threading
+
+EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+HOSTNAME = re.compile(
+    r'^(?=.{1,253}\.?$)(?!-)[a-z0-9-]{1,63}(?<!-)'
+    r'(\.(?!-)[a-z0-9-]{1,63}(?<!-))*\.?$', re.IGNORECASE)
+DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+DATE_TIME = re.compile(
+    r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?'
+    r'(Z|[+-]\d{2}:?\d{2})?$', re.IGNORECASE)
+
+
+class ValidationError(ValueError):
+    '''Raised if a payload doesn't match the schema of its endpoint'''
+    def __init__(self, endpoint, errors):
+        self.endpoint = endpoint
+        self.errors = errors
+        super().__init__(f'Invalid payload for {endpoint}: '
+                         f'{"; ".join(errors)}')
+
+
+def _string(value):
+    '''Strings and numbers, mailcow reads the latter as strings'''
+    return isinstance(value, (str, int, float)) and \
+        not isinstance(value, bool)
+
+
+def _number(value):
+    '''Numbers and strings of numbers'''
+    if isinstance(value, (int, float)):
+        return True
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+
+    return True
+
+
+def _integer(value):
+    '''Whole numbers and strings of them'''
+    if isinstance(value, (int, bool)):
+        return True
+    try:
+        return float(value).is_integer()
+    except (TypeError, ValueError):
+        return False
+
+
+def _boolean(value):
+    '''Booleans, 0 and 1 as numbers or strings'''
+    if isinstance(value, bool) or value in (0, 1):
+        return True
+
+    return isinstance(value, str) and \
+        value.lower() in ['0', '1', 'true', 'false']
+
+
+def _ip(version):
+    '''Return check of IP addresses or networks of `version`'''
+    def check(value):
+        import ipaddress
+        try:
+            address = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            return False
+        return address.version == version
+
+    return check
+
+
+def _uri(value):
+    '''URIs with scheme and host'''
+    from urllib.parse import urlparse
+    parts = urlparse(value)
+
+    return bool(parts.scheme and parts.netloc)
+
+
+TYPES = {
+    'string': _string,
+    'number': _number,
+    'integer': _integer,
+    'boolean': _boolean,
+    'bool': _boolean,
+    # mailcow also takes comma separated strings
+    'array': lambda value: isinstance(value, (list, tuple, str)),
+    'object': lambda value: isinstance(value, dict),
+}
+FORMATS = {
+    'email': EMAIL.match,
+    'hostname': HOSTNAME.match,
+    'ipv4': _ip(4),
+    'ipv6': _ip(6),
+    'uri': _uri,
+    'url': _uri,
+    'date': DATE.match,
+    'date-time': DATE_TIME.match,
+}
+
+
+def normalize(value):
+    '''Return `value` as compared to enums, booleans become 0 or 1'''
+    if isinstance(value, bool):
+        return str(int(value))
+
+    return str(value)
+
+
+def compile_property(name, values):
+    '''
+    Return a function checking a value of property `name`.
+    It returns an error message or None.
+    '''
+    kind = values.get('type')
+    # mirrors the menu, active is a number in some sections
+    if name == 'active':
+        kind = 'boolean'
+    valid_type = TYPES.get(kind)
+    items = values.get('items') if isinstance(values.get('items'), dict) \
+        else {}
+    enum = values.get('enum') or items.get('enum')
+    choices = {normalize(choice) for choice in enum or []}
+    format_name = values.get('format') or items.get('format')
+    form = FORMATS.get(format_name)
+
+    def check(value):
+        if valid_type is not None and not valid_type(value):
+            return f'expected {kind}, got {json.dumps(value, default=str)}'
+
+        elements = value if isinstance(value, (list, tuple)) else [value]
+        for element in elements:
+            if choices and normalize(element) not in choices:
+                return f'{element!r} is not one of ' \
+                    f'{", ".join(sorted(choices))}'
+            if form is not None and isinstance(element, str) and \
+                    not form(element):
+                return f'{element!r} is not a valid {format_name}'
+
+        return None
+
+    return check
+
+
+def compile_validator(properties, partial=False):
+    '''
+    Return a function listing errors of a payload for `properties`.
+    Required properties may be missing if `partial` is set (edit).
+    '''
+    checks = {name: compile_property(name, values)
+              for name, values in properties.items()
+              if isinstance(values, dict)}
+    required = [] if partial else [
+        name for name, values in properties.items()
+        if isinstance(values, dict) and values.get('required')]
+
+    def validate(payload):
+        if not isinstance(payload, dict):
+            return [f'expected an object, got {type(payload).__name__}']
+
+        missing = [name for name in required
+                   if payload.get(name) in [None, '']]
+        errors = [f'{name}: missing' for name in missing]
+        for name, value in payload.items():
+            check = checks.get(name)
+            if check is None or value is None or name in missing:
+                continue
+            error = check(value)
+            if error:
+                errors.append(f'{name}: {error}')
+
+        return errors
+
+    return validate
+
+
+class Validators:
+    '''
+    Payload validators of `endpoints`, compiled on first use.
+
+    | Argument | Type | Description |
+    | -------- | ---- | ----------- |
+    | endpoints | Dict | Endpoints derived from the OpenApi schema |
+
+    Example:
+    ```
+    moo = MailCow()
+    validators = Validators(moo.endpoints)
+    validators.errors('domain', 'add', {'domain': 'example.org'})
+    # []
+    ```
+    '''
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+        self.compiled = dict()
+        self.lock = threading.Lock()
+
+    def validator(self, section, modifier):
+        '''Return validator of `section` `modifier` or None if unknown'''
+        section = section.split('/')[0]
+        key = (section, modifier)
+
+        with self.lock:
+            if key not in self.compiled:
+                properties = self.endpoints.get(section, {}).get(modifier)
+                self.compiled[key] = None if properties is None else \
+                    compile_validator(properties, modifier == 'edit')
+
+            return self.compiled[key]
+
+    def errors(self, section, modifier, payload):
+        '''Return errors of `payload` for `section` `modifier`'''
+        validate = self.validator(section, modifier)
+
+        return validate(payload) if validate else []
+
+    def check(self, section, modifier, payload):
+        '''Raise ValidationError if `payload` is invalid'''
+        errors = self.errors(section, modifier, payload)
+        if errors:
+            raise ValidationError(
+                f'{modifier}/{section.split("/")[0]}', errors)
+
+
+def check_items(validators, section, modifier, stream, attrs=None):
+    '''
+    Check items read line by line from `stream` without sending them.
+    JSON objects of `add` are merged into `attrs` first, the attributes
+    of `edit` are checked once. Yields a dict (line, item, type, msg)
+    per invalid line.
+    '''
+    if modifier == 'edit' and attrs:
+        errors = validators.errors(section, modifier, attrs)
+        if errors:
+            yield dict(line=None, item=None, type='error', msg=errors)
+
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        try:
+            item = json.loads(line) if line[0] in '{[' else line
+        except ValueError as error:
+            yield dict(line=number, item=line, type='error',
+                       msg=[f'invalid JSON: {error}'])
+            continue
+
+        if modifier != 'add':
+            continue
+        errors = validators.errors(
+            section, modifier,
+            dict(attrs or {}, **item) if isinstance(item, dict) else item)
+        if errors:
+            yield dict(line=number, item=item, type='error', msg=errors)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Fixtures shared by the tests'''
+
+import sys
+import threading
+from os import path
+import pytest
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(
+    path.abspath(__file__))), 'benchmarks'))
+
+# pylint: disable=wrong-import-position
+from mock_server import Dataset, MockServer  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    '''Mock server of mailcow's API running in a thread'''
+    mock = MockServer(('127.0.0.1', 0), Dataset(20, 20, 2))
+    thread = threading.Thread(target=mock.serve_forever, daemon=True)
+    thread.start()
+    mock.url = f'http://127.0.0.1:{mock.server_address[1]}'
+
+    yield mock
+
+    mock.shutdown()
+    mock.server_close()
+
+
+@pytest.fixture
+def conf(tmp_path, server):
+    '''Config file pointing to `server` with a fresh cache'''
+    conf = tmp_path / 'python-mailcow.conf'
+    conf.write_text(
+        f'[defaults]\nserver = test\n\n'
+        f'[test]\nurl = {server.url}\ntoken = test\n'
+        f'ssl_verify = false\ncache_dir = {tmp_path / "cache"}\n'
+        f'backoff_factor = 0\n')
+
+    return str(conf)
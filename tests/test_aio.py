@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of mailcow.aio against the mock server'''
+
+import asyncio
+import time
+import pytest
+from mock_server import Handler
+
+pytest.importorskip('aiohttp')
+
+# pylint: disable=wrong-import-position
+from mailcow.aio import AsyncMailCow  # noqa: E402
+from mailcow.validate import ValidationError  # noqa: E402
+
+DELAY = 0.1
+
+
+def run(coroutine):
+    '''Run `coroutine` in a new event loop'''
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def collect(results):
+    '''Return items of asynchronous iterator `results` as list'''
+    return [result async for result in results]
+
+
+class Unavailable(Handler):
+    '''Answer the first `server.failures` API requests late with 503'''
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.startswith('/api/v1/'):
+            with self.server.lock:
+                self.server.failures -= 1
+                failed = self.server.failures >= 0
+            if failed:
+                time.sleep(DELAY)
+                return self.reply(503, b'{}')
+        return super().do_GET()
+
+
+class Recorder:
+    '''Hook keeping emitted request events'''
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, event):
+        if event['event'] == 'request':
+            self.requests.append(event)
+
+
+def test_get_many(conf):
+    '''GET requests are sent concurrently and merged'''
+    async def main():
+        async with AsyncMailCow(conf=conf) as moo:
+            return await moo.get_many(
+                {f'mailbox/user{i}@domain{i % 2}.example.org': {'n': i}
+                 for i in range(5)})
+
+    results = run(main())
+
+    assert [result['n'] for result in results] == list(range(5))
+    assert results[3]['username'] == 'user3@domain1.example.org'
+
+
+def test_bulk(conf):
+    '''Bulk methods are asynchronous iterators yielding every item'''
+    async def main():
+        async with AsyncMailCow(conf=conf) as moo:
+            deleted = await collect(moo.bulk_delete(
+                'alias', [str(i) for i in range(7)], batch_size=3))
+            edited = await collect(moo.bulk_edit(
+                'alias', ['1', '2'], {'active': 0}))
+            added = await collect(moo.bulk_add('alias', [
+                {'address': 'a@example.org', 'goto': 'b@example.org',
+                 'active': 1}]))
+            return deleted, edited, added
+
+    deleted, edited, added = run(main())
+
+    assert [result['item'] for result in deleted] == \
+        [str(i) for i in range(7)]
+    assert {result['type'] for result in deleted + edited + added} == \
+        {'success'}
+    assert len(edited) == 2 and len(added) == 1
+
+
+def test_bulk_edit_validates_first(conf):
+    '''Invalid attributes raise before any request is sent'''
+    async def main():
+        async with AsyncMailCow(conf=conf) as moo:
+            moo.bulk_edit('alias', ['1'], {'active': 'maybe'})
+
+    with pytest.raises(ValidationError):
+        run(main())
+
+
+def test_stream_and_report(conf):
+    '''Streamed records are aggregated by the asynchronous report'''
+    async def main():
+        async with AsyncMailCow(conf=conf) as moo:
+            streamed = await collect(moo.streamRequest('alias/all'))
+            report = await moo.report(
+                group_by=['domain'], section='alias/all')
+            return streamed, report
+
+    streamed, report = run(main())
+
+    assert len(streamed) == 20
+    assert sorted(row['count'] for row in report) == [10, 10]
+
+
+def test_retry_server_errors(conf, server):
+    '''5xx answers are retried and the retries are reported'''
+    server.RequestHandlerClass = Unavailable
+    server.failures = 2
+    recorder = Recorder()
+
+    async def main():
+        async with AsyncMailCow(conf=conf, retries=3,
+                                hooks=[recorder]) as moo:
+            return await moo.getRequest('status/version')
+
+    assert run(main()) == {'version': '2021-01'}
+    assert recorder.requests[-1]['status'] == 200
+    assert recorder.requests[-1]['retries'] == 2
+    assert recorder.requests[-1]['duration'] >= 2 * DELAY
+    assert recorder.requests[-1]['ttfb'] >= 2 * DELAY
+
+
+def test_retries_exhausted(conf, server):
+    '''The last failing answer is returned once retries are used up'''
+    server.RequestHandlerClass = Unavailable
+    server.failures = 5
+    recorder = Recorder()
+
+    async def main():
+        async with AsyncMailCow(conf=conf, retries=1,
+                                hooks=[recorder]) as moo:
+            return await moo._send(  # pylint: disable=protected-access
+                url=f'{moo.request_url}/get/status/version', method='get')
+
+    assert run(main()).status_code == 503
+    assert recorder.requests[-1]['retries'] == 1
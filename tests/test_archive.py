@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of `mailcow export` and `mailcow import`'''
+
+import json
+import sys
+from os import path
+import pytest
+from mock_server import Handler
+from mailcow import MailCow
+from mailcow.cli import run
+
+
+class Denied(Handler):
+    '''Answer GET of all aliases like mailcow does without access'''
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path == '/api/v1/get/alias/all':
+            return self.reply(200, json.dumps(
+                {'type': 'danger', 'msg': 'access_denied'}).encode())
+        return super().do_GET()
+
+
+def export(conf, directory, monkeypatch, *options):
+    '''Run `mailcow export` and return exit code and manifest'''
+    monkeypatch.setattr(
+        sys, 'argv', ['mailcow', 'export', str(directory), *options])
+    with pytest.raises(SystemExit) as exit_info:
+        run(clients=lambda **kwargs: MailCow(conf=conf, **kwargs))
+
+    with open(path.join(str(directory), 'manifest.json')) as manifest:
+        return exit_info.value.code, json.load(manifest)
+
+
+def test_export(conf, tmp_path, monkeypatch):
+    '''Sections without get parameters are exported as well'''
+    code, manifest = export(conf, tmp_path / 'export', monkeypatch)
+    sections = manifest['sections']
+
+    assert code == 0
+    assert sections['fail2ban'] == dict(
+        request='fail2ban', file='fail2ban.ndjson.gz', records=0)
+    assert sections['alias']['records'] == 20
+    assert not any('error' in entry for entry in sections.values())
+
+
+def test_export_error(conf, server, tmp_path, monkeypatch):
+    '''Error answers are recorded as failed sections, not as records'''
+    server.RequestHandlerClass = Denied
+    directory = tmp_path / 'export'
+    code, manifest = export(
+        conf, directory, monkeypatch, '--sections', 'alias,domain')
+
+    assert code == 1
+    assert manifest['sections']['alias'] == dict(
+        request='alias/all', error="danger: access_denied")
+    assert manifest['sections']['domain']['records'] == 2
+    assert not (directory / 'alias.ndjson.gz').exists()
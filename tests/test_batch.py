@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of mailcow.batch'''
+
+import io
+from mailcow import MailCow
+from mailcow.batch import Batch, read_operations
+from mailcow.cli import execute
+
+SCRIPT = '''\
+{"section": "domain", "modifier": "get", "args": "--help"}
+{"section": "domain", "modifier": "add", "args": "--bogus"}
+{"section": "status", "modifier": "get", "args": "--version"}
+'''
+
+
+def test_help_is_an_error_record(conf, capsys):
+    '''Help and usage don't end the batch or reach the output'''
+    batch = Batch(MailCow(conf=conf), execute)
+    records = list(batch.run(read_operations(io.StringIO(SCRIPT))))
+
+    assert [record['type'] for record in records] == \
+        ['error', 'error', 'success']
+    assert 'usage:' in records[0]['result']
+    assert 'unrecognized arguments: --bogus' in records[1]['result']
+    assert records[2]['result'] == {'version': '2021-01'}
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of caching GET results'''
+
+import json
+import threading
+from mock_server import Handler
+from mailcow import MailCow
+from mailcow.cache import MISSING
+
+
+class Unauthorized(Handler):
+    '''Answer API requests with `server.error` until it's None'''
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.startswith('/api/v1/') and self.server.error:
+            status, body = self.server.error
+            return self.reply(status, json.dumps(body).encode())
+        return super().do_GET()
+
+
+class Slow(Handler):
+    '''Hold POST requests until `server.release` is set'''
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.server.posting.set()
+        self.server.release.wait(10)
+        return super().do_POST()
+
+
+def test_errors_are_not_cached(conf, server):
+    '''Error answers are returned but not cached'''
+    server.RequestHandlerClass = Unauthorized
+    moo = MailCow(conf=conf, cache_ttl=60, retries=0)
+
+    for error in [(401, {'type': 'error', 'msg': 'authentication failed'}),
+                  (200, {'type': 'danger', 'msg': 'access_denied'}),
+                  None]:
+        server.error = error
+        expected = error[1] if error else {'version': '2021-01'}
+        assert moo.getRequest('status/version') == expected
+
+    server.error = (401, {'type': 'error', 'msg': 'authentication failed'})
+    assert moo.getRequest('status/version') == {'version': '2021-01'}
+
+
+def test_invalidated_after_write(conf, server):
+    '''GETs answered while a write is in flight aren't kept'''
+    server.RequestHandlerClass = Slow
+    server.posting, server.release = threading.Event(), threading.Event()
+    moo = MailCow(conf=conf, cache_ttl=60)
+    writer = threading.Thread(
+        target=moo.editRequest, args=('alias', ['1'], {'active': 0}))
+
+    writer.start()
+    assert server.posting.wait(10)
+    moo.getRequest('alias/all')
+    server.release.set()
+    writer.join()
+
+    assert moo._cached('alias/all') is MISSING  # noqa
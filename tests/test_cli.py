@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of the CLI against the mock server'''
+
+import json
+import sys
+import pytest
+from mailcow import MailCow
+from mailcow.cli import forwardable, run
+
+
+@pytest.fixture
+def mailcow(conf, monkeypatch, capsys):
+    '''Return function running the CLI and its decoded NDJSON output'''
+    def call(*argv):
+        monkeypatch.setattr(sys, 'argv', ['mailcow', *argv])
+        code = 0
+        try:
+            run(clients=lambda **kwargs: MailCow(conf=conf, **kwargs))
+        except SystemExit as exit_info:
+            code = exit_info.code
+        out = capsys.readouterr().out
+        return code, [json.loads(line) for line in out.splitlines()]
+
+    return call
+
+
+def test_bulk_bad_lines(mailcow, tmp_path):
+    '''Lines that can't be sent become errors, the others are sent'''
+    items = tmp_path / 'aliases.jsonl'
+    items.write_text(
+        '{"address": "a@example.org", "goto": "b@example.org"}\n'
+        '["not", "an", "object"]\n'
+        '{"address": \n'
+        '# comment\n'
+        '{"address": "c@example.org", "goto": "b@example.org"}\n')
+
+    code, results = mailcow(
+        '--ndjson', 'alias', 'add', '--items-from', str(items))
+
+    assert code == 0
+    assert sorted(result['type'] for result in results) == \
+        ['error', 'error', 'success', 'success']
+    errors = [result for result in results if result['type'] == 'error']
+    assert {str(error['msg']) for error in errors} >= {
+        "['expected a JSON object']"}
+    assert any(error['msg'][0].startswith('line 3: invalid JSON')
+               for error in errors)
+
+
+def test_bulk_delete_bad_json(mailcow, tmp_path):
+    '''Malformed JSON doesn't stop deleting the other items'''
+    items = tmp_path / 'ids.txt'
+    items.write_text('1\n{"id": \n2\n')
+
+    code, results = mailcow(
+        '--ndjson', 'alias', 'delete', '--items-from', str(items))
+
+    assert code == 0
+    assert sorted((result['item'], result['type']) for result in results) \
+        == [('1', 'success'), ('2', 'success'), ('{"id":', 'error')]
+
+
+@pytest.mark.parametrize('argv, expected', [
+    (['alias', 'get', '--all'], True),
+    (['--json', 'mailbox', 'get', '--all', '--fields', 'username'], True),
+    (['--no-cache', 'domain', 'get', '--all'], True),
+    (['logs', 'get', '--postfix', '--count', '-5'], True),
+    (['daemon'], False),
+    (['--no-daemon', 'alias', 'get', '--all'], False),
+    (['--no-d', 'alias', 'get', '--all'], False),
+    (['alias', 'delete', '--items-from', '-'], False),
+    (['alias', 'delete', '--items-from=-'], False),
+    (['alias', 'delete', '--items=-'], False),
+    (['apply', '-'], False),
+    (['logs', 'get', '--postfix', '--follow'], False),
+    (['logs', 'get', '--postfix', '--fol'], False),
+    (['logs', 'get', '--postfix', '-f'], False),
+    (['-v', 'logs', 'get', '--postfix', '-jf'], False),
+])
+def test_forwardable(argv, expected):
+    '''Stdin and follow aren't forwarded, however they are spelled'''
+    assert forwardable(['mailcow', *argv]) is expected
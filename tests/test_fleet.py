@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of mailcow.fleet'''
+
+import time
+from mailcow.fleet import MailCowFleet
+
+
+class Client:
+    '''Client answering GET requests after `delay` seconds'''
+    def __init__(self, server, delay=0.0, **kwargs):
+        self.server = server
+        self.delay = delay
+
+    def getRequest(self, section):  # pylint: disable=invalid-name
+        '''Answer `section` late'''
+        time.sleep(self.delay)
+        return [{'section': section}]
+
+
+def test_default_deadline(conf):
+    '''Without a deadline the fleet waits for timeouts with retries'''
+    fleet = MailCowFleet(['test'], conf=conf, connect=Client)
+    assert fleet.deadline == (30 + 30) * 4
+
+    fleet = MailCowFleet(['test', 'other'], conf=conf, connect=Client,
+                         timeout=0.1, connect_timeout=0.05, retries=1,
+                         backoff_factor=0.2)
+    assert abs(fleet.deadline - 0.5) < 1e-9
+
+
+def test_slow_servers_are_reported(conf):
+    '''Servers answering after the deadline become error records'''
+    def connect(server, **kwargs):
+        return Client(server, delay=5 if server == 'slow' else 0, **kwargs)
+
+    fleet = MailCowFleet(['test', 'slow'], conf=conf, connect=connect,
+                         timeout=0.1, connect_timeout=0.1, retries=0)
+    start = time.monotonic()
+    results = fleet.getRequest('domain')
+
+    assert time.monotonic() - start < 1
+    assert results[0] == {'server': 'test', 'section': 'domain'}
+    assert results[1]['server'] == 'slow'
+    assert results[1]['type'] == 'error'
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Budget of the CLI's import time, see benchmarks/importtime.py'''
+
+import os
+from os import path
+from importtime import BUDGET, FORBIDDEN, MODULE, importtime
+
+SRC = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'src')
+
+
+def test_import_budget(monkeypatch):
+    '''The bare CLI imports within budget and without heavy modules'''
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join(
+        filter(None, [SRC, os.environ.get('PYTHONPATH')])))
+    # best of three to keep a busy machine from failing the check
+    runs = [importtime(MODULE) for _ in range(3)]
+    times = min(runs, key=lambda run: run[MODULE])
+
+    assert not {name.split('.')[0] for name in times} & set(FORBIDDEN)
+    assert times[MODULE] / 1000 <= BUDGET
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of request timings and scheduler statistics'''
+
+import time
+from mock_server import Handler
+from mailcow import MailCow, instrument
+from mailcow.daemon import Clients
+
+DELAY = 0.2
+
+
+class Limited(Handler):
+    '''Answer the first `server.failures` API requests late with 429'''
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.startswith('/api/v1/'):
+            with self.server.lock:
+                self.server.failures -= 1
+                failed = self.server.failures >= 0
+            if failed:
+                time.sleep(DELAY)
+                return self.reply(429, b'{}')
+        return super().do_GET()
+
+
+class Recorder:
+    '''Hook keeping emitted events by name'''
+    def __init__(self):
+        self.events = {}
+
+    def __call__(self, event):
+        self.events.setdefault(event['event'], []).append(event)
+
+
+def test_retries_are_timed(conf, server):
+    '''Duration and time to first byte include rate limited attempts'''
+    server.RequestHandlerClass = Limited
+    server.failures = 2
+    recorder = Recorder()
+    moo = MailCow(conf=conf, retries=2, hooks=[recorder])
+
+    assert moo.getRequest('status/version') == {'version': '2021-01'}
+    request = recorder.events['request'][-1]
+    assert request['status'] == 200
+    assert request['retries'] == 2
+    assert request['duration'] >= 2 * DELAY
+    assert request['ttfb'] >= 2 * DELAY
+
+
+def test_daemon_stats_per_call(conf):
+    '''Warm instances report scheduler statistics of the current call'''
+    recorder = Recorder()
+    clients = Clients()
+
+    instrument.subscribe(recorder)
+    try:
+        for _ in range(2):
+            moo = clients(conf=conf)
+            moo.getRequest('status/version')
+            moo.getRequest('domain/all')
+    finally:
+        instrument.unsubscribe(recorder)
+
+    requests = [event['requests'] for event in recorder.events['schedule']]
+    assert requests[-4:] == [1, 2, 1, 2]
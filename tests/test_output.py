@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of mailcow.output'''
+
+import io
+import json
+from mailcow import MailCow
+from mailcow.columns import Columns
+from mailcow.daemon import FrameWriter
+from mailcow.output import write_table
+
+RECORDS = [{'id': 1, 'address': 'info@example.org', 'active': 1},
+           {'id': 2, 'address': 'postmaster@example.org', 'active': 0}]
+
+
+def frames(stream):
+    '''Return output sent as frames to `stream`'''
+    return ''.join(json.loads(line)['out']
+                   for line in stream.getvalue().splitlines())
+
+
+def test_table_through_daemon():
+    '''Tables are written to the daemon's socket like to a file'''
+    expected, stream = io.StringIO(), io.BytesIO()
+    write_table(RECORDS, out=expected)
+    write_table(RECORDS, out=FrameWriter(stream, 'out'))
+
+    assert frames(stream) == expected.getvalue()
+    assert 'postmaster@example.org' in expected.getvalue()
+
+
+def test_vertical_table_through_daemon():
+    '''Vertical tables are written to the daemon's socket as well'''
+    stream = io.BytesIO()
+    write_table(RECORDS, out=FrameWriter(stream, 'out'), vertical=True)
+
+    assert frames(stream).count('| address |') == 2
+
+
+def test_table_without_isatty():
+    '''Outputs without isatty() are treated as files'''
+    class Output:
+        def __init__(self):
+            self.data = []
+
+        def write(self, data):
+            self.data.append(data)
+
+        def writelines(self, lines):
+            self.data.extend(lines)
+
+    out = Output()
+    write_table(RECORDS, out=out)
+
+    assert ''.join(out.data).count('\n') == 6
+
+
+def test_columns_as_table():
+    '''Columnar results are tabulated in both layouts'''
+    moo = MailCow.__new__(MailCow)
+    moo.data = Columns(RECORDS + [{'id': 3, 'quota': 10}])
+
+    table, = moo.as_table()
+    tables = moo.as_table(vertical=True)
+
+    assert table.field_names == ['id', 'address', 'active', 'quota']
+    assert len(table.rows) == 3
+    assert len(tables) == 3
+    assert [row for row in tables[2].rows if row[1] != ''] == \
+        [['id', 3], ['quota', 10]]
+    assert tables[0].rows[1] == ['address', 'info@example.org']
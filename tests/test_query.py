@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of mailcow.query'''
+
+import pytest
+from mailcow.columns import Columns
+from mailcow.query import apply_query, compile_expression, compile_where
+
+MAILBOXES = [
+    {'username': 'admin@example.org', 'domain': 'example.org',
+     'percent_in_use': '95', 'attributes': {'force_pw_update': '1'}},
+    {'username': 'info@example.org', 'domain': 'example.org',
+     'percent_in_use': 40, 'attributes': {'force_pw_update': '0'}},
+    {'username': 'sales@example.com', 'domain': 'example.com',
+     'percent_in_use': '- ', 'attributes': None},
+]
+
+
+@pytest.mark.parametrize('expression', [
+    # attributes of anything but fields
+    "''.join(['a'])",
+    "().__class__",
+    "username.__class__",
+    "attributes.__dict__",
+    "_record",
+    "_field(_record, ('username',))",
+    "__builtins__",
+    "(1).real",
+    "lower(username).__class__.__bases__",
+    # calls of anything but the whitelisted functions
+    "open('/etc/passwd')",
+    "__import__('os').system('true')",
+    "eval('1')",
+    "getattr(username, 'upper')()",
+    "lower.__call__(username)",
+    "username.upper()",
+    "match(username, pattern='^a')",
+    "match(*[username, '^a'])",
+    "(lambda: 1)()",
+    # syntax outside the whitelist
+    "username[0]",
+    "[x for x in username]",
+    "percent_in_use + 1",
+    "{'a': 1}",
+    "username if domain else domain",
+    "f'{username}'",
+])
+def test_rejected(expression):
+    '''Attribute access and calls beyond fields and helpers raise'''
+    with pytest.raises(ValueError):
+        compile_where(expression)
+    with pytest.raises(ValueError):
+        compile_expression(expression)
+
+
+def test_invalid_syntax():
+    '''Syntax errors are reported as ValueError'''
+    with pytest.raises(ValueError, match='Invalid expression'):
+        compile_where('percent_in_use >')
+
+
+@pytest.mark.parametrize('expression, usernames', [
+    ('percent_in_use > 90', ['admin']),
+    ('percent_in_use >= 40 and domain == "example.org"', ['admin', 'info']),
+    ('-percent_in_use < -50', ['admin']),
+    ('not percent_in_use < 50', ['admin', 'sales']),
+    ("attributes.force_pw_update == '1'", ['admin']),
+    ('attributes.force_pw_update is None', ['sales']),
+    ("match(username, '^(admin|sales)@')", ['admin', 'sales']),
+    ("lower(domain) in ['example.com']", ['sales']),
+    ('len(username) > 16', ['admin', 'sales']),
+    ('missing == None', ['admin', 'info', 'sales']),
+])
+def test_where(expression, usernames):
+    '''Fields are looked up and compared to numbers as numbers'''
+    predicate = compile_where(expression)
+
+    assert [mailbox['username'].split('@')[0] for mailbox in MAILBOXES
+            if predicate(mailbox)] == usernames
+
+
+def test_expression_values():
+    '''Expressions compute values, failures become None'''
+    domain = compile_expression("extract(username, '@(.*)$')")
+    number = compile_expression('int(percent_in_use)')
+
+    assert [domain(mailbox) for mailbox in MAILBOXES] == \
+        ['example.org', 'example.org', 'example.com']
+    assert [number(mailbox) for mailbox in MAILBOXES] == [95, 40, None]
+
+
+def test_apply_query():
+    '''Filter, sort and limit lists, iterables and columns alike'''
+    def names(records):
+        return [record['username'].split('@')[0] for record in records]
+
+    assert names(apply_query(MAILBOXES, sort=['percent_in_use'])) == \
+        ['info', 'admin', 'sales']
+    assert names(apply_query(
+        iter(MAILBOXES), where="domain == 'example.org'",
+        sort=['percent_in_use'], limit=1)) == ['info']
+    assert names(apply_query(MAILBOXES, limit=2)) == ['admin', 'info']
+
+    columns = apply_query(Columns(MAILBOXES), sort=['-domain', 'username'])
+    assert isinstance(columns, Columns)
+    assert names(columns) == ['admin', 'info', 'sales']
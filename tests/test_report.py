@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of mailcow.report against exact answers'''
+
+import bisect
+import collections
+import random
+import pytest
+from mailcow.report import (
+    QUANTILE_K, Frequent, Quantiles, Report, split_arguments)
+
+FRACTIONS = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99]
+
+
+def latencies(count, seed=1):
+    '''Skewed values like response times'''
+    rand = random.Random(seed)
+    return [rand.lognormvariate(0, 1.5) for _ in range(count)]
+
+
+def senders(count, seed=2):
+    '''Zipf distributed values like senders of a mail log'''
+    rand = random.Random(seed)
+    weights = [1 / rank ** 1.1 for rank in range(1, 20001)]
+    return [f'user{rank}@example.org' for rank in rand.choices(
+        range(1, 20001), weights, k=count)]
+
+
+def rank_error(values, estimate, fraction):
+    '''Return how far the rank of `estimate` is off `fraction`'''
+    low = bisect.bisect_left(values, estimate) / len(values)
+    high = bisect.bisect_right(values, estimate) / len(values)
+    if low <= fraction <= high:
+        return 0.0
+
+    return min(abs(low - fraction), abs(high - fraction))
+
+
+@pytest.mark.parametrize('count', [100, 10000, 200000])
+def test_quantiles(count):
+    '''Ranks of estimated quantiles are off by 2% at most'''
+    values = latencies(count)
+    sketch = Quantiles()
+    for value in values:
+        sketch.add(value)
+    values.sort()
+
+    for fraction in FRACTIONS:
+        assert rank_error(values, sketch.quantile(fraction),
+                          fraction) <= 0.02, fraction
+    assert sum(len(items) for items in sketch.levels) <= 4 * QUANTILE_K
+
+
+def test_quantiles_exact():
+    '''Fewer values than the sketch keeps are answered exactly'''
+    sketch = Quantiles()
+    for value in ['5', 1, 3.5, None, 'n/a', 2, 4]:
+        sketch.add(value)
+
+    assert [sketch.quantile(fraction) for fraction in [0, 0.5, 1]] == \
+        [1, 3.5, 5]
+    assert Quantiles().quantile(0.5) is None
+
+
+def test_frequent():
+    '''Top values are found and their counts are never too high'''
+    values = senders(200000)
+    exact = collections.Counter(values)
+    sketch = Frequent(1000)
+    for value in values:
+        sketch.add(value)
+    top = sketch.top(10)
+
+    assert list(top) == [value for value, _ in exact.most_common(10)]
+    for value, count in top.items():
+        assert 0.98 * exact[value] <= count <= exact[value]
+
+
+def test_frequent_exact():
+    '''Fewer distinct values than the capacity are counted exactly'''
+    values = senders(5000)
+    sketch = Frequent(100000)
+    for value in values:
+        sketch.add(value)
+
+    assert sketch.top(5) == dict(collections.Counter(values).most_common(5))
+
+
+def test_report_groups():
+    '''Exact aggregates match the values computed directly'''
+    rand = random.Random(3)
+    records = [{'domain': f'domain{rand.randrange(3)}.org',
+                'quota': rand.randrange(1000),
+                'active': rand.choice(['0', '1'])}
+               for _ in range(3000)]
+    report = Report(
+        group_by=['domain'],
+        aggregates=['count', 'share', 'sum(quota) as total', 'avg(quota)',
+                    'min(quota)', 'max(quota)', 'median(quota)'],
+        where="active == '1'")
+    rows = report.extend(iter(records)).results()
+    active = [record for record in records if record['active'] == '1']
+
+    assert len(rows) == 3
+    for row in rows:
+        quotas = sorted(record['quota'] for record in active
+                        if record['domain'] == row['domain'])
+        assert row['count'] == len(quotas)
+        assert row['share'] == pytest.approx(len(quotas) / len(active))
+        assert row['total'] == sum(quotas)
+        assert row['avg(quota)'] == pytest.approx(sum(quotas) / len(quotas))
+        assert (row['min(quota)'], row['max(quota)']) == \
+            (quotas[0], quotas[-1])
+        assert rank_error(quotas, row['median(quota)'], 0.5) <= 0.02
+
+
+def test_report_top_by_expression():
+    '''Top values of an expression are counted per group'''
+    messages = [{'program': 'postfix/smtp',
+                 'message': f'from=<{sender}> status=sent'}
+                for sender in senders(20000)]
+    report = Report(
+        group_by=['program'],
+        aggregates=["top(extract(message, 'from=<([^>]*)>'), 3) as top"])
+    top = report.extend(messages).results()[0]['top']
+    exact = collections.Counter(
+        message['message'][6:-13] for message in messages)
+
+    assert top == dict(exact.most_common(3))
+
+
+def test_report_empty():
+    '''Aggregates of nothing are reported once'''
+    assert Report(aggregates=['count', 'sum(quota)']).results() == \
+        [{'count': 0, 'sum(quota)': 0}]
+
+
+@pytest.mark.parametrize('aggregates', [
+    ['unknown(quota)'], ['sum'], ['percentile(quota)'],
+    ['percentile(quota, 101)'], ['top(quota, 0)'], ['share(quota)'],
+    ['count', 'count'],
+])
+def test_report_invalid(aggregates):
+    '''Invalid aggregates raise ValueError'''
+    with pytest.raises(ValueError):
+        Report(aggregates=aggregates)
+
+
+def test_split_arguments():
+    '''Commas in brackets and quotes don't split'''
+    assert split_arguments("extract(a, 'x,y'), 3") == \
+        ["extract(a, 'x,y')", '3']
+    assert split_arguments('') == []
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of downloading and caching the OpenApi schema'''
+
+import pytest
+from mock_server import Handler
+from mailcow import MailCow
+
+
+class Broken(Handler):
+    '''Answer schema requests with an error page'''
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path == '/api/openapi.yaml':
+            return self.reply(500, b'<html>Internal Server Error</html>',
+                              'text/html')
+        return super().do_GET()
+
+
+def test_error_is_not_cached(conf, server):
+    '''A failing download raises without creating a cache'''
+    server.RequestHandlerClass = Broken
+
+    with pytest.raises(IOError, match='status code 500'):
+        MailCow(conf=conf, retries=0)
+
+    server.RequestHandlerClass = Handler
+    moo = MailCow(conf=conf, retries=0)
+
+    assert 'mailbox' in moo.endpoints
+
+
+def test_error_keeps_stale_cache(conf, server):
+    '''Revalidation failing keeps the cached schema untouched'''
+    moo = MailCow(conf=conf)
+    cache = moo.schema_cache
+    schema = cache.schema()
+
+    server.RequestHandlerClass = Broken
+    moo = MailCow(conf=conf, retries=0, schema_ttl=0)
+
+    assert cache.schema() == schema
+    assert 'mailbox' in moo.endpoints
+
+
+def test_not_modified(conf):
+    '''A schema reported unchanged is read from cache'''
+    MailCow(conf=conf)
+    moo = MailCow(conf=conf, schema_ttl=0)
+
+    assert moo.getOpenApiSchema() == moo.schema_cache.schema()
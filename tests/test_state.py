@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of mailcow.state and `mailcow apply`'''
+
+import json
+import sys
+import pytest
+from mock_server import Handler
+from mailcow import MailCow
+from mailcow.cli import run
+from mailcow.state import apply_plan, plan_state
+from mailcow.validate import ValidationError
+
+STATE = {'domain': [
+    {'domain': 'new.example.org'},
+    {'domain': 'domain0.example.org', 'active': 'maybe'}]}
+STATE_FILE = '''\
+domain:
+  - domain: new.example.org
+  - domain: domain0.example.org
+    active: maybe
+'''
+
+
+class Recording(Handler):
+    '''Keep paths of POST requests in `server.posted`'''
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.server.posted.append(self.path)
+        return super().do_POST()
+
+
+class Current(Recording):
+    '''Answer GET of all domains with `server.current`'''
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path == '/api/v1/get/domain/all':
+            return self.reply(200, json.dumps(self.server.current).encode())
+        return super().do_GET()
+
+
+@pytest.fixture
+def recording(server):
+    '''Mock server recording changes'''
+    server.RequestHandlerClass = Recording
+    server.posted = []
+
+    return server
+
+
+def test_invalid_plan_sends_nothing(conf, recording):
+    '''An invalid edit stops the plan before the adds are sent'''
+    moo = MailCow(conf=conf)
+    plan = plan_state(moo, STATE)
+
+    assert [change['action'] for change in plan] == ['add', 'edit']
+    with pytest.raises(ValidationError, match='edit domain '
+                       'domain0.example.org: active: expected boolean'):
+        list(apply_plan(moo, plan))
+    assert recording.posted == []
+
+
+def test_valid_plan(conf, recording):
+    '''Adds and edits of a valid plan are sent'''
+    moo = MailCow(conf=conf)
+    state = {'domain': [STATE['domain'][0],
+                        dict(STATE['domain'][1], active=0)]}
+    results = list(apply_plan(moo, plan_state(moo, state)))
+
+    assert [result['action'] for result in results] == ['add', 'edit']
+    assert recording.posted == ['/api/v1/add/domain', '/api/v1/edit/domain']
+
+
+def test_apply_exits_with_message(conf, recording, tmp_path, monkeypatch,
+                                  capsys):
+    '''`mailcow apply` reports an invalid state without a traceback'''
+    state = tmp_path / 'state.yaml'
+    state.write_text(STATE_FILE)
+    monkeypatch.setattr(sys, 'argv', ['mailcow', 'apply', str(state)])
+
+    with pytest.raises(SystemExit) as exit_info:
+        run(clients=lambda **kwargs: MailCow(conf=conf, **kwargs))
+
+    assert 'active: expected boolean' in str(exit_info.value.code)
+    assert recording.posted == []
+    assert capsys.readouterr().out == ''
+
+
+@pytest.mark.parametrize('current, error', [
+    ({'type': 'error', 'msg': 'authentication failed'},
+     'authentication failed'),
+    ({}, 'unexpected response'),
+    ('<html>', 'unexpected response'),
+])
+def test_unavailable_current_state(conf, recording, current, error):
+    '''Failed requests of current objects stop planning'''
+    recording.RequestHandlerClass = Current
+    recording.current = current
+    moo = MailCow(conf=conf)
+
+    with pytest.raises(ValueError, match=f'Current domain objects '
+                       f'unavailable: .*{error}'):
+        plan_state(moo, STATE, prune=True)
+
+
+def test_records_without_key(conf, recording):
+    '''Current records without natural key are never pruned'''
+    recording.RequestHandlerClass = Current
+    recording.current = [{'domain_name': 'new.example.org'},
+                         {'description': 'no name'}]
+    moo = MailCow(conf=conf)
+    plan = plan_state(moo, {'domain': [{'domain': 'new.example.org'}]},
+                      prune=True)
+
+    assert plan == []
+
+    recording.current = {'domain_name': 'new.example.org'}
+    assert plan_state(moo, {'domain': []}, prune=True) == [dict(
+        action='delete', section='domain', key='new.example.org',
+        item='new.example.org')]
+
+
+
+def test_apply_unavailable(conf, recording, tmp_path, monkeypatch):
+    '''`mailcow apply` exits with a message if objects are unknown'''
+    recording.RequestHandlerClass = Current
+    recording.current = {'type': 'error', 'msg': 'authentication failed'}
+    state = tmp_path / 'state.yaml'
+    state.write_text(STATE_FILE)
+    monkeypatch.setattr(
+        sys, 'argv', ['mailcow', 'apply', '--prune', str(state)])
+
+    with pytest.raises(SystemExit) as exit_info:
+        run(clients=lambda **kwargs: MailCow(conf=conf, **kwargs))
+
+    assert 'authentication failed' in str(exit_info.value.code)
+    assert recording.posted == []
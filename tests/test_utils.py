@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of decoding and splitting responses in mailcow.utils'''
+
+import json
+import pytest
+from mailcow.utils import _json_elements, iter_json, split_response
+
+DOCUMENTS = [
+    '[]',
+    '  [ ]  \n',
+    '[1, 2.5, -3e2, true, false, null]',
+    '[{"msg": "a ] b , c [ {"}, "}", "\\"]\\""]',
+    '[{"path": "C:\\\\", "quote": "\\\\\\"", "nl": "a\\nb"}]',
+    '["\\u00fcber", "\\ud83d\\ude00", "caf\u00e9 \u20ac \U0001f600"]',
+    '[[1, [2, [3]]], {"a": {"b": [4, {"c": 5}]}}]\r\n\t ',
+    '{"type": "success", "msg": ["mailbox_added", "info"]}\n',
+    '"only a string"',
+    '12345',
+    'null',
+    ' \n {"nested": [1, 2, {"x": "]"}]}  \n\n',
+]
+
+
+def chunks(data, size):
+    '''Split bytes `data` into chunks of `size` bytes'''
+    return [data[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+def expected(document):
+    '''Return what iter_json should yield for `document`'''
+    value = json.loads(document)
+    return value if document.lstrip().startswith('[') else [value]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64, 1 << 20])
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_iter_json_chunked(document, size):
+    '''Any chunking decodes like json.loads'''
+    data = document.encode()
+
+    assert list(iter_json(chunks(data, size))) == expected(document)
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_iter_json_every_split(document):
+    '''Splitting anywhere, ie. in escapes or characters, is harmless'''
+    data = document.encode()
+
+    for pos in range(len(data) + 1):
+        assert list(iter_json([data[:pos], data[pos:]])) == \
+            expected(document), pos
+
+
+def test_iter_json_empty():
+    '''Empty bodies yield nothing'''
+    assert list(iter_json([])) == []
+    assert list(iter_json([b'', b'  \n', b''])) == []
+
+
+def test_iter_json_yields_early():
+    '''Elements are yielded before the array is complete'''
+    def stream():
+        yield b'[{"id": 1}, {"id'
+        yield b'": 2}, '
+        raise AssertionError('read too far')
+
+    elements = iter_json(stream())
+
+    assert next(elements) == {'id': 1}
+    assert next(elements) == {'id': 2}
+
+
+def test_iter_json_stops_at_end_of_array():
+    '''Data after the closing bracket isn't read'''
+    assert list(iter_json([b'[1, 2]', b' garbage'])) == [1, 2]
+
+
+def test_json_elements_rest():
+    '''Incomplete elements and numbers are kept for the next chunk'''
+    decoder = json.JSONDecoder()
+
+    assert _json_elements('{"a": 1}, {"b"', decoder) == \
+        ([{'a': 1}], '{"b"', False)
+    assert _json_elements('1, 23', decoder) == ([1], '23', False)
+    assert _json_elements('1, 23', decoder, final=True) == \
+        ([1, 23], '', False)
+    assert _json_elements(' 4 ]', decoder) == ([4], '', True)
+
+
+def test_split_response_per_item():
+    '''One message per item is mapped in order'''
+    response = [{'type': 'success', 'msg': ['alias_removed', '1']},
+                {'type': 'danger', 'msg': ['access_denied', '2']}]
+
+    assert list(split_response(['1', '2'], response)) == [
+        {'item': '1', 'type': 'success', 'msg': ['alias_removed', '1']},
+        {'item': '2', 'type': 'danger', 'msg': ['access_denied', '2']}]
+
+
+def test_split_response_shared():
+    '''Other answers are shared with the worst type'''
+    response = [{'type': 'success', 'msg': 'a'},
+                {'type': 'error', 'msg': 'b'},
+                {'type': 'success', 'msg': 'c'}]
+
+    assert list(split_response(['1', '2'], response)) == [
+        {'item': item, 'type': 'error', 'msg': ['a', 'b', 'c']}
+        for item in ['1', '2']]
+
+
+def test_split_response_failures():
+    '''Exceptions and bodies that aren't JSON become errors'''
+    assert list(split_response(['1'], IOError('timeout'))) == [
+        {'item': '1', 'type': 'error', 'msg': 'timeout'}]
+    assert list(split_response(['1'], b'<html>\xff</html>')) == [
+        {'item': '1', 'type': 'error', 'msg': '<html>\ufffd</html>'}]
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2021 Jean-Denis Gebhardt <projects@der-jd.de>
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''Tests of mailcow.validate'''
+
+import io
+from os import path
+import pytest
+import yaml
+from mailcow.utils import getOpenApiEndpoints
+from mailcow.validate import (
+    ValidationError, Validators, check_items, compile_validator)
+
+SCHEMA = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                   'benchmarks', 'data', 'openapi.yaml')
+
+
+@pytest.fixture(scope='module')
+def validators():
+    '''Validators of the endpoints in the benchmark schema'''
+    with open(SCHEMA) as schema:
+        return Validators(getOpenApiEndpoints(yaml.safe_load(schema)))
+
+
+@pytest.mark.parametrize('section, modifier, payload', [
+    ('domain', 'add', {'domain': 'example.org', 'active': 1,
+                       'aliases': '400', 'quota': 10240, 'tags': ['a']}),
+    ('domain', 'add', {'domain': 'example.org', 'active': 'true',
+                       'backupmx': False, 'tags': 'a,b'}),
+    ('mailbox', 'add', {'local_part': 'info', 'domain': 'example.org',
+                        'password': 'x', 'password2': 'x', 'quota': 3072,
+                        'force_pw_update': '0', 'tls_enforce_in': True}),
+    ('alias', 'add', {'address': 'a@example.org', 'goto': 'b@example.org',
+                      'goto_null': 0, 'sogo_visible': '1'}),
+    ('alias', 'edit', {'active': 0}),
+    ('dkim', 'add', {'domains': 'example.org', 'dkim_selector': 'dkim',
+                     'key_size': '2048'}),
+    ('app-passwd', 'add', {'username': 'info@example.org',
+                           'protocols': ['imap_access', 'smtp_access']}),
+    # unknown fields and endpoints are passed on
+    ('domain', 'add', {'domain': 'example.org', 'undocumented': [1]}),
+    ('unknown-section', 'add', {'active': 'maybe'}),
+    ('transport/all', 'add', {'destination': 'example.org'}),
+])
+def test_accepted(validators, section, modifier, payload):
+    '''Payloads as mailcow reads them are accepted'''
+    assert validators.errors(section, modifier, payload) == []
+    validators.check(section, modifier, payload)
+
+
+@pytest.mark.parametrize('section, modifier, payload, error', [
+    ('domain', 'add', {'domain': 'example.org', 'active': 'maybe'},
+     'active: expected boolean, got "maybe"'),
+    ('domain', 'add', {'domain': 'example.org', 'quota': '10G'},
+     'quota: expected number, got "10G"'),
+    ('domain', 'add', {'domain': ['example.org']},
+     'domain: expected string, got ["example.org"]'),
+    ('domain', 'edit', {'tags': {'a': 1}},
+     'tags: expected array, got {"a": 1}'),
+    ('mailbox', 'add', {'local_part': 'info', 'active': 2},
+     'active: expected boolean, got 2'),
+    ('mailbox', 'edit', {'sogo_access': 'yes'},
+     'sogo_access: expected boolean, got "yes"'),
+    ('alias', 'add', {'address': True},
+     'address: expected string, got true'),
+    ('dkim', 'add', {'key_size': None, 'domains': 1.5, 'dkim_selector': {}},
+     'dkim_selector: expected string, got {}'),
+    ('domain', 'add', ['example.org'], 'expected an object, got list'),
+])
+def test_rejected(validators, section, modifier, payload, error):
+    '''Payloads mailcow would reject are reported with their field'''
+    assert validators.errors(section, modifier, payload) == [error]
+    with pytest.raises(ValidationError, match=f'{modifier}/{section}'):
+        validators.check(section, modifier, payload)
+
+
+PROPERTIES = {
+    'domain': {'type': 'string', 'format': 'hostname', 'required': True},
+    'goto': {'type': 'string', 'format': 'email'},
+    'kind': {'type': 'string', 'enum': ['local', 'relay']},
+    'protocols': {'type': 'array',
+                  'items': {'enum': ['imap_access', 'pop3_access']}},
+    'ip': {'type': 'string', 'format': 'ipv4'},
+    'since': {'type': 'string', 'format': 'date-time'},
+    'url': {'type': 'string', 'format': 'uri'},
+}
+
+
+@pytest.mark.parametrize('payload, errors', [
+    ({'domain': 'example.org', 'goto': 'a@example.org', 'kind': 'relay',
+      'protocols': ['imap_access'], 'ip': '10.0.0.0/8',
+      'since': '2021-06-01T12:00:00Z', 'url': 'https://example.org'}, []),
+    ({}, ['domain: missing']),
+    ({'domain': ''}, ['domain: missing']),
+    ({'domain': '-example.org'},
+     ["domain: '-example.org' is not a valid hostname"]),
+    ({'domain': 'example.org', 'goto': 'nobody'},
+     ["goto: 'nobody' is not a valid email"]),
+    ({'domain': 'example.org', 'kind': 'remote'},
+     ["kind: 'remote' is not one of local, relay"]),
+    ({'domain': 'example.org', 'protocols': ['imap_access', 'ftp']},
+     ["protocols: 'ftp' is not one of imap_access, pop3_access"]),
+    ({'domain': 'example.org', 'ip': '::1'},
+     ["ip: '::1' is not a valid ipv4"]),
+    ({'domain': 'example.org', 'since': 'yesterday'},
+     ["since: 'yesterday' is not a valid date-time"]),
+    ({'domain': 'example.org', 'url': 'example.org'},
+     ["url: 'example.org' is not a valid uri"]),
+])
+def test_enums_and_formats(payload, errors):
+    '''Required fields, enums and formats are checked'''
+    assert compile_validator(PROPERTIES)(payload) == errors
+
+
+def test_edit_is_partial():
+    '''Required fields may be missing from edits'''
+    assert compile_validator(PROPERTIES, partial=True)({}) == []
+
+
+def test_check_items(validators):
+    '''Invalid lines are reported with their number, nothing else'''
+    stream = io.StringIO(
+        '# comment\n'
+        '{"domain": "a.org", "active": 1}\n'
+        '\n'
+        '{"domain": "b.org", "quota": "lots"}\n'
+        '{"domain": \n')
+    invalid = list(check_items(
+        validators, 'domain', 'add', stream, {'active': 0}))
+
+    assert [entry['line'] for entry in invalid] == [4, 5]
+    assert invalid[0]['msg'] == ['quota: expected number, got "lots"']
+    assert invalid[1]['msg'][0].startswith('invalid JSON')
+
+
+def test_check_items_edit(validators):
+    '''Attributes of an edit are checked once'''
+    invalid = list(check_items(
+        validators, 'alias', 'edit', io.StringIO('1\n2\n'),
+        {'active': 'maybe'}))
+
+    assert invalid == [dict(line=None, item=None, type='error',
+                            msg=['active: expected boolean, got "maybe"'])]